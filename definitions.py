@@ -9,3 +9,17 @@ if 'WM_ENV' in os.environ:
     config = 'config.%s.ini' % os.environ['WM_ENV'].lower()
 else:
     config = 'config.dev.ini'
+
+# market data refresh mode: 'incremental' - tables extended by missing days, 'full' - materialized views rebuilt
+MD_REFRESH = os.environ.get('WM_MD_REFRESH', 'incremental').lower()
+# number of the last filled days the incremental refresh builds again, prices and rates that arrive or are corrected
+# earlier than that are never picked up by it: WM_MD_REFRESH=full rebuilds the whole history after such corrections
+MD_REFRESH_OVERLAP = int(os.environ.get('WM_MD_REFRESH_OVERLAP', 7))
+# forward fill of market data and fx rates: 'window' - running max of price dates, 'recursive' - day by day
+MD_GAP_FILL = os.environ.get('WM_MD_GAP_FILL', 'window').lower()
+# disk cache of PnL inputs shared by joblib workers, empty value keeps the cache in memory only
+PNL_CACHE_DIR = os.environ.get('WM_PNL_CACHE', os.path.join(ROOT_DIR, '.pnl_cache'))
+# PnL of periods: 'workers' - chunks of periods in a pool of processes, 'vectorized' - all periods in this process
+PNL_MODE = os.environ.get('WM_PNL_MODE', 'workers').lower()
+# upper limit of PnL worker processes, 0 - by CPU cores and DB connections
+PNL_WORKERS = int(os.environ.get('WM_PNL_WORKERS', 0))
@@ -0,0 +1,165 @@
+from collections import defaultdict
+
+
+def value_sum(values):
+    # as SQL SUM: values without position are skipped, None if there is nothing to sum
+    values = [value for value in values if value is not None]
+
+    return sum(values) if values else None
+
+
+def percentage_order(row):
+    # percentage DESC NULLS LAST
+    return (row['percentage'] is None, -row['percentage'] if row['percentage'] is not None else 0)
+
+
+def class_order(row):
+    # asset class name, NULLS LAST
+    return (row['asset_class'] is None, row['asset_class'] or '')
+
+
+class Allocations(object):
+
+    # this class breaks down valued holdings of a portfolio by instrument attributes, holdings are read once per date
+    def __init__(self, holdings, custodians=None):
+        """
+        :param holdings: rows of instruments with 'value' in portfolio currency (None without position) and attributes
+        :param custodians: function returning rows of custodian_id, custodian and value, called at the first use
+        """
+        self.holdings = holdings
+        self.load_custodians = custodians
+        self.results = dict()
+
+    @staticmethod
+    def breakdown(rows, columns, group, within=lambda row: None):
+        """
+        :param rows: holdings to break down
+        :param columns: {column name: function returning the column of a holding}
+        :param group: function returning the partition of a holding, the percentage is taken of its value
+        :param within: function returning the partition the percentage is calculated of, the whole rows if not specified
+        :return: distinct rows of the columns and 'percentage'
+        """
+        values, totals = defaultdict(list), defaultdict(list)
+        for row in rows:
+            values[group(row)].append(row['value'])
+            totals[within(row)].append(row['value'])
+        sums = {key: value_sum(group_values) for key, group_values in values.items()}
+        total_sums = {key: value_sum(total_values) for key, total_values in totals.items()}
+
+        shares = dict()
+        for row in rows:
+            value, total = sums[group(row)], total_sums[within(row)]
+            # the share of a partition without value is None, as division by NULL or NULLIF(0)
+            percentage = value * 100 / total if value is not None and total else None
+            key = tuple(column(row) for column in columns.values()) + (percentage,)
+            shares[key] = dict(zip(list(columns) + ['percentage'], key))
+
+        return list(shares.values())
+
+    def memo(self, name, calculate):
+        if name not in self.results:
+            self.results[name] = calculate()
+        return self.results[name]
+
+    def by_class(self, name, columns, group, within, rows=None):
+        """
+        :return: breakdown within asset classes ordered by class name and percentage
+        """
+        def calculate():
+            shares = self.breakdown(self.holdings if rows is None else rows, columns, group, within)
+            return sorted(sorted(shares, key=percentage_order), key=class_order)
+
+        return self.memo(name, calculate)
+
+    def by_portfolio(self, name, columns, group, rows=None):
+        """
+        :return: breakdown of the portfolio ordered by percentage
+        """
+        def calculate():
+            return sorted(self.breakdown(self.holdings if rows is None else rows, columns, group), key=percentage_order)
+
+        return self.memo(name, calculate)
+
+    @staticmethod
+    def of_class(shares, column, asset_class):
+        """
+        :return: {column value: percentage} of the asset class, empty shares are skipped
+        """
+        return {row[column]: row['percentage'] for row in shares
+                if row['percentage'] and row['asset_class'] == asset_class}
+
+    def currency(self):
+        shares = self.by_portfolio('currency', {'currency': lambda r: r['currency']}, lambda r: r['currency'])
+
+        return {row['currency']: row['percentage'] for row in shares if row['percentage'] != 0}
+
+    def region(self):
+        shares = self.by_portfolio('region', {'region': lambda r: r['region']}, lambda r: r['geo_region_id'],
+                                   rows=[row for row in self.holdings if row['region_id'] is not None])
+
+        return {row['region']: row['percentage'] for row in shares if row['percentage'] != 0}
+
+    def asset_classes(self):
+        shares = self.by_portfolio('asset_classes', {'asset_class': lambda r: r['asset_class']},
+                                   lambda r: r['asset_class_id'],
+                                   rows=[row for row in self.holdings if row['asset_class'] is not None])
+
+        return {row['asset_class']: row['percentage'] for row in shares}
+
+    def custodian(self):
+        shares = self.by_portfolio('custodian', {'custodian': lambda r: r['custodian']}, lambda r: r['custodian_id'],
+                                   rows=self.memo('custodians', self.load_custodians))
+
+        return {row['custodian']: row['percentage'] for row in shares}
+
+    def subclass(self, asset_class=None):
+        shares = self.by_class('subclass', {'asset_class': lambda r: r['asset_class'], 'subclass': lambda r: r['asset_subclass']},
+                               lambda r: r['asset_subclass_id'], lambda r: r['asset_class_id'],
+                               rows=[row for row in self.holdings
+                                     if row['asset_class'] is not None and row['asset_subclass'] is not None])
+
+        return self.of_class(shares, 'subclass', asset_class) if asset_class else shares
+
+    def asset_region(self, asset_class=None):
+        # an instrument is in the breakdown of its class and of its subclass
+        rows = [dict(row, asset_class=name) for row in self.holdings for name in row['class_names']]
+        shares = self.by_class('asset_region', {'asset_class': lambda r: r['asset_class'], 'region': lambda r: r['region']},
+                               lambda r: (r['asset_class'], r['geo_region_id']), lambda r: r['asset_class'], rows=rows)
+
+        return self.of_class(shares, 'region', asset_class) if asset_class else shares
+
+    def asset_currency(self, asset_class=None):
+        shares = self.by_class('asset_currency', {'asset_class': lambda r: r['asset_class'], 'currency': lambda r: r['currency']},
+                               lambda r: (r['asset_class_id'], r['currency']), lambda r: r['asset_class_id'])
+
+        return self.of_class(shares, 'currency', asset_class) if asset_class else shares
+
+    def industry(self, asset_class=None):
+        industry_sector = (lambda r: 'Unknown' if r['industry_sector'] is None else r['industry_sector'])
+        shares = self.by_class('industry', {'asset_class': lambda r: r['asset_class'], 'industry_sector': industry_sector},
+                               lambda r: (r['asset_class_id'], r['industry_sector']), lambda r: r['asset_class_id'])
+        if not asset_class:
+            return shares
+
+        # sectors without name are unknown as well
+        return {[sector, 'Unknown'][sector == '']: percentage
+                for sector, percentage in self.of_class(shares, 'industry_sector', asset_class).items()}
+
+    def credit(self, asset_class=None):
+        shares = self.by_class('credit', {'asset_class': lambda r: r['asset_class'], 'rating': lambda r: r['rating']},
+                               lambda r: (r['asset_class_id'], r['credit_rating']), lambda r: r['asset_class_id'])
+
+        return self.of_class(shares, 'rating', asset_class) if asset_class else shares
+
+    def breakdowns(self, asset_class=None):
+        """
+        :param asset_class: name of asset class to break down, the whole portfolio if not specified
+        :return: {dimension: breakdown}
+        """
+        if asset_class:
+            return {'subclass': self.subclass(asset_class), 'region': self.asset_region(asset_class),
+                    'currency': self.asset_currency(asset_class), 'industry': self.industry(asset_class),
+                    'credit': self.credit(asset_class)}
+
+        return {'asset_classes': self.asset_classes(), 'region': self.region(), 'currency': self.currency(),
+                'custodian': self.custodian()}
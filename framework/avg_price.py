@@ -0,0 +1,58 @@
+from bisect import bisect_right
+from collections import defaultdict
+
+
+class AvgPrice(object):
+
+    # this class calculates moving average cost of instruments in one pass over the trades ordered by time
+    def __init__(self):
+        self.position = dict()
+        self.avg = dict()
+        self.dates = defaultdict(list)
+        self.prices = defaultdict(list)
+
+    def add(self, instrument, trade_date, quantity, price):
+        """
+        :param instrument: instrument name, trades of one instrument must come in time order
+        :param trade_date: date of the trade
+        :param quantity: signed quantity, negative for Sell trades
+        :param price: trade price
+        :return: average price after the trade
+        """
+        if instrument not in self.avg:
+            # the first trade sets the price
+            position, avg = quantity, price
+        else:
+            position = self.position[instrument] + quantity
+            # the price changes only if the trade increases long or short position
+            if (position > 0 and quantity > 0) or (position < 0 and quantity < 0):
+                avg = (quantity * price + self.position[instrument] * self.avg[instrument]) / position
+            else:
+                avg = self.avg[instrument]
+        self.position[instrument], self.avg[instrument] = position, avg
+
+        # several trades per day leave the price after the last one
+        dates, prices = self.dates[instrument], self.prices[instrument]
+        if dates and dates[-1] == trade_date:
+            prices[-1] = avg
+        else:
+            dates.append(trade_date)
+            prices.append(avg)
+
+        return avg
+
+    def at(self, instrument, price_date):
+        """
+        :param instrument: instrument name
+        :param price_date: date
+        :return: average price after the last trade done till the date, 0 before the first trade
+        """
+        idx = bisect_right(self.dates[instrument], price_date)
+
+        return self.prices[instrument][idx - 1] if idx else 0.0
+
+    def series(self):
+        """
+        :return: {instrument: {trade date: average price}}
+        """
+        return {instr: dict(zip(dates, self.prices[instr])) for instr, dates in self.dates.items()}
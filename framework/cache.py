@@ -0,0 +1,42 @@
+import threading
+
+
+class ReferenceCache(object):
+
+    # this class keeps results of reference lookups which do not change during the test session
+    def __init__(self):
+        self.values = dict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, load):
+        """
+        :param key: name of the cached lookup
+        :param load: function without arguments to call if the key is not cached yet
+        :return: cached value
+        """
+        with self.lock:
+            if key in self.values:
+                self.hits += 1
+                return self.values[key]
+            self.misses += 1
+
+        value = load()
+        with self.lock:
+            self.values[key] = value
+
+        return value
+
+    def invalidate(self, *keys):
+        """
+        :param keys: names of lookups to drop, all of them if nothing is specified
+        :return: None
+        """
+        with self.lock:
+            for key in keys or list(self.values):
+                self.values.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'keys': sorted(self.values)}
@@ -1,8 +1,29 @@
+import csv
+import io
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
 import psycopg2
-from psycopg2 import extras
+from psycopg2 import extensions, extras
 
 from framework.configread import ReadConfig
 
+# time spent by the current process on handshakes vs queries
+db_timings = {'connects': 0, 'connect_time': 0.0, 'queries': 0, 'query_time': 0.0}
+# parsed 'PostgreDB' sections by config name, the ini file is read once per process
+_db_configs = dict()
+# connection pools by config name, see db_pool()
+_db_pools = dict()
+# names of server-side cursors
+_cursor_ids = itertools.count()
+# dtypes of numpy arrays by Postgres type oid, other types are kept as objects
+column_dtypes = {16: bool, 20: float, 21: float, 23: float, 700: float, 701: float, 1700: float,
+                 1082: 'datetime64[D]', 1114: 'datetime64[us]'}
+
 
 class DbPostgres:
 
@@ -18,15 +39,18 @@ class DbPostgres:
         self.user = db_connection['user']
         self.password = db_connection['password']
 
+        # the process that owns the socket, forked children must not close it
+        self.pid = os.getpid()
         self.connection = self.db_connect()
         self.cursor = self.connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        # names of statements prepared in the session of the connection
+        self.prepared = set()
 
     def read_db_configuration(self):
-        env_config = ReadConfig(self.config)
-        db_connection = env_config.section('PostgreDB')
-        return db_connection
+        return db_config(self.config)
 
     def db_connect(self):
+        started = time.perf_counter()
         connection = psycopg2.connect(
             host=self.host,
             port=self.port,
@@ -36,6 +60,8 @@ class DbPostgres:
         )
 
         connection.autocommit = False
+        db_timings['connects'] += 1
+        db_timings['connect_time'] += time.perf_counter() - started
 
         return connection
 
@@ -47,19 +73,277 @@ class DbPostgres:
         :return: result for 'select'
         """
 
+        started = time.perf_counter()
         try:
-            self.cursor.execute(sql)
+            try:
+                self.cursor.execute(sql)
+            except Exception as e:
+                self.connection.rollback()
+                raise e
+
+            if sql.lower().startswith('select') or sql.lower().startswith('with'):
+                res = self.cursor.fetchall()
+            else:
+                res = self.cursor.rowcount
+                self.connection.commit()
+        finally:
+            db_timings['queries'] += 1
+            db_timings['query_time'] += time.perf_counter() - started
+
+        return res
+
+    def execute_prepared(self, name, sql, params):
+        """
+        this function executes 'select' by the statement prepared on the connection, it is prepared at the first call
+        :param name: statement name
+        :param sql: 'select' with $1, $2... parameters
+        :param params: values of the parameters
+        :return: (rows, True if the statement had been prepared before)
+        """
+        hit = name in self.prepared
+        prepare = 'PREPARE %s AS %s' % (name, sql)
+        execute = 'EXECUTE %s (%s)' % (name, ', '.join(['%s'] * len(params)))
+        started = time.perf_counter()
+        try:
+            try:
+                if not hit:
+                    self.cursor.execute(prepare)
+                    self.prepared.add(name)
+                self.cursor.execute(execute, params)
+            except psycopg2.Error as e:
+                self.connection.rollback()
+                if e.pgcode != '26000' or not hit:
+                    raise e
+                # the session lost the statement, it is prepared again once, still one query
+                self.prepared.discard(name)
+                hit = False
+                try:
+                    self.cursor.execute(prepare)
+                    self.prepared.add(name)
+                    self.cursor.execute(execute, params)
+                except psycopg2.Error:
+                    self.connection.rollback()
+                    raise
+            res = self.cursor.fetchall()
+        finally:
+            db_timings['queries'] += 1
+            db_timings['query_time'] += time.perf_counter() - started
+
+        return res, hit
+
+    def batches(self, sql, itersize=2000, row_format='dict'):
+        """
+        this function executes 'select' with a server-side cursor, rows are fetched from the server by itersize
+        :param sql: request to execute
+        :param itersize: number of rows kept in memory
+        :param row_format: 'dict' - RealDictRow, 'tuple' - plain tuple, 'columns' - {column: [values]} per itersize rows
+        :return: generator of lists of rows or column batches, every list is one fetch from the server
+        """
+        # tuples and columns do not keep column names in every row
+        cursor_factory = psycopg2.extras.RealDictCursor if row_format == 'dict' else None
+        cursor = self.connection.cursor(name='stream_%s' % next(_cursor_ids), cursor_factory=cursor_factory)
+        started = time.perf_counter()
+        try:
+            try:
+                cursor.execute(sql)
+            finally:
+                db_timings['queries'] += 1
+                db_timings['query_time'] += time.perf_counter() - started
+            rows = cursor.fetchmany(itersize)
+            names = [column.name for column in cursor.description or list()]
+            while rows:
+                yield [dict(zip(names, map(list, zip(*rows))))] if row_format == 'columns' else rows
+                rows = cursor.fetchmany(itersize)
         except Exception as e:
             self.connection.rollback()
             raise e
+        finally:
+            # the cursor is gone already if the transaction has been rolled back
+            try:
+                cursor.close()
+            except psycopg2.Error:
+                pass
 
-        if sql.lower().startswith('select') or sql.lower().startswith('with'):
-            res = self.cursor.fetchall()
+    def stream(self, sql, itersize=2000, row_format='dict'):
+        """
+        this function executes 'select' with a server-side cursor, see batches()
+        :return: generator of rows or column batches
+        """
+        for batch in self.batches(sql, itersize, row_format):
+            for row in batch:
+                yield row
+
+    def columns(self, sql, method='cursor', itersize=10000):
+        """
+        this function executes 'select' and returns the result by columns
+        :param sql: request to execute, without ';'
+        :param method: 'cursor' - rows read by server-side cursor, 'copy' - COPY ... TO STDOUT in CSV format
+        :param itersize: number of rows fetched at once by 'cursor' method
+        :return: {column name: numpy array}, numbers are float, dates are datetime64, NULL is nan or NaT
+        """
+        # column types are taken from the empty result of the query
+        types_cursor = self.connection.cursor()
+        types_cursor.execute('SELECT * FROM (%s) q LIMIT 0' % sql)
+        types = [(column.name, column.type_code) for column in types_cursor.description]
+        types_cursor.close()
+
+        values = {name: list() for name, _ in types}
+        if method == 'copy':
+            started = time.perf_counter()
+            buffer = io.StringIO()
+            with self.connection.cursor() as cursor:
+                cursor.copy_expert('COPY (%s) TO STDOUT WITH CSV' % sql, buffer)
+            db_timings['queries'] += 1
+            db_timings['query_time'] += time.perf_counter() - started
+            buffer.seek(0)
+            for row in csv.reader(buffer):
+                for (name, _), value in zip(types, row):
+                    values[name].append(value if value != '' else None)
         else:
-            res = self.cursor.rowcount
-            self.connection.commit()
+            for batch in self.stream(sql, itersize, row_format='columns'):
+                for name, _ in types:
+                    values[name].extend(batch[name])
+        self.connection.rollback()
 
-        return res
+        return {name: column_array(values[name], type_code, from_text=method == 'copy') for name, type_code in types}
+
+    def close(self):
+        # the connection inherited from a parent process is left to the parent
+        if self.pid == os.getpid() and not self.connection.closed:
+            self.connection.close()
 
     def __del__(self):
-        self.connection.close()
+        if hasattr(self, 'connection'):
+            self.close()
+
+
+class DbPool:
+
+    # this class keeps DbPostgres connectors open between queries of the same process
+    def __init__(self, config_name=None, max_idle=4):
+
+        self.config = config_name
+        self.max_idle = max_idle
+        self.pid = os.getpid()
+        self.idle = list()
+        self.lock = threading.Lock()
+
+    def borrow(self):
+        """
+        :return: idle connector or the new one if all of them are in use
+        """
+        self.check_fork()
+        with self.lock:
+            connector = self.idle.pop() if self.idle else None
+
+        return connector or DbPostgres(self.config)
+
+    def give_back(self, connector):
+        """
+        :param connector: connector received from borrow()
+        :return: None
+        """
+        self.check_fork()
+        status = extensions.TRANSACTION_STATUS_UNKNOWN
+        if connector.pid == self.pid and not connector.connection.closed:
+            status = connector.connection.get_transaction_status()
+
+        # finish the read transaction opened by 'select' so no locks are kept by idle connections
+        if status in [extensions.TRANSACTION_STATUS_INTRANS, extensions.TRANSACTION_STATUS_INERROR]:
+            try:
+                connector.connection.rollback()
+                status = extensions.TRANSACTION_STATUS_IDLE
+            except psycopg2.Error:
+                status = extensions.TRANSACTION_STATUS_UNKNOWN
+
+        with self.lock:
+            if status == extensions.TRANSACTION_STATUS_IDLE and len(self.idle) < self.max_idle:
+                self.idle.append(connector)
+                return
+
+        connector.close()
+
+    @contextmanager
+    def connector(self):
+        connector = self.borrow()
+        try:
+            yield connector
+        finally:
+            self.give_back(connector)
+
+    def check_fork(self):
+        # connections inherited by a forked worker are the parent's sockets: forget them, never close
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.idle = list()
+            self.lock = threading.Lock()
+
+    def close_all(self):
+        self.check_fork()
+        with self.lock:
+            idle, self.idle = self.idle, list()
+        for connector in idle:
+            connector.close()
+
+
+def column_array(values, type_code, from_text=False):
+    """
+    :param values: list of column values, None for NULL
+    :param type_code: Postgres type oid of the column
+    :param from_text: True if the values are CSV strings
+    :return: numpy array
+    """
+    dtype = column_dtypes.get(type_code, object)
+    if dtype is object:
+        return np.array(values, dtype=object)
+    if dtype is bool:
+        if from_text:
+            values = [None if v is None else v == 't' for v in values]
+        # NULL is not a boolean, such columns stay objects
+        return np.array(values, dtype=bool if None not in values else object)
+    if dtype is float:
+        return np.array([np.nan if v is None else float(v) for v in values], dtype=float)
+
+    return np.array(['NaT' if v is None else str(v) for v in values], dtype=dtype)
+
+
+def db_config(config_name=None):
+    """
+    :param config_name: name of config file
+    :return: 'PostgreDB' section of the config
+    """
+    if config_name not in _db_configs:
+        env_config = ReadConfig(config_name)
+        _db_configs[config_name] = dict(env_config.section('PostgreDB'))
+
+    return _db_configs[config_name]
+
+
+def db_max_connections(config_name=None):
+    """
+    :param config_name: name of config file
+    :return: number of connections the tests may open, optional 'max_connections' of 'PostgreDB' section
+    """
+    return int(db_config(config_name).get('max_connections', 20))
+
+
+def db_pool(config_name=None):
+    """
+    :param config_name: name of config file
+    :return: process-wide connection pool for the config
+    """
+    if config_name not in _db_pools:
+        _db_pools[config_name] = DbPool(config_name)
+
+    return _db_pools[config_name]
+
+
+def db_stats():
+    """
+    :return: connect and query counters of the current process
+    """
+    stats = dict(db_timings)
+    total = stats['connect_time'] + stats['query_time']
+    stats['connect_share'] = stats['connect_time'] / total if total else 0.0
+
+    return stats
@@ -0,0 +1,52 @@
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime, time
+
+
+def to_timestamp(value):
+    # a date means its midnight, as Postgres compares dates with rate timestamps
+    return value if isinstance(value, datetime) else datetime.combine(value, time())
+
+
+class FxRates(object):
+
+    # this class resolves exchange rates as of a date, a rate is valid till the next rate of the currency pair
+    def __init__(self):
+        self.timestamps = defaultdict(list)
+        self.rates = defaultdict(list)
+        self.resolved = dict()
+
+    def add(self, from_currency, to_currency, rate_timestamp, rate):
+        """
+        :param from_currency: portfolio currency
+        :param to_currency: instrument currency
+        :param rate_timestamp: date or timestamp of the rate, rates of one pair must come in time order
+        :param rate: rate value
+        :return: None
+        """
+        timestamps, rates = self.timestamps[(from_currency, to_currency)], self.rates[(from_currency, to_currency)]
+        rate_timestamp = to_timestamp(rate_timestamp)
+        if timestamps and timestamps[-1] == rate_timestamp:
+            rates[-1] = rate
+        else:
+            timestamps.append(rate_timestamp)
+            rates.append(rate)
+        self.resolved.clear()
+
+    def at(self, from_currency, to_currency, rate_date):
+        """
+        :param from_currency: portfolio currency
+        :param to_currency: instrument currency
+        :param rate_date: date or timestamp
+        :return: the latest rate till the date, 1 for the same currency, None before the first rate
+        """
+        if from_currency == to_currency:
+            return 1
+        # every (pair, date) is looked up once
+        key = (from_currency, to_currency, rate_date)
+        if key not in self.resolved:
+            timestamps = self.timestamps.get((from_currency, to_currency), list())
+            idx = bisect_right(timestamps, to_timestamp(rate_date))
+            self.resolved[key] = self.rates[(from_currency, to_currency)][idx - 1] if idx else None
+
+        return self.resolved[key]
@@ -0,0 +1,69 @@
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+
+
+class Pager(object):
+
+    # this class reads a paginated API list as a stream, the next pages are requested while the current one is read
+    def __init__(self, request, url_param, body, size=500, prefetch=4):
+        """
+        :param request: Request object
+        :param url_param: API method returning {'content': [...], 'last': bool}
+        :param body: request body without 'page' and 'size'
+        :param size: number of items per page
+        :param prefetch: number of pages requested concurrently, 1 - one page after another
+        """
+        self.request = request
+        self.url_param = url_param
+        self.body = body
+        self.size = size
+        self.prefetch = max(1, prefetch)
+        self.pages = 0
+
+    def page(self, number):
+        body = dict(self.body, page=number, size=self.size)
+        self.pages += 1
+
+        return self.request.post(json.dumps(body), url_param=self.url_param)
+
+    def __iter__(self):
+        # at most prefetch pages are kept in memory
+        with ThreadPoolExecutor(max_workers=self.prefetch) as executor:
+            window = deque(executor.submit(self.page, n) for n in range(self.prefetch))
+            number = self.prefetch
+            while window:
+                api_data = window.popleft().result()
+                content = api_data['content']
+                for item in content:
+                    yield item
+                if api_data.get('last', len(content) < self.size) or not content:
+                    for future in window:
+                        future.cancel()
+                    break
+                window.append(executor.submit(self.page, number))
+                number += 1
+
+
+def merge_groups(left, right, left_key, right_key):
+    """
+    :param left: iterable ordered by left_key
+    :param right: iterable ordered by right_key
+    :param left_key: function returning the key of left item
+    :param right_key: function returning the key of right item, comparable with left keys
+    :return: generator of (key, left items, right items) in key order, only one group is kept in memory
+    """
+    left_groups, right_groups = groupby(left, key=left_key), groupby(right, key=right_key)
+    left_group, right_group = next(left_groups, None), next(right_groups, None)
+
+    while left_group is not None or right_group is not None:
+        if right_group is None or (left_group is not None and left_group[0] < right_group[0]):
+            yield left_group[0], list(left_group[1]), list()
+            left_group = next(left_groups, None)
+        elif left_group is None or right_group[0] < left_group[0]:
+            yield right_group[0], list(), list(right_group[1])
+            right_group = next(right_groups, None)
+        else:
+            yield left_group[0], list(left_group[1]), list(right_group[1])
+            left_group, right_group = next(left_groups, None), next(right_groups, None)
@@ -0,0 +1,66 @@
+import re
+import threading
+from collections import defaultdict
+
+from psycopg2 import extensions
+
+# $1, $2... parameters of statements
+_parameter = re.compile(r'\$(\d+)')
+
+
+class QueryRegistry(object):
+
+    # this class keeps named statements with $n parameters, every pooled connection prepares a statement once
+    def __init__(self):
+        self.statements = dict()
+        self.calls = defaultdict(lambda: {'executed': 0, 'prepared': 0})
+        self.lock = threading.Lock()
+
+    def register(self, name, sql):
+        """
+        :param name: statement name, unique in the registry
+        :param sql: 'select' with $1, $2... instead of values, without ';'
+        :return: name
+        """
+        if name in self.statements and self.statements[name] != sql:
+            raise ValueError('Statement %s is registered with another query' % name)
+        self.statements[name] = sql
+
+        return name
+
+    def execute(self, connector, name, params):
+        """
+        :param connector: DbPostgres
+        :param name: registered statement name
+        :param params: values of $1, $2...
+        :return: rows of the statement
+        """
+        rows, hit = connector.execute_prepared(name, self.statements[name], params)
+        with self.lock:
+            self.calls[name]['executed'] += 1
+            self.calls[name]['prepared'] += 0 if hit else 1
+
+        return rows
+
+    def inline(self, name, params):
+        """
+        :return: statement with the values instead of $n, for EXPLAIN and logs
+        """
+        return _parameter.sub(lambda m: extensions.adapt(params[int(m.group(1)) - 1]).getquoted().decode('utf-8'),
+                              self.statements[name])
+
+    def stats(self):
+        """
+        :return: {name: {executed, prepared, hits}}, hits are executions of the already prepared plan
+        """
+        with self.lock:
+            return {name: dict(call, hits=call['executed'] - call['prepared']) for name, call in self.calls.items()}
+
+    def hit_rate(self):
+        stats = self.stats().values()
+        executed = sum(call['executed'] for call in stats)
+
+        return sum(call['hits'] for call in stats) / executed if executed else 0.0
+
+
+oracle_queries = QueryRegistry()
@@ -1,17 +1,50 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import functools
 import json
 import logging
 import requests
 import urllib3
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from framework.timing import timings
 
 log = logging.getLogger(__name__)
 
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+# POST bodies sent by the tests, recorded for tests/benchmarks/api_latency.py if it is a list
+recorded_bodies = None
+
+
+def http_session(pool_size=10, retries=3, backoff=0.3):
+    """
+    :param pool_size: number of keep-alive connections kept per host
+    :param retries: number of retries for failed connections and 502/503/504 responses
+    :param backoff: backoff factor between retries, seconds
+    :return: session to share between Request objects
+    """
+    # statuses are retried for idempotent methods only, connection errors - for all of them
+    retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=[502, 503, 504],
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.verify = False
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
 
 class Request(object):
-    def __init__(self, url, cookies='', headers=None):
+    def __init__(self, url, cookies='', headers=None, session=None):
         self.url = url
         self.cookies = cookies
         self.headers = headers
+        self.session = session or http_session()
 
     def get(self, url_param='', params='', no_check=False):
         """
@@ -20,11 +53,10 @@ class Request(object):
         :param no_check: True - no need to check the status code, False - check the request response
         :return:
         """
-        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
         url_param = ['/' + url_param, url_param][url_param == '' or url_param.startswith('?')]
-        response = requests.get(self.url + url_param, params=params, cookies=self.cookies, headers=self.headers,
-                                timeout=5, verify=False)
+        with timings.measure('http', 'GET %s' % url_param.split('?')[0]):
+            response = self.session.get(self.url + url_param, params=params, cookies=self.cookies,
+                                        headers=self.headers, timeout=5, verify=False)
         if no_check:
             return response
 
@@ -37,12 +69,15 @@ class Request(object):
 
     def post(self, body=None, url_param='', no_check=False, files=None):
 
-        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        if recorded_bodies is not None and body is not None and not files:
+            recorded_bodies.append({'url': self.url, 'url_param': url_param, 'body': body})
+
         params = {'files': files, 'verify': False, 'headers': self.headers.copy()}
         # do not send content type for files
         if files:
             del params['headers']['Content-Type']
-        response = requests.post(self.url + url_param, data=body, **params)
+        with timings.measure('http', 'POST %s' % url_param.split('?')[0]):
+            response = self.session.post(self.url + url_param, data=body, **params)
 
         if no_check:
             return response
@@ -59,11 +94,10 @@ class Request(object):
 
     def put(self, body=None, url_param='', no_check=False):
 
-        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
         url_param = ['/' + url_param, url_param][url_param == '']
 
-        response = requests.put(self.url + url_param, data=body, headers=self.headers, verify=False)
+        with timings.measure('http', 'PUT %s' % url_param.split('?')[0]):
+            response = self.session.put(self.url + url_param, data=body, headers=self.headers, verify=False)
 
         if no_check:
             return response
@@ -85,12 +119,11 @@ class Request(object):
         :param no_check: True - no need to check the status code, False - check the request response
         :return:
         """
-        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
         url_param = ['/' + url_param, url_param][url_param == '']
 
-        response = requests.delete(self.url + url_param, params=params, cookies=self.cookies, headers=self.headers,
-                                   verify=False)
+        with timings.measure('http', 'DELETE %s' % url_param.split('?')[0]):
+            response = self.session.delete(self.url + url_param, params=params, cookies=self.cookies,
+                                           headers=self.headers, verify=False)
 
         if no_check:
             return response
@@ -104,3 +137,75 @@ class Request(object):
             log.exception('DELETE request failure: status %s, url: %s, message %s' %
                           (response.status_code, response.url, response.content))
             raise requests.RequestException
+
+
+class AsyncRequest(object):
+    def __init__(self, request, concurrency=8):
+        """
+        :param request: Request object to send the calls with, its session pool should fit the concurrency
+        :param concurrency: max number of calls in flight
+        """
+        self.request = request
+        self.concurrency = concurrency
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.semaphores = dict()
+        # calls of all gather() are run in one event loop, it is closed by close()
+        self.loop = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        this function stops the worker threads and closes the event loop, calls cannot be sent after it
+        """
+        self.executor.shutdown(wait=True)
+        if self.loop is not None:
+            self.semaphores.pop(self.loop, None)
+            self.loop.close()
+            self.loop = None
+
+    async def get(self, url_param='', params='', no_check=False):
+        return await self.call(self.request.get, url_param=url_param, params=params, no_check=no_check)
+
+    async def post(self, body=None, url_param='', no_check=False, files=None):
+        return await self.call(self.request.post, body=body, url_param=url_param, no_check=no_check, files=files)
+
+    async def put(self, body=None, url_param='', no_check=False):
+        return await self.call(self.request.put, body=body, url_param=url_param, no_check=no_check)
+
+    async def delete(self, url_param='', params='', no_check=False):
+        return await self.call(self.request.delete, url_param=url_param, params=params, no_check=no_check)
+
+    async def call(self, method, **kwargs):
+        # status check and failure logging are done by the wrapped Request method
+        loop = asyncio.get_event_loop()
+        async with self.semaphore(loop):
+            return await loop.run_in_executor(self.executor, functools.partial(method, **kwargs))
+
+    def semaphore(self, loop):
+        # asyncio primitives are bound to the loop they are used in
+        if loop not in self.semaphores:
+            self.semaphores[loop] = asyncio.Semaphore(self.concurrency)
+        return self.semaphores[loop]
+
+    def gather(self, *calls):
+        """
+        :param calls: coroutines of get/post/put/delete
+        :return: list of results in the order of calls, the first failure is raised when all calls are done
+        """
+        async def run_all():
+            return await asyncio.gather(*calls, return_exceptions=True)
+
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+        results = self.loop.run_until_complete(run_all())
+
+        for res in results:
+            if isinstance(res, Exception):
+                raise res
+
+        return results
@@ -0,0 +1,140 @@
+import functools
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# call categories: API latency, SQL of oracles, reference calculations of tests/WM_API/totals.py
+categories = ['http', 'sql', 'oracle']
+
+
+class Timings(object):
+
+    # this class collects wall time of calls by test id, it does nothing until enabled,
+    # calls made in worker processes (PnL of tests/WM_API/totals.py) are not collected, only the wait for them is
+    def __init__(self):
+        self.enabled = False
+        self.test_id = '<session>'
+        self.calls = defaultdict(dict)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @contextmanager
+    def measure(self, category, name):
+        """
+        :param category: one of categories
+        :param name: name of the call inside the category
+        """
+        if not self.enabled:
+            yield
+            return
+
+        # SQL sent by calculate_* is a part of the oracle time, nested oracle calls are not counted twice
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = list()
+        stack = self.local.stack
+        nested = category in stack
+        in_oracle = 'oracle' in stack
+        stack.append(category)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            spent = time.perf_counter() - started
+            stack.pop()
+            if not nested:
+                self.add(category, name, spent, in_oracle)
+
+    @contextmanager
+    def named(self, name):
+        """
+        :param name: name the calls measured inside the block without a name of their own are reported by,
+                     the innermost name wins
+        """
+        if not self.enabled:
+            yield
+            return
+
+        if not hasattr(self.local, 'names'):
+            self.local.names = list()
+        self.local.names.append(name)
+        try:
+            yield
+        finally:
+            self.local.names.pop()
+
+    def current_name(self):
+        """
+        :return: the innermost name set by named() in this thread, None outside of it
+        """
+        names = getattr(self.local, 'names', None)
+
+        return names[-1] if names else None
+
+    def add(self, category, name, spent, in_oracle=False):
+        with self.lock:
+            call = self.calls[self.test_id].setdefault((category, name), {
+                'category': category, 'name': name, 'count': 0, 'total': 0.0, 'max': 0.0, 'in_oracle': 0.0})
+            call['count'] += 1
+            call['total'] += spent
+            call['max'] = max(call['max'], spent)
+            if in_oracle:
+                call['in_oracle'] += spent
+
+    def test_report(self, test_id):
+        """
+        :return: totals of the test: API time, own reference time (oracles and SQL outside of them) and calls
+        """
+        with self.lock:
+            calls = sorted(self.calls.get(test_id, dict()).values(), key=lambda c: c['total'], reverse=True)
+
+        totals = {category: sum(c['total'] for c in calls if c['category'] == category) for category in categories}
+        sql_outside = sum(c['total'] - c['in_oracle'] for c in calls if c['category'] == 'sql')
+
+        return {'api': round(totals['http'], 6),
+                'reference': round(totals['oracle'] + sql_outside, 6),
+                'sql': round(totals['sql'], 6),
+                'calls': [dict(c, total=round(c['total'], 6), max=round(c['max'], 6), in_oracle=round(c['in_oracle'], 6))
+                          for c in calls]}
+
+    def report(self):
+        """
+        :return: {test id: test report} sorted by time spent, the slowest test first
+        """
+        with self.lock:
+            test_ids = list(self.calls)
+        tests = {test_id: self.test_report(test_id) for test_id in test_ids}
+
+        return dict(sorted(tests.items(), key=lambda t: t[1]['api'] + t[1]['reference'], reverse=True))
+
+    def dump(self, path):
+        with open(path, 'w') as report_file:
+            json.dump(self.report(), report_file, indent=2)
+
+
+timings = Timings()
+
+
+def timed(category, name=None):
+    """
+    decorator measuring the calls of a function with timings.measure()
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timings.measure(category, name or func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def named(func):
+    """
+    decorator naming the calls measured inside the function by the function name, see Timings.named()
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with timings.named(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
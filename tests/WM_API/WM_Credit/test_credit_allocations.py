@@ -4,10 +4,9 @@ import pytest
 from definitions import RECENT_DATE
 from tests.db_support import db_shares_asset_ccy, db_shares_asset_region, db_shares_subclass
 from tests.db_support import db_shares_industry, db_shares_credit
-from tests.db_support import db_get_portfolio_info as p_info
 
 
-@pytest.mark.parametrize('p_name, p_id', p_info(parametrized=True, ids_only=True))
+@pytest.mark.portfolios('p_name, p_id')
 def test_subclasses_shares(wm_api, p_name, p_id, expect):
     sc_in = db_shares_subclass(p_name, RECENT_DATE, asset_class=class_name)
     # get subclasses breakdown
@@ -21,7 +20,7 @@ def test_subclasses_shares(wm_api, p_name, p_id, expect):
                'Fail: Subclasses breakdown: %s: api %s != %s db' % (subcls, sc_in[subcls], sc_out[subcls]))
 
 
-@pytest.mark.parametrize('p_name, p_id', p_info(parametrized=True, ids_only=True))
+@pytest.mark.portfolios('p_name, p_id')
 def test_region_shares(wm_api, p_name, p_id, expect):
     g_in = db_shares_asset_region(p_name, RECENT_DATE, asset_class=class_name)
     # get region breakdown
@@ -35,7 +34,7 @@ def test_region_shares(wm_api, p_name, p_id, expect):
                'Fail: Region breakdown: %s: api %s != %s db' % (geo, g_in[geo], g_out[geo]))
 
 
-@pytest.mark.parametrize('p_name, p_id', p_info(parametrized=True, ids_only=True))
+@pytest.mark.portfolios('p_name, p_id')
 def test_ccy_shares(wm_api, p_name, p_id, expect):
     c_in = db_shares_asset_ccy(p_name, RECENT_DATE, asset_class=class_name)
     # get currency breakdown
@@ -49,7 +48,7 @@ def test_ccy_shares(wm_api, p_name, p_id, expect):
                'Fail: Region breakdown: %s: api %s != %s db' % (ccy, c_in[ccy], c_out[ccy]))
 
 
-@pytest.mark.parametrize('p_name, p_id', p_info(parametrized=True, ids_only=True))
+@pytest.mark.portfolios('p_name, p_id')
 def test_industry_shares(wm_api, p_name, p_id, expect):
     ind_in = db_shares_industry(p_name, RECENT_DATE, asset_class=class_name)
     # get currency breakdown
@@ -63,7 +62,7 @@ def test_industry_shares(wm_api, p_name, p_id, expect):
                'Fail: Industry sectors breakdown: %s: api %s != %s db' % (sctr, ind_in[sctr], ind_out[sctr]))
 
 
-@pytest.mark.parametrize('p_name, p_id', p_info(parametrized=True, ids_only=True))
+@pytest.mark.portfolios('p_name, p_id')
 def test_rating_shares(wm_api, p_name, p_id, expect):
     ind_in = db_shares_credit(p_name, RECENT_DATE, asset_class=class_name)
     # get currency breakdown
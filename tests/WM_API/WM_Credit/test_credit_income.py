@@ -1,19 +1,11 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 import pytest
 import json
 
-from definitions import RECENT_DATE
 from tests.WM_API.totals import calculate_totals_for_period
-from tests.db_support import db_get_portfolio_info as p_info
 
 
-@pytest.mark.parametrize('p_name, p_id, tense, from_dt, to_dt',
-                         [(p_name, p_id, tense, _from, _to)
-                          for p_name, p_id, start_dt in p_info(parametrized=True)
-                          for tense, _from, _to in
-                          [(0, RECENT_DATE.replace(year=RECENT_DATE.year - 1, day=1), RECENT_DATE.replace(day=1) - timedelta(days=1)),
-                           (1, RECENT_DATE.replace(day=1), (RECENT_DATE.replace(day=1, year=RECENT_DATE.year + 1) - timedelta(days=1)))
-                           ]])
+@pytest.mark.portfolios('p_name, p_id, tense, from_dt, to_dt', 'month_tenses')
 def test_coupons(p_name, p_id, tense, from_dt, to_dt, wm_api, expect):
     # calculate only income for equity
     flags = {class_name.lower(): True, 'income': True, 'aggregated': True, 'specific': True, 'interval': 'Monthly'}
@@ -2,10 +2,10 @@ import json
 import pytest
 
 from definitions import RECENT_DATE
-from tests.db_support import db_principal_pay, db_get_portfolio_info as p_info
+from tests.db_support import db_principal_pay
 
 
-@pytest.mark.parametrize('p_name, p_id', p_info(parametrized=True, ids_only=True))
+@pytest.mark.portfolios('p_name, p_id')
 def test_credit_principal(wm_api, p_name, p_id, expect):
     pr_in = db_principal_pay(p_name, RECENT_DATE)
     # get total wealth
@@ -0,0 +1,25 @@
+import json
+import pytest
+
+from framework.request import AsyncRequest
+from tests.WM_API.conftest import wm_api_init
+
+allocations_to_test = ['AssetClass', 'Region', 'Currency', 'Custodian']
+
+
+@pytest.fixture(scope='module')
+def allocations():
+    api = AsyncRequest(wm_api_init()['portfolio'], concurrency=len(allocations_to_test))
+    breakdowns = dict()
+
+    def breakdown(p_id, allocation):
+        # all breakdowns of the portfolio are requested at once on the first call
+        if p_id not in breakdowns:
+            bodies = [json.dumps({'portfolioId': p_id, 'withChildren': False, 'allocations': [name]})
+                      for name in allocations_to_test]
+            api_data = api.gather(*[api.post(body, url_param='.allocation') for body in bodies])
+            breakdowns[p_id] = {name: data[name] for name, data in zip(allocations_to_test, api_data)}
+        return breakdowns[p_id][allocation]
+
+    yield breakdown
+    api.close()
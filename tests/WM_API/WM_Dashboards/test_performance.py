@@ -2,20 +2,10 @@ from datetime import datetime
 import pytest
 import json
 
-from definitions import RECENT_DATE
 from tests.WM_API.totals import calculate_performance, calculate_benchmark_performance
-from tests.db_support import db_get_portfolio_info as p_info
-
-
-@pytest.mark.parametrize('p_name, p_id, p_dt, from_dt, to_dt',
-                         [(p_name, p_id, start_dt, _from, _to)
-                          for p_name, p_id, start_dt in p_info(parametrized=True)
-                          for _from, _to in
-                          sorted({
-                              ([start_dt, RECENT_DATE.replace(day=1)][start_dt < RECENT_DATE.replace(day=1)], RECENT_DATE),
-                              (start_dt, RECENT_DATE),
-                              ([start_dt, RECENT_DATE.replace(month=1, day=1)][start_dt < RECENT_DATE.replace(month=1, day=1)], RECENT_DATE)
-                          })])
+
+
+@pytest.mark.portfolios('p_name, p_id, p_dt, from_dt, to_dt', 'performance_periods')
 def test_performance(p_name, p_id, from_dt, to_dt, p_dt, wm_api, expect):
     # correct 'start' date according to portfolio start date
     actual_start_dt = [p_dt, from_dt][p_dt < from_dt]
@@ -38,14 +28,7 @@ def test_performance(p_name, p_id, from_dt, to_dt, p_dt, wm_api, expect):
 
 
 @pytest.mark.skip('not ready yet')
-@pytest.mark.parametrize('p_id, from_dt, to_dt',
-                         [(p_id, _from, _to)
-                          for p_name, p_id, start_dt in p_info(parametrized=True)
-                          for _from, _to in
-                          [(RECENT_DATE.replace(day=1), RECENT_DATE),
-                           (start_dt, RECENT_DATE),
-                           (RECENT_DATE.replace(month=1, day=1), RECENT_DATE)
-                           ]])
+@pytest.mark.portfolios('p_id, from_dt, to_dt', 'calendar_periods')
 def test_spx_performance(p_id, from_dt, to_dt, wm_api, expect):
     # calculate performance using db data
     performance_in = calculate_benchmark_performance('SP500', from_dt, to_dt)
@@ -1,22 +1,11 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 import pytest
 import json
 
-from definitions import RECENT_DATE
 from tests.WM_API.totals import calculate_pnl
-from tests.db_support import db_get_portfolio_info as p_info
 
 
-@pytest.mark.parametrize('p_name, p_id, from_dt, to_dt',
-                         [(p_name, p_id, _from, _to)
-                          for p_name, p_id, start_dt in p_info(parametrized=True)
-                          for _from, _to in
-                          sorted({
-                              ([start_dt, RECENT_DATE.replace(day=1)][start_dt < RECENT_DATE.replace(day=1)], RECENT_DATE),  # MTD
-                              (start_dt, RECENT_DATE),  # since inception
-                              ([start_dt, RECENT_DATE.replace(year=RECENT_DATE.year - 1)][start_dt < RECENT_DATE.replace(year=RECENT_DATE.year - 1)], RECENT_DATE),  # 1 Year
-                              ([start_dt, RECENT_DATE.replace(month=1, day=1)][start_dt < RECENT_DATE.replace(month=1, day=1)], RECENT_DATE)  # YTD
-                          })])
+@pytest.mark.portfolios('p_name, p_id, from_dt, to_dt', 'dashboard_pnl_periods')
 def test_pnl(p_name, p_id, from_dt, to_dt, wm_api, expect):
     flags = {'aggregated': False}
     pnl_in = calculate_pnl(p_name, from_dt, to_dt, **flags)
@@ -32,14 +21,7 @@ def test_pnl(p_name, p_id, from_dt, to_dt, wm_api, expect):
 
 
 @pytest.mark.skip('not ready')
-@pytest.mark.parametrize('p_name, p_id, from_dt, to_dt',
-                         [(p_name, p_id, _from, _to)
-                          for p_name, p_id, start_dt in p_info(parametrized=True)
-                          for _from, _to in
-                          [(start_dt, RECENT_DATE),
-                           ((RECENT_DATE - timedelta(days=365)).replace(day=1), RECENT_DATE),
-                           (RECENT_DATE.replace(month=1, day=1), RECENT_DATE),
-                           (RECENT_DATE.replace(day=1), RECENT_DATE)]])
+@pytest.mark.portfolios('p_name, p_id, from_dt, to_dt', 'pnl_periods')
 def test_pnl_attribution(p_name, p_id, from_dt, to_dt, wm_api, expect):
     flags = {'pnl': True, 'nav': False, 'income': False, 'aggregated': False}
     pnl_in = calculate_pnl(p_name, from_dt, to_dt, **flags)
@@ -3,11 +3,11 @@ import pytest
 from datetime import timedelta
 
 from definitions import RECENT_DATE
-from tests.db_support import db_total_wealth, db_get_portfolio_info as p_info
+from tests.db_support import db_total_wealth
 from tests.WM_API.totals import calculate_income, calculate_yield
 
 
-@pytest.mark.parametrize('p_name, p_id', p_info(parametrized=True, ids_only=True))
+@pytest.mark.portfolios('p_name, p_id')
 def test_tw(wm_api, p_name, p_id):
     tw_in = db_total_wealth(p_name, RECENT_DATE)
     # get total wealth
@@ -18,7 +18,7 @@ def test_tw(wm_api, p_name, p_id):
     assert round(tw_out, 2) == round(tw_in, 2), 'Fail: Total wealth: api %s != %s db' % (tw_out, tw_in)
 
 
-@pytest.mark.parametrize('p_name, p_id', p_info(parametrized=True, ids_only=True))
+@pytest.mark.portfolios('p_name, p_id')
 def test_iw(wm_api, p_name, p_id):
     tw_in = db_total_wealth(p_name, RECENT_DATE, investable=True)
     # get total wealth
@@ -29,7 +29,7 @@ def test_iw(wm_api, p_name, p_id):
     assert round(tw_out, 2) == round(tw_in, 2), 'Fail: Total wealth: api %s != %s db' % (tw_out, tw_in)
 
 
-@pytest.mark.parametrize('p_name, p_id', p_info(parametrized=True, ids_only=True))
+@pytest.mark.portfolios('p_name, p_id')
 def test_pi(wm_api, p_name, p_id):
     # calculate income for next 12 month
     to_ = RECENT_DATE.replace(year=RECENT_DATE.year + 1)
@@ -42,7 +42,7 @@ def test_pi(wm_api, p_name, p_id):
     assert round(pi_out, 2) == round(pi_in, 2), 'Fail: Projected income: api %s != %s db' % (pi_out, pi_in)
 
 
-@pytest.mark.parametrize('p_name, p_id', p_info(parametrized=True, ids_only=True))
+@pytest.mark.portfolios('p_name, p_id')
 def test_pi_yield(wm_api, p_name, p_id):
     # calculate income for next 12 month
     to_ = RECENT_DATE.replace(year=RECENT_DATE.year + 1)
@@ -3,10 +3,9 @@ import pytest
 
 from definitions import RECENT_DATE
 from tests.db_support import db_shares_asset_ccy, db_shares_asset_region, db_shares_subclass, db_shares_industry
-from tests.db_support import db_get_portfolio_info as p_info
 
 
-@pytest.mark.parametrize('p_name, p_id', p_info(parametrized=True, ids_only=True))
+@pytest.mark.portfolios('p_name, p_id')
 def test_subclasses_shares(wm_api, p_name, p_id, expect):
     sc_in = db_shares_subclass(p_name, RECENT_DATE, asset_class=class_name)
     # get subclasses breakdown
@@ -20,7 +19,7 @@ def test_subclasses_shares(wm_api, p_name, p_id, expect):
                'Fail: Subclasses breakdown: %s: api %s != %s db' % (subcls, sc_in[subcls], sc_out[subcls]))
 
 
-@pytest.mark.parametrize('p_name, p_id', p_info(parametrized=True, ids_only=True))
+@pytest.mark.portfolios('p_name, p_id')
 def test_region_shares(wm_api, p_name, p_id, expect):
     g_in = db_shares_asset_region(p_name, RECENT_DATE, asset_class=class_name)
     # get region breakdown
@@ -34,7 +33,7 @@ def test_region_shares(wm_api, p_name, p_id, expect):
                'Fail: Region breakdown: %s: api %s != %s db' % (geo, g_in[geo], g_out[geo]))
 
 
-@pytest.mark.parametrize('p_name, p_id', p_info(parametrized=True, ids_only=True))
+@pytest.mark.portfolios('p_name, p_id')
 def test_ccy_shares(wm_api, p_name, p_id, expect):
     c_in = db_shares_asset_ccy(p_name, RECENT_DATE, asset_class=class_name)
     # get currency breakdown
@@ -48,7 +47,7 @@ def test_ccy_shares(wm_api, p_name, p_id, expect):
                'Fail: Currency breakdown: %s: api %s != %s db' % (ccy, c_in[ccy], c_out[ccy]))
 
 
-@pytest.mark.parametrize('p_name, p_id', p_info(parametrized=True, ids_only=True))
+@pytest.mark.portfolios('p_name, p_id')
 def test_industry_shares(wm_api, p_name, p_id, expect):
     ind_in = db_shares_industry(p_name, RECENT_DATE, asset_class=class_name)
     # get currency breakdown
@@ -2,20 +2,10 @@ from datetime import datetime
 import pytest
 import json
 
-from definitions import RECENT_DATE
 from tests.WM_API.totals import calculate_performance
-from tests.db_support import db_get_portfolio_info as p_info
 
 
-@pytest.mark.parametrize('p_name, p_id, from_dt, to_dt, p_dt',
-                         [(p_name, p_id, _from, _to, p_dt)
-                          for p_name, p_id, p_dt in p_info(parametrized=True)
-                          for _from, _to in
-                          sorted({
-                              ([p_dt, RECENT_DATE.replace(day=1)][p_dt < RECENT_DATE.replace(day=1)], RECENT_DATE),
-                              (p_dt, RECENT_DATE),
-                              ([p_dt, RECENT_DATE.replace(month=1, day=1)][p_dt < RECENT_DATE.replace(month=1, day=1)], RECENT_DATE)
-                          })])
+@pytest.mark.portfolios('p_name, p_id, from_dt, to_dt, p_dt', 'performance_periods')
 def test_equity_performance(p_name, p_id, from_dt, to_dt, p_dt, wm_api, expect):
     actual_start_dt = [p_dt, from_dt][p_dt < from_dt]
     periodicity = ['Monthly', 'Daily'][(to_dt - actual_start_dt).days < 31]
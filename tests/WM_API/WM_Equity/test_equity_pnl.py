@@ -1,21 +1,12 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 import pytest
 import json
 
-from definitions import RECENT_DATE
 from tests.WM_API.totals import calculate_pnl
-from tests.db_support import db_get_portfolio_info as p_info
 
 
 @pytest.mark.skip('not ready yet')
-@pytest.mark.parametrize('p_name, p_id, from_dt, to_dt',
-                         [(p_name, p_id, _from, _to)
-                          for p_name, p_id, start_dt in p_info(parametrized=True)
-                          for _from, _to in
-                          [(start_dt, RECENT_DATE),
-                           ((RECENT_DATE - timedelta(days=365)).replace(day=1), RECENT_DATE),
-                           (RECENT_DATE.replace(month=1, day=1), RECENT_DATE),
-                           (RECENT_DATE.replace(day=1), RECENT_DATE)]])
+@pytest.mark.portfolios('p_name, p_id, from_dt, to_dt', 'pnl_periods')
 def test_pnl_attribution(p_name, p_id, from_dt, to_dt, wm_api, expect):
     flags = {'equity': True, 'pnl': True, 'aggregated': False}
     pnl_in = calculate_pnl(p_name, from_dt, to_dt, **flags)
@@ -1,13 +1,12 @@
 import json
 import pytest
-from datetime import timedelta
 
 from definitions import RECENT_DATE
-from tests.db_support import db_wealth_per_asset, db_get_portfolio_info as p_info
+from tests.db_support import db_wealth_per_asset
 from tests.WM_API.totals import calculate_income, calculate_yield
 
 
-@pytest.mark.parametrize('p_name, p_id', p_info(parametrized=True, ids_only=True))
+@pytest.mark.portfolios('p_name, p_id')
 def test_equity_tw(wm_api, p_name, p_id):
     tw_in = db_wealth_per_asset(p_name, RECENT_DATE)[class_name]
     # get total wealth
@@ -18,13 +17,7 @@ def test_equity_tw(wm_api, p_name, p_id):
     assert round(tw_in, 2) == round(tw_out, 2), 'Fail: Total wealth: api %s != %s db' % (tw_out, tw_in)
 
 
-@pytest.mark.parametrize('p_name, p_id, tense, from_dt, to_dt',
-                         [(p_name, p_id, tense, _from, _to)
-                          for p_name, p_id in p_info(parametrized=True, ids_only=True)
-                          for tense, _from, _to in
-                          [('past', RECENT_DATE.replace(year=RECENT_DATE.year - 1), RECENT_DATE),
-                           ('next', RECENT_DATE + timedelta(days=1), (RECENT_DATE.replace(year=RECENT_DATE.year + 1)))
-                           ]])
+@pytest.mark.portfolios('p_name, p_id, tense, from_dt, to_dt', 'year_tenses')
 def test_dividends_past_next(p_name, p_id, from_dt, to_dt, tense, wm_api):
     flags = {'income': True, class_name.lower(): True, 'aggregated': True, 'specific': True}
     income_in = calculate_income(p_name, from_dt, to_dt, **flags)
@@ -37,13 +30,7 @@ def test_dividends_past_next(p_name, p_id, from_dt, to_dt, tense, wm_api):
                                                          (tense, income_out, income_in[to_dt])
 
 
-@pytest.mark.parametrize('p_name, p_id, tense, from_dt, to_dt',
-                         [(p_name, p_id, tense, _from, _to)
-                          for p_name, p_id in p_info(parametrized=True, ids_only=True)
-                          for tense, _from, _to in
-                          [('past', RECENT_DATE.replace(year=RECENT_DATE.year - 1), RECENT_DATE),
-                           ('next', RECENT_DATE, (RECENT_DATE.replace(year=RECENT_DATE.year + 1)))
-                           ]])
+@pytest.mark.portfolios('p_name, p_id, tense, from_dt, to_dt', 'year_tenses_from_recent')
 def test_dividends_yield(p_name, p_id, from_dt, to_dt, tense, wm_api):
     # calculate income yield
     flags = {'income': True, class_name.lower(): True, 'aggregated': True, 'specific': True}
@@ -2,11 +2,11 @@ import json
 import pytest
 
 from definitions import RECENT_DATE
-from tests.db_support import db_top_positions, db_get_portfolio_info as p_info
+from tests.db_support import db_top_positions
 
 
 @pytest.mark.parametrize('order, limit', [('DESC', 10), ('DESC', 15), ('ASC', 10), ('ASC', 15)])
-@pytest.mark.parametrize('p_name, p_id', p_info(parametrized=True, ids_only=True))
+@pytest.mark.portfolios('p_name, p_id')
 def test_pe_top_positions_security(wm_api, p_name, p_id, order, limit, expect):
     pos_in = db_top_positions(p_name, RECENT_DATE, order_by='percentage_per_class', desc=order == 'DESC', limit=limit,
                               asset_class=class_name)
@@ -26,7 +26,7 @@ def test_pe_top_positions_security(wm_api, p_name, p_id, order, limit, expect):
 
 
 @pytest.mark.parametrize('order, limit', [('DESC', 10), ('DESC', 15), ('ASC', 10), ('ASC', 15)])
-@pytest.mark.parametrize('p_name, p_id', p_info(parametrized=True, ids_only=True))
+@pytest.mark.portfolios('p_name, p_id')
 def test_pe_top_positions_issuer(wm_api, p_name, p_id, order, limit, expect):
     pos_in = db_top_positions(p_name, RECENT_DATE, order_by='percentage_per_issuer', desc=order == 'DESC', limit=limit,
                               asset_class=class_name)
@@ -1,13 +1,12 @@
 import json
 import pytest
-from datetime import timedelta
 
 from definitions import RECENT_DATE
-from tests.db_support import db_wealth_per_asset, db_get_portfolio_info as p_info
+from tests.db_support import db_wealth_per_asset
 from tests.WM_API.totals import calculate_income, calculate_yield
 
 
-@pytest.mark.parametrize('p_name, p_id', p_info(parametrized=True, ids_only=True))
+@pytest.mark.portfolios('p_name, p_id')
 def test_private_equity_tw(wm_api, p_name, p_id):
     tw_in = db_wealth_per_asset(p_name, RECENT_DATE)[class_name]
     # get total wealth
@@ -19,13 +18,7 @@ def test_private_equity_tw(wm_api, p_name, p_id):
 
 
 @pytest.mark.skip('No requirements')
-@pytest.mark.parametrize('p_name, p_id, tense, from_dt, to_dt',
-                         [(p_name, p_id, tense, _from, _to)
-                          for p_name, p_id in p_info(parametrized=True, ids_only=True)
-                          for tense, _from, _to in
-                          [('past', RECENT_DATE.replace(year=RECENT_DATE.year - 1), RECENT_DATE),
-                           ('next', RECENT_DATE + timedelta(days=1), (RECENT_DATE.replace(year=RECENT_DATE.year + 1)))
-                           ]])
+@pytest.mark.portfolios('p_name, p_id, tense, from_dt, to_dt', 'year_tenses')
 def test_distributions_past_next(p_name, p_id, from_dt, to_dt, tense, wm_api):
     flags = {'income': True, 'credit': True, 'aggregated': True}
     income_in = calculate_income(p_name, from_dt, to_dt, **flags)
@@ -39,13 +32,7 @@ def test_distributions_past_next(p_name, p_id, from_dt, to_dt, tense, wm_api):
 
 
 @pytest.mark.skip('No requirements')
-@pytest.mark.parametrize('p_name, p_id, tense, from_dt, to_dt',
-                         [(p_name, p_id, tense, _from, _to)
-                          for p_name, p_id in p_info(parametrized=True, ids_only=True)
-                          for tense, _from, _to in
-                          [('past', RECENT_DATE.replace(year=RECENT_DATE.year - 1), RECENT_DATE),
-                           ('next', RECENT_DATE + timedelta(days=1), (RECENT_DATE.replace(year=RECENT_DATE.year + 1)))
-                           ]])
+@pytest.mark.portfolios('p_name, p_id, tense, from_dt, to_dt', 'year_tenses')
 def test_distributions_yield(p_name, p_id, from_dt, to_dt, tense, wm_api):
     # calculate income yield
     flags = {'income': True, 'credit': True, 'aggregated': True}
@@ -2,19 +2,10 @@ from datetime import datetime
 import pytest
 import json
 
-from definitions import RECENT_DATE
 from tests.WM_API.totals import calculate_totals_for_period, calculate_income, calculate_nav, calculate_yield
-from tests.db_support import db_get_portfolio_info as p_info
 
 
-@pytest.mark.parametrize('p_name, p_id, from_dt, to_dt',
-                         [(p_name, p_id, _from, _to)
-                          for p_name, p_id, start_dt in p_info(parametrized=True)
-                          for _from, _to in
-                          [(start_dt, RECENT_DATE),
-                           (RECENT_DATE.replace(year=RECENT_DATE.year - 1), RECENT_DATE),
-                           (RECENT_DATE.replace(month=1, day=1), RECENT_DATE)
-                           ]])
+@pytest.mark.portfolios('p_name, p_id, from_dt, to_dt', 'report_periods')
 def test_report_income(p_name, p_id, from_dt, to_dt, wm_api, expect):
     flags = {'aggregated': True, 'all': False, 'specific': False, 'income': True}
     income_in = calculate_totals_for_period(p_name, from_dt, to_dt, **flags)['income']
@@ -33,13 +24,7 @@ def test_report_income(p_name, p_id, from_dt, to_dt, wm_api, expect):
                    'Fail: Income: period %s: %s: api %s != %s db' % (dt, key, i_out, i_in))
 
 
-@pytest.mark.parametrize('p_name, p_id, tense, from_dt, to_dt',
-                         [(p_name, p_id, tense, _from, _to)
-                          for p_name, p_id in p_info(parametrized=True, ids_only=True)
-                          for tense, _from, _to in
-                          [('past', RECENT_DATE.replace(year=RECENT_DATE.year - 1), RECENT_DATE),
-                           ('next', RECENT_DATE, (RECENT_DATE.replace(year=RECENT_DATE.year + 1)))
-                           ]])
+@pytest.mark.portfolios('p_name, p_id, tense, from_dt, to_dt', 'year_tenses_from_recent')
 def test_report_income_past_next(p_name, p_id, from_dt, to_dt, tense, wm_api):
     flags = {'interval': None}
     income_in = calculate_income(p_name, from_dt, to_dt, **flags)
@@ -52,13 +37,7 @@ def test_report_income_past_next(p_name, p_id, from_dt, to_dt, tense, wm_api):
                                                          (tense, income_out, income_in[to_dt])
 
 
-@pytest.mark.parametrize('p_name, p_id, tense, from_dt, to_dt',
-                         [(p_name, p_id, tense, _from, _to)
-                          for p_name, p_id in p_info(parametrized=True, ids_only=True)
-                          for tense, _from, _to in
-                          [('past', RECENT_DATE.replace(year=RECENT_DATE.year - 1), RECENT_DATE),
-                           ('next', RECENT_DATE, (RECENT_DATE.replace(year=RECENT_DATE.year + 1)))
-                           ]])
+@pytest.mark.portfolios('p_name, p_id, tense, from_dt, to_dt', 'year_tenses_from_recent')
 def test_report_income_yield(p_name, p_id, from_dt, to_dt, tense, wm_api):
     # calculate income yield
     flags = {'interval': None}
@@ -3,10 +3,10 @@ import pytest
 
 from definitions import RECENT_DATE
 from tests.WM_API.totals import calculate_pnl
-from tests.db_support import db_portfolio_snapshot, db_get_portfolio_info as p_info
+from tests.db_support import db_portfolio_snapshot
 
 
-@pytest.mark.parametrize('p_name, p_id, p_dt', p_info(parametrized=True))
+@pytest.mark.portfolios('p_name, p_id, p_dt')
 def test_portfolio_snapshot(wm_api, p_name, p_id, p_dt, expect):
     snap_in = db_portfolio_snapshot(p_name)
     pnl_in = calculate_pnl(p_name, start_date=p_dt, end_date=RECENT_DATE, **{'all': False, 'detailed': True})
@@ -1,4 +1,6 @@
 import base64
+from datetime import datetime, timedelta
+from fnmatch import fnmatch
 import glob
 import json
 import pytest
@@ -6,18 +8,188 @@ import os
 import re
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
 
-from definitions import ROOT_DIR
-from framework.request import Request
+from definitions import ROOT_DIR, RECENT_DATE
+from framework.dbpostgres import db_stats
+from framework.request import AsyncRequest, Request, http_session
 from tests.conftest import env_config
-from tests.db_support import refresh_trades, refresh_md, db_get_portfolio_info as p_info
+from tests.db_support import refresh_trades, refresh_md, refresh_positions, refresh_coupon_principals, reference_cache, \
+    invalidate_reference_cache
+from tests.db_support import db_get_portfolio_info as p_info, db_portfolios_fingerprint, db_portfolio_trades_count
+from tests.WM_API.totals import prune_pnl_cache
 
 logger = logging.getLogger(__name__)
 
+# waiting for trades of a created portfolio to be stored, seconds
+PORTFOLIO_READY_TIMEOUT = 60
+PORTFOLIO_READY_POLL = 0.5
+
+# keep-alive connections shared by all API clients of the session, see api_session()
+_api_session = None
+# portfolios tests are parametrized with, see portfolio_catalog()
+_portfolio_catalog = None
+
+
+def since(start_dt, dt):
+    # a period does not start before the portfolio start date
+    return [start_dt, dt][start_dt < dt]
+
+
+# named periods of @pytest.mark.portfolios: (columns, function of portfolio start date returning values of the columns)
+portfolio_periods = {
+    # the past year and the next one starting the day after the recent date
+    'year_tenses': (('tense', 'from_dt', 'to_dt'), lambda start_dt: [
+        ('past', RECENT_DATE.replace(year=RECENT_DATE.year - 1), RECENT_DATE),
+        ('next', RECENT_DATE + timedelta(days=1), RECENT_DATE.replace(year=RECENT_DATE.year + 1))]),
+    # the past year and the next one starting at the recent date
+    'year_tenses_from_recent': (('tense', 'from_dt', 'to_dt'), lambda start_dt: [
+        ('past', RECENT_DATE.replace(year=RECENT_DATE.year - 1), RECENT_DATE),
+        ('next', RECENT_DATE, RECENT_DATE.replace(year=RECENT_DATE.year + 1))]),
+    # the past year and a year from the day after the recent date
+    'year_tenses_next_day': (('tense', 'from_dt', 'to_dt'), lambda start_dt: [
+        ('past', RECENT_DATE.replace(year=RECENT_DATE.year - 1), RECENT_DATE),
+        ('next', RECENT_DATE + timedelta(days=1),
+         (RECENT_DATE + timedelta(days=1)).replace(year=RECENT_DATE.year + 1))]),
+    # 12 whole months before the recent month and 12 months from it, the tense is 0 for the past and 1 for the next
+    'month_tenses': (('tense', 'from_dt', 'to_dt'), lambda start_dt: [
+        (0, RECENT_DATE.replace(year=RECENT_DATE.year - 1, day=1), RECENT_DATE.replace(day=1) - timedelta(days=1)),
+        (1, RECENT_DATE.replace(day=1), RECENT_DATE.replace(day=1, year=RECENT_DATE.year + 1) - timedelta(days=1))]),
+    # since inception, 12 months, YTD and MTD
+    'pnl_periods': (('from_dt', 'to_dt'), lambda start_dt: [
+        (start_dt, RECENT_DATE),
+        ((RECENT_DATE - timedelta(days=365)).replace(day=1), RECENT_DATE),
+        (RECENT_DATE.replace(month=1, day=1), RECENT_DATE),
+        (RECENT_DATE.replace(day=1), RECENT_DATE)]),
+    # MTD, since inception, 1 year and YTD, not earlier than the start date
+    'dashboard_pnl_periods': (('from_dt', 'to_dt'), lambda start_dt: sorted({
+        (since(start_dt, RECENT_DATE.replace(day=1)), RECENT_DATE),
+        (start_dt, RECENT_DATE),
+        (since(start_dt, RECENT_DATE.replace(year=RECENT_DATE.year - 1)), RECENT_DATE),
+        (since(start_dt, RECENT_DATE.replace(month=1, day=1)), RECENT_DATE)})),
+    # MTD, since inception and YTD, not earlier than the start date
+    'performance_periods': (('from_dt', 'to_dt'), lambda start_dt: sorted({
+        (since(start_dt, RECENT_DATE.replace(day=1)), RECENT_DATE),
+        (start_dt, RECENT_DATE),
+        (since(start_dt, RECENT_DATE.replace(month=1, day=1)), RECENT_DATE)})),
+    # MTD, since inception and YTD as they are
+    'calendar_periods': (('from_dt', 'to_dt'), lambda start_dt: [
+        (RECENT_DATE.replace(day=1), RECENT_DATE),
+        (start_dt, RECENT_DATE),
+        (RECENT_DATE.replace(month=1, day=1), RECENT_DATE)]),
+    # since inception, a year 3 years ago, 1 year, YTD and MTD
+    'income_periods': (('from_dt', 'to_dt'), lambda start_dt: [
+        (start_dt, RECENT_DATE),
+        (RECENT_DATE.replace(day=1, year=RECENT_DATE.year - 3), RECENT_DATE.replace(year=RECENT_DATE.year - 2)),
+        (RECENT_DATE.replace(year=RECENT_DATE.year - 1), RECENT_DATE),
+        (RECENT_DATE.replace(month=1, day=1), RECENT_DATE),
+        (RECENT_DATE.replace(day=1), RECENT_DATE)]),
+    # since inception, 1 year and YTD
+    'report_periods': (('from_dt', 'to_dt'), lambda start_dt: [
+        (start_dt, RECENT_DATE),
+        (RECENT_DATE.replace(year=RECENT_DATE.year - 1), RECENT_DATE),
+        (RECENT_DATE.replace(month=1, day=1), RECENT_DATE)]),
+    # since inception, 1 year and 3 years
+    'history_periods': (('from_dt', 'to_dt'), lambda start_dt: [
+        (start_dt, RECENT_DATE),
+        (RECENT_DATE.replace(year=RECENT_DATE.year - 1), RECENT_DATE),
+        (RECENT_DATE.replace(year=RECENT_DATE.year - 3), RECENT_DATE)]),
+}
+
 
 def pytest_sessionstart():
     create_portfolios()
     init_db()
+    # PnL cached for the former trades and market data is removed before any test reads the cache
+    prune_pnl_cache()
+
+
+def pytest_sessionfinish():
+    if _api_session is not None:
+        _api_session.close()
+    stats = db_stats()
+    logger.info("DB usage: %s connections in %.2fs, %s queries in %.2fs (%.0f%% of DB time on handshakes)" %
+                (stats['connects'], stats['connect_time'], stats['queries'], stats['query_time'],
+                 stats['connect_share'] * 100))
+    stats = reference_cache.stats()
+    logger.info("Reference cache: %s hits, %s misses" % (stats['hits'], stats['misses']))
+
+
+def pytest_generate_tests(metafunc):
+    """
+    tests marked with @pytest.mark.portfolios(argnames, expand=None) are parametrized by the portfolio catalog,
+    expand is a name from portfolio_periods or expand(p_name, p_id, start_dt) returning the list of argument values
+    for a portfolio; p_name, p_id and p_dt (start date) arguments are taken from the catalog
+    """
+    marker = metafunc.definition.get_closest_marker('portfolios')
+    if marker is None:
+        return
+
+    argnames = marker.args[0]
+    expand = marker.args[1] if len(marker.args) > 1 else None
+    if isinstance(expand, str):
+        expand = named_periods(argnames, expand)
+    elif expand is None:
+        size = len(argnames.split(','))
+        expand = lambda p_name, p_id, start_dt: [(p_name, p_id, start_dt)[:size]]
+
+    metafunc.parametrize(argnames, [values for p_name, p_id, start_dt in portfolio_catalog(metafunc.config)
+                                    for values in expand(p_name, p_id, start_dt)])
+
+
+def named_periods(argnames, name):
+    """
+    :param argnames: argument names of the test
+    :param name: name from portfolio_periods
+    :return: expand(p_name, p_id, start_dt) for @pytest.mark.portfolios
+    """
+    columns, periods = portfolio_periods[name]
+    names = [arg.strip() for arg in argnames.split(',')]
+
+    def expand(p_name, p_id, start_dt):
+        return [tuple(dict(zip(columns, values), p_name=p_name, p_id=p_id, p_dt=start_dt)[arg] for arg in names)
+                for values in periods(start_dt)]
+
+    return expand
+
+
+def portfolio_matches(row, pattern):
+    return fnmatch(row[0], pattern) or pattern == str(row[1])
+
+
+def portfolio_catalog(config):
+    """
+    :param config: pytest config
+    :return: [(portfolio, portfolio id, start date)] filtered by --portfolio options
+    """
+    global _portfolio_catalog
+    patterns = config.getoption('portfolio')
+    if _portfolio_catalog is None:
+        cache = getattr(config, 'cache', None)
+        cached = cache.get('wm_api/portfolios', None) if cache else None
+        # the catalog is kept in pytest cache until portfolios or trades change, the fingerprint is checked every time
+        fingerprint = db_portfolios_fingerprint()
+        if cached and cached['fingerprint'] == fingerprint:
+            catalog = cached['portfolios']
+        else:
+            catalog = [[p_name, p_id, str(start_dt)] for p_name, p_id, start_dt in p_info(parametrized=True)]
+            if cache:
+                cache.set('wm_api/portfolios', {'fingerprint': fingerprint, 'portfolios': catalog})
+        _portfolio_catalog = [(p_name, p_id, datetime.strptime(start_dt, '%Y-%m-%d').date())
+                              for p_name, p_id, start_dt in catalog]
+
+    return [row for row in _portfolio_catalog
+            if not patterns or any(portfolio_matches(row, pattern) for pattern in patterns)]
+
+
+def api_session():
+    global _api_session
+    if _api_session is None:
+        api_spec_connection = env_config.section('WM API')
+        _api_session = http_session(pool_size=int(api_spec_connection.get('pool_size', 10)),
+                                    retries=int(api_spec_connection.get('retries', 3)),
+                                    backoff=float(api_spec_connection.get('backoff', 0.3)))
+    return _api_session
 
 
 def wm_api_init():
@@ -28,13 +200,14 @@ def wm_api_init():
 
     token = 'Basic %s' % base64.b64encode(auth_line.encode('utf-8')).decode("utf-8")
     headers = {'Content-Type': 'application/json', 'Authorization': token}
+    session = api_session()
     apis = dict()
 
-    apis['portfolio'] = Request(api_spec_connection['portfolio_api_url'], headers=headers)
-    apis['equity'] = Request(api_spec_connection['equity_api_url'], headers=headers)
-    apis['credit'] = Request(api_spec_connection['credit_api_url'], headers=headers)
-    apis['report'] = Request(api_spec_connection['report_api_url'], headers=headers)
-    apis['common'] = Request(api_spec_connection['common_api_url'], headers=headers)
+    apis['portfolio'] = Request(api_spec_connection['portfolio_api_url'], headers=headers, session=session)
+    apis['equity'] = Request(api_spec_connection['equity_api_url'], headers=headers, session=session)
+    apis['credit'] = Request(api_spec_connection['credit_api_url'], headers=headers, session=session)
+    apis['report'] = Request(api_spec_connection['report_api_url'], headers=headers, session=session)
+    apis['common'] = Request(api_spec_connection['common_api_url'], headers=headers, session=session)
 
     return apis
 
@@ -44,21 +217,33 @@ def wm_api():
     return wm_api_init()
 
 
+@pytest.fixture()
+def wm_async_api():
+    async_api = {name: AsyncRequest(api) for name, api in wm_api_init().items()}
+    yield async_api
+    for api in async_api.values():
+        api.close()
+
+
 def init_db():
-    logger.info("DB initialization. Refreshing views: trades, market data. It will take some time...")
+    logger.info("DB initialization. Refreshing views: trades, market data, positions, coupon principals. It will take some time...")
     success = refresh_trades()
     success = success and refresh_md()
+    success = success and refresh_positions()
+    success = success and refresh_coupon_principals()
     if success:
         logger.info("DB initialization success! The views have been updated.")
     else:
         logger.error("DB initialization failure! The process stopped.")
-        raise
+        raise RuntimeError('DB initialization failure: the views have not been updated')
 
 
 def ccy_code(ccy):
-    api_data = wm_api_init()['common'].post(url_param='currency.all')
-    ccy_dict = {row['name']: row['id'] for row in api_data}
-    return ccy_dict[ccy]
+    def load():
+        api_data = wm_api_init()['common'].post(url_param='currency.all')
+        return {row['name']: row['id'] for row in api_data}
+
+    return reference_cache.get('currencies', load)[ccy]
 
 
 def portfolios_to_test():
@@ -71,32 +256,74 @@ def portfolios_to_test():
     return portfolios
 
 
+def wait_portfolio_ready(p_id, trades_cnt, timeout=PORTFOLIO_READY_TIMEOUT):
+    """
+    :param p_id: portfolio id
+    :param trades_cnt: number of confirmed trades reported by API
+    :param timeout: seconds to wait
+    :return: True if all trades are stored before timeout
+    """
+    # if the API does not report the count, the first stored trade is waited for
+    trades_cnt = trades_cnt if isinstance(trades_cnt, int) else 1
+    deadline = time.time() + timeout
+    while db_portfolio_trades_count(p_id) < trades_cnt:
+        if time.time() > deadline:
+            return False
+        time.sleep(PORTFOLIO_READY_POLL)
+    return True
+
+
+def create_portfolio(wm_api, portfolio, p_data):
+    """
+    :return: True if the portfolio is created and its trades are confirmed and stored
+    """
+    body = {"name": portfolio, "portfolioType": "CLIENT", "currencyId": p_data['ccy']}
+    api_data = wm_api['portfolio'].post(json.dumps(body), url_param='.create')
+    p_id = api_data['id']
+    # load trades into created portfolio
+    with open(p_data['path'], 'rb') as trades_file:
+        p_file = {'file': (p_data['file'], trades_file)}
+        api_data = wm_api['common'].post(files=p_file, url_param='trades/upload?portfolioId=%s' % p_id)
+    loaded_cnt = api_data
+
+    # confirm trades for created portfolio
+    body = {"portfolioId": p_id}
+    api_data = wm_api['portfolio'].post(json.dumps(body), url_param='.confirm.trades')
+    confirmed_cnt = api_data
+    if confirmed_cnt != loaded_cnt:
+        logger.warning("Portfolios initialization. %s is not created properly! "
+                       "Trades loaded: %s. Trades confirmed: %s" % (portfolio, loaded_cnt, confirmed_cnt))
+        return False
+
+    if not wait_portfolio_ready(p_id, confirmed_cnt):
+        logger.warning("Portfolios initialization. %s trades are not stored in %ss!" %
+                       (portfolio, PORTFOLIO_READY_TIMEOUT))
+        return False
+
+    logger.info("Portfolios initialization. %s is created successfully!" % portfolio)
+    return True
+
+
 def create_portfolios():
+    global _portfolio_catalog
     logger.info("Portfolios initialization. Creating test portfolios...")
     wm_api = wm_api_init()
     # create all portfolios from resources folder
     db_portfolios = p_info()
     test_portfolios = portfolios_to_test()
+    new_portfolios = dict()
     for portfolio, p_data in test_portfolios.items():
         if portfolio in db_portfolios:
             logger.info("Portfolios initialization. %s already exists!" % portfolio)
         else:
-            body = {"name": portfolio, "portfolioType": "CLIENT", "currencyId": p_data['ccy']}
-            api_data = wm_api['portfolio'].post(json.dumps(body), url_param='.create')
-            p_id = api_data['id']
-            # load trades into created portfolio
-            p_file = {'file': (p_data['file'], open(p_data['path'], 'rb'))}
-            api_data = wm_api['common'].post(files=p_file, url_param='trades/upload?portfolioId=%s' % p_id)
-            loaded_cnt = api_data
-
-            # confirm trades for created portfolio
-            body = {"portfolioId": p_id}
-            api_data = wm_api['portfolio'].post(json.dumps(body), url_param='.confirm.trades')
-            confirmed_cnt = api_data
-            if confirmed_cnt == loaded_cnt:
-                logger.info("Portfolios initialization. %s is created successfully!" % portfolio)
-                time.sleep(10)
-            else:
-                logger.warning("Portfolios initialization. %s is not created properly! "
-                               "Trades loaded: %s. Trades confirmed: %s" % (portfolio, loaded_cnt, confirmed_cnt))
+            new_portfolios[portfolio] = p_data
+
+    # portfolios are created concurrently, the time is defined by the slowest of them
+    workers = int(env_config.section('WM API').get('bootstrap_workers', 4))
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(new_portfolios) or 1))) as executor:
+        list(executor.map(lambda item: create_portfolio(wm_api, *item), new_portfolios.items()))
 
+    # cached portfolio list does not contain the new ones
+    if new_portfolios:
+        invalidate_reference_cache('portfolios')
+        _portfolio_catalog = None
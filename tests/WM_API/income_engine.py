@@ -0,0 +1,104 @@
+from collections import defaultdict
+from dateutil.relativedelta import relativedelta
+
+from definitions import RECENT_DATE
+from framework.allocations import value_sum
+from tests.db_support import db_get_portfolio_info, db_income_payments
+
+# asset classes paying income: flag of calculate_income() and name of the class
+income_classes = {'equities': 'Equities', 'credit': 'Credit', 'cash and equivalents': 'Cash and Equivalents',
+                  'real estate': 'Real Estate'}
+# income of these classes is paid by the calendar of the instrument, the rest is paid monthly
+calendar_classes = ['Equities', 'Credit']
+
+
+class IncomeEngine(object):
+
+    # this class reads income of all asset classes for a period in one query and breaks it down in memory
+    def __init__(self, portfolio, start_date=None, end_date=RECENT_DATE):
+        """
+        :param portfolio: portfolio name
+        :param start_date: the first date of the period, since inception if not specified
+        :param end_date: the last date of the period
+        """
+        self.portfolio = portfolio
+        self.start_date = start_date or db_get_portfolio_info()[portfolio]['start_date']
+        self.end_date = end_date
+        self.payments = defaultdict(list)
+        for payment in db_income_payments(portfolio, self.start_date, end_date):
+            self.payments[payment['asset_class']].append(payment)
+
+    def per_instrument(self, asset_class):
+        """
+        :return: {instrument: income in instrument currency}, None if no payment of the instrument has amount
+        """
+        amounts = defaultdict(list)
+        for payment in self.payments[asset_class]:
+            amounts[payment['instrument']].append(payment['amount'])
+        income = {instr: value_sum(instr_amounts) for instr, instr_amounts in amounts.items()}
+        # cash income is 0 if there is no cash
+        if asset_class == 'Cash and Equivalents':
+            income = {instr: amount or 0 for instr, amount in income.items()}
+
+        return defaultdict(int, income)
+
+    def total(self, asset_class):
+        """
+        :return: income of the class in portfolio currency, None if no payment has amount
+        """
+        payments = self.payments[asset_class]
+        if not payments:
+            return 0
+        # cash income is reported only while there is cash in the last month
+        if asset_class == 'Cash and Equivalents' and not payments[-1]['amount']:
+            return 0
+
+        return value_sum(payment['exd_amount'] for payment in payments)
+
+    def per_period(self, asset_class, interval='Monthly'):
+        """
+        :param interval: 'Monthly' or 'Daily'
+        :return: {period end date: income in portfolio currency}, income of the instrument calendar is None
+                 if no payment of the period has amount
+        """
+        payments = self.payments[asset_class]
+        if asset_class not in calendar_classes:
+            income = defaultdict(int, {payment['pay_date']: 0 for payment in payments})
+            for payment in payments:
+                income[payment['pay_date']] += payment['exd_amount'] or 0
+            return income
+
+        # payments are reported at the end of month, the last month ends at the end of the period
+        def period_end(pay_date):
+            month_end = pay_date + relativedelta(day=31)
+            return month_end if month_end < self.end_date else self.end_date
+
+        income = defaultdict(int, dict())
+        if interval == 'Daily':
+            # a day total is reported at the end of month, the day of the last instrument in the month wins
+            days = defaultdict(list)
+            for payment in payments:
+                days[payment['pay_date']].append(payment['exd_amount'])
+            for payment in sorted(payments, key=lambda p: p['instrument'].lower()):
+                income[period_end(payment['pay_date'])] = value_sum(days[payment['pay_date']])
+        else:
+            periods = defaultdict(list)
+            for payment in payments:
+                periods[period_end(payment['pay_date'])].append(payment['exd_amount'])
+            income.update({end: value_sum(amounts) for end, amounts in periods.items()})
+
+        return income
+
+    def breakdown(self, asset_class, class_data_only=True, interval=None):
+        """
+        :param asset_class: 'Equities', 'Credit', 'Cash and Equivalents' or 'Real Estate'
+        :param class_data_only: False - income per instrument
+        :param interval: 'Monthly' or 'Daily' - income per period, total income otherwise
+        :return: income of the class as the former per-class income oracles returned it
+        """
+        if not class_data_only:
+            return self.per_instrument(asset_class)
+        if interval in ['Monthly', 'Daily']:
+            return self.per_period(asset_class, interval)
+
+        return self.total(asset_class)
@@ -0,0 +1,110 @@
+from collections import defaultdict
+import numpy as np
+
+from definitions import RECENT_DATE
+from tests.db_support import db_portfolio_trades_columns, db_avg_price, db_close_price_for_dates
+
+
+def to_days(dates):
+    return np.array(dates, dtype='datetime64[D]')
+
+
+class PnlEngine(object):
+
+    # this class calculates unrealized and realized PnL of portfolio instruments for many dates at once
+    # the version is a part of the disk cache key, results of older calculations are not reused
+    version = 2
+
+    def __init__(self, portfolio, end_date=RECENT_DATE):
+        """
+        :param portfolio: portfolio name
+        :param end_date: the latest date PnL can be calculated for
+        """
+        self.portfolio = portfolio
+        self.end_date = end_date
+        self.explained = dict()
+        self.instruments = dict()
+
+        # trades are read by columns ordered by instrument, every instrument is a slice of the arrays
+        trades = db_portfolio_trades_columns(portfolio, end_date)
+        avg_p = db_avg_price(portfolio)
+        instr = trades['instrument']
+        starts = np.flatnonzero(np.r_[True, instr[1:] != instr[:-1]]) if len(instr) else np.array([], dtype=int)
+        for start, stop in zip(starts, np.r_[starts[1:], len(instr)]):
+            avg_instr = avg_p[instr[start]] if instr[start] in avg_p else dict()
+            self.instruments[instr[start]] = self.instrument_arrays(
+                {column: values[start:stop] for column, values in trades.items()}, avg_instr)
+
+    @staticmethod
+    def instrument_arrays(trades, avg_instr):
+        """
+        :param trades: {column: array} of instrument trades ordered by trade time
+        :param avg_instr: {trade date: average price}
+        :return: dict of arrays: trade and position dates, cumulative quantity, multiplier and realized PnL,
+                 average prices
+        """
+        trade_days = trades['trade_time'].astype('datetime64[D]')
+        position_days = trades['position_date'].astype('datetime64[D]')
+        quantity, price, multiplier = trades['quantity'], trades['price'], trades['multiplier']
+
+        avg_dates = sorted(avg_instr.keys())
+        avg_days = to_days(avg_dates)
+        avg_price = np.array([avg_instr[dt] for dt in avg_dates], dtype=float)
+
+        # average price of the trade date, 0 if there is no average price for the date
+        idx = np.searchsorted(avg_days, trade_days)
+        found = idx < len(avg_days)
+        found[found] = avg_days[idx[found]] == trade_days[found]
+        trade_avg = np.where(found, avg_price[np.minimum(idx, len(avg_days) - 1)] if len(avg_days) else 0.0, 0.0)
+
+        # realized PnL is made by Sell trades only
+        realized = np.where(quantity < 0, multiplier * quantity * (trade_avg - price), 0.0)
+
+        return {'trade_days': trade_days,
+                'position_days': position_days,
+                'quantity': np.concatenate([[0.0], np.cumsum(quantity)]),
+                'multiplier': np.concatenate([[0.0], np.maximum.accumulate(multiplier)]),
+                'realized': np.concatenate([[0.0], np.cumsum(realized)]),
+                'avg_days': avg_days,
+                'avg_price': avg_price}
+
+    def explain(self, dates):
+        """
+        :param dates: list of dates not later than end_date
+        :return: {date: (unrealized PnL per instrument, realized PnL per instrument)}
+        """
+        new_dates = sorted(set(dt for dt in dates if dt not in self.explained))
+        if new_dates:
+            self.explained.update(self.calculate(new_dates))
+
+        return {dt: self.explained[dt] for dt in dates}
+
+    def calculate(self, dates):
+        days = to_days(dates)
+        close = db_close_price_for_dates(self.portfolio, dates)
+        explained = {dt: (defaultdict(int, dict()), defaultdict(int, dict())) for dt in dates}
+
+        for instr, data in self.instruments.items():
+            # number of trades in the position of the date and trades done before the date
+            held = np.searchsorted(data['position_days'], days, side='right')
+            before = np.searchsorted(data['trade_days'], days, side='left')
+            position = data['quantity'][held] * data['multiplier'][held]
+            realized = data['realized'][before]
+
+            # the closest average price not later than the date, 0 before the first trade
+            avg_idx = np.searchsorted(data['avg_days'], days, side='right') - 1
+            if len(data['avg_price']):
+                avg_price = np.where(avg_idx >= 0, data['avg_price'][np.maximum(avg_idx, 0)], 0.0)
+            else:
+                avg_price = np.zeros(len(days))
+
+            for n, dt in enumerate(dates):
+                # instrument is not in portfolio yet
+                if not held[n]:
+                    continue
+                pnl_u, pnl_r = explained[dt]
+                close_dt = close[dt]
+                pnl_u[instr] = float(position[n] * (float(close_dt.get(instr, 0)) - avg_price[n])) if close_dt else 0
+                pnl_r[instr] = float(realized[n])
+
+        return explained
@@ -1,58 +1,147 @@
+import hashlib
+import os
+import shutil
 from datetime import datetime, timedelta
-from joblib import Parallel, delayed, parallel_backend
+from joblib import Memory, Parallel, cpu_count, delayed
+from joblib.parallel import LokyBackend
 
+from definitions import PNL_CACHE_DIR, PNL_MODE, PNL_WORKERS
+from framework.dbpostgres import db_config, db_max_connections
+from framework.timing import timed
 from tests.db_support import *
+from tests.WM_API.income_engine import IncomeEngine, income_classes
+from tests.WM_API.pnl_engine import PnlEngine
 
 asset_classes = ['alternatives', 'cash and equivalents', 'commodities',
                  'credit', 'equities', 'real assets', 'real estate']
 totals = ['pnl', 'nav', 'income']
-
-
-def pnl_explained(portfolio, pnl_date):
-    pnl_u, pnl_r = defaultdict(int, dict()), defaultdict(int, dict())
-    positions = db_instrument_position(portfolio, pnl_date)
-    trades = db_portfolio_trades(portfolio, pnl_date, raw_view=True)
-    # if there are no instruments in portfolio return empty dict
-    if not positions:
-        return pnl_u, pnl_r
-    # get average price for trade dates
-    avg_p = db_avg_price(portfolio)
-    close = db_close_price(portfolio, pnl_date)
-
-    for instr in positions:
-        pnl = 0
-        trade_dates = sorted(avg_p[instr].keys())
-        # get the closest avg_price if pnl_date is not equal to trade date
-        if pnl_date not in trade_dates:
-            if min(trade_dates) > pnl_date:
-                avg_p[instr].update({pnl_date: 0.0})
-            else:
-                nearest_trade_date = max(dt for dt in trade_dates if dt <= pnl_date)
-                avg_p[instr].update({pnl_date: avg_p[instr][nearest_trade_date]})
-        pnl_u[instr] = positions[instr] * (close[instr] - avg_p[instr][pnl_date]) if close else 0
-        for trade in trades[instr]:
-            # calculate only if it is Sell trade and trade happened before pnl_date
-            if trade['trade_time'] < pnl_date and trade['quantity'] < 0:
-                pnl += trade['multiplier'] * trade['quantity'] * (avg_p[instr][trade['trade_time']] - trade['price'])
-        pnl_r[instr] = pnl
-
-    return pnl_u, pnl_r
-
-
+# worker processes calculating PnL, reused by all tests of the session, see pnl_workers()
+_pnl_workers = None
+
+
+def pnl_explained(portfolio, pnl_date, pnl_engine=None):
+    # trades, average and close prices are loaded by the engine once for all dates
+    pnl_engine = pnl_engine or PnlEngine(portfolio, pnl_date)
+
+    return pnl_engine.explain([pnl_date])[pnl_date]
+
+
+def context_explained(portfolio, pnl_date, context):
+    # the engine explains all dates requested from the context in one pass at the first miss
+    return context.engine.explain(sorted(context.pending | {pnl_date}))[pnl_date]
+
+
+def pnl_cache_root(location=PNL_CACHE_DIR):
+    """
+    :param location: root directory of the disk cache
+    :return: directory for the DB of the config or None if the disk cache is off, checkouts and sessions
+             testing other DBs keep their results apart
+    """
+    if not location:
+        return None
+    db = db_config(config)
+
+    return os.path.join(location, hashlib.md5(repr((db['host'], db['port'], db['database'])).encode()).hexdigest()[:12])
+
+
+def pnl_cache_location(version, location=PNL_CACHE_DIR):
+    """
+    :param version: refresh version of trades and market data, see db_trades_version()
+    :param location: root directory of the disk cache
+    :return: directory for the version or None if the disk cache is off
+    """
+    root = pnl_cache_root(location)
+    if not root:
+        return None
+
+    return os.path.join(root, hashlib.md5(repr((PnlEngine.version, version)).encode()).hexdigest()[:12])
+
+
+def prune_pnl_cache(version=None, location=PNL_CACHE_DIR):
+    """
+    this function removes results cached for other versions of the DB, it is called once at the session start
+    :param version: refresh version of trades and market data, taken from DB if not specified
+    :param location: root directory of the disk cache
+    :return: None
+    """
+    root = pnl_cache_root(location)
+    if not root or not os.path.isdir(root):
+        return
+    current = os.path.basename(pnl_cache_location(version or db_trades_version(), location))
+    for name in os.listdir(root):
+        if name != current:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+class PnlContext(object):
+
+    # this class memoizes inputs of PnL for a portfolio by date, the disk cache is shared by joblib workers
+    def __init__(self, portfolio, end_date=RECENT_DATE, version=None):
+        """
+        :param portfolio: portfolio name
+        :param end_date: the latest date PnL can be calculated for
+        :param version: refresh version of trades and market data, taken from DB if not specified
+        """
+        self.portfolio = portfolio
+        self.end_date = end_date
+        self.memory = Memory(pnl_cache_location(version or db_trades_version()), verbose=0)
+        self.values = dict()
+        self.pending = set()
+        self._engine = None
+
+    @property
+    def engine(self):
+        # trades and prices are loaded only if some explained PnL is not cached yet
+        if self._engine is None:
+            self._engine = PnlEngine(self.portfolio, self.end_date)
+        return self._engine
+
+    def memo(self, func, *args, **kwargs):
+        """
+        :param func: module level function, 'context' argument is not a part of the key
+        :return: result of func(*args, **kwargs) from memory, disk or DB
+        """
+        key = (func.__name__,) + args + tuple(sorted((k, v) for k, v in kwargs.items() if k != 'context'))
+        if key not in self.values:
+            cached = self.memory.cache(func, ignore=['context'] if 'context' in kwargs else None)
+            self.values[key] = cached(*args, **kwargs)
+
+        return self.values[key]
+
+    def explained(self, dates):
+        """
+        :return: {date: (unrealized PnL per instrument, realized PnL per instrument)}
+        """
+        self.pending.update(dates)
+
+        return {dt: self.memo(context_explained, self.portfolio, dt, context=self) for dt in dates}
+
+    def income(self, income_date):
+        return self.memo(calculate_income, self.portfolio, end_date=income_date, detailed=True, aggregated=False)
+
+    def fees(self, fee_date):
+        # full history of fees is taken once and resolved for each date
+        return fees_at_date(self.memo(db_fees, self.portfolio), fee_date)
+
+    def fx_rate(self, fx_date):
+        return self.memo(db_fx_rate, self.portfolio, fx_date)
+
+    def instruments_classes(self, status_date):
+        return self.memo(db_instruments_classes, self.portfolio, status_date, asset_class=True)
+
+
+@timed('oracle')
 def calculate_income(portfolio, start_date=None, end_date=RECENT_DATE, **kwargs):
     def flags(s):
         return kwargs[s] if kwargs and s in kwargs else all([k not in kwargs for k in asset_classes])
 
+    # income of all classes is read by one query, the classes are broken down from it
+    engine = IncomeEngine(portfolio, start_date, end_date)
     income = defaultdict(int, dict())
     params = {"class_data_only": flags('aggregated'), "interval": flags('interval')}
-    if flags('equities'):
-        income['Equities'] = db_dividends(portfolio, start_date, end_date, **params)
-    if flags('credit'):
-        income['Credit'] = db_coupons(portfolio, start_date, end_date, **params)
-    if flags('cash and equivalents'):
-        income['Cash and Equivalents'] = db_cash_income(portfolio, start_date, end_date, **params)
-    if flags('real estate'):
-        income['Real Estate'] = db_non_market_income(portfolio, start_date, end_date, **params)
+    for cls, name in income_classes.items():
+        if flags(cls):
+            income[name] = engine.breakdown(name, **params)
 
     if flags('aggregated'):
         if flags('all'):
@@ -84,20 +173,22 @@ def calculate_income(portfolio, start_date=None, end_date=RECENT_DATE, **kwargs)
     return income_total
 
 
-def calculate_pnl(portfolio, start_date, end_date, **kwargs):
+@timed('oracle')
+def calculate_pnl(portfolio, start_date, end_date, context=None, **kwargs):
     def flags(s):
         return kwargs[s] if kwargs and s in kwargs else all([k not in kwargs for k in asset_classes])
 
     # start_date should be 1 day earlier than date requested
     st_date = start_date - timedelta(days=1)
+    # inputs of boundary dates are shared with other periods through the context
+    context = context or PnlContext(portfolio, end_date)
     pnl_u, pnl_r = dict(), dict()
-    pnl_u[st_date], pnl_r[st_date] = pnl_explained(portfolio, st_date)
-    pnl_u[end_date], pnl_r[end_date] = pnl_explained(portfolio, end_date)
-    income = {st_date: calculate_income(portfolio, end_date=st_date, **{'detailed': True, 'aggregated': False}),
-              end_date: calculate_income(portfolio, end_date=end_date, **{'detailed': True, 'aggregated': False})}
-    fees = {st_date: db_fees(portfolio, fee_date=st_date), end_date: db_fees(portfolio, fee_date=end_date)}
-    i_classes = db_instruments_classes(portfolio, end_date, asset_class=True)
-    fx = {st_date: db_fx_rate(portfolio, st_date), end_date: db_fx_rate(portfolio, end_date)}
+    for dt, explained in context.explained([st_date, end_date]).items():
+        pnl_u[dt], pnl_r[dt] = explained
+    income = {st_date: context.income(st_date), end_date: context.income(end_date)}
+    fees = {st_date: context.fees(st_date), end_date: context.fees(end_date)}
+    i_classes = context.instruments_classes(end_date)
+    fx = {st_date: context.fx_rate(st_date), end_date: context.fx_rate(end_date)}
     # summarize all PnL for portfolio
     if flags('all') and flags('aggregated'):
         pnl = {st_date: 0.0, end_date: 0.0}
@@ -128,23 +219,74 @@ def calculate_pnl(portfolio, start_date, end_date, **kwargs):
                 return {end_date: pnl_total[cls.capitalize()]}
 
 
+@timed('oracle')
+def calculate_pnl_for_periods(portfolio, periods, context, **kwargs):
+    """
+    :param portfolio: portfolio name
+    :param periods: list of (start date, end date)
+    :param context: PnlContext object
+    :return: list of calculate_pnl() results
+    """
+    return [calculate_pnl(portfolio, st, d, context=context, **kwargs) for st, d in periods]
+
+
+def pnl_workers():
+    """
+    :return: Parallel object with the number of workers limited by CPU cores and DB connections
+    """
+    global _pnl_workers
+    if _pnl_workers is None:
+        # every worker keeps a DB pool of its own
+        db_limit = max(1, db_max_connections(config) // db_pool(config).max_idle)
+        n_jobs = max(1, min(cpu_count(), db_limit, PNL_WORKERS or cpu_count()))
+        # loky keeps the processes alive between calls with the same number of workers,
+        # BLAS and OpenMP of every worker run in one thread not to oversubscribe the cores
+        _pnl_workers = Parallel(n_jobs=n_jobs, backend=LokyBackend(inner_max_num_threads=1))
+
+    return _pnl_workers
+
+
+def date_chunks(periods, n):
+    """
+    :return: periods split into n contiguous chunks at most, adjacent periods share boundary dates
+    """
+    if not periods:
+        return list()
+    size = -(-len(periods) // n)
+
+    return [periods[i:i + size] for i in range(0, len(periods), size)]
+
+
+@timed('oracle')
 def calculate_nav(portfolio, end_date=datetime.now().date(), **kwargs):
+    return calculate_nav_for_dates(portfolio, [end_date], **kwargs)
+
+
+@timed('oracle')
+def calculate_nav_for_dates(portfolio, dates, **kwargs):
     def flags(s):
         return kwargs[s] if kwargs and s in kwargs else all([k not in kwargs for k in asset_classes])
 
-    nav_total = defaultdict(int, db_wealth_per_asset(portfolio, end_date))
-    nav = {end_date: nav_total}
-    # if the total is required, get sum for asset classes
-    if flags('all') and flags('aggregated'):
-        return {end_date: sum([v for k, v in nav_total.items() if k.lower() in asset_classes])}
-    elif flags('all'):
-        return nav
-    else:
-        for cls in asset_classes:
-            if flags(cls):
-                return {end_date: nav_total[cls.capitalize()]}
+    # nav for all dates is taken by one query
+    nav_dates = db_wealth_per_asset_for_dates(portfolio, dates)
+    nav = dict()
+    for end_date, nav_assets in nav_dates.items():
+        nav_total = defaultdict(int, nav_assets)
+        # if the total is required, get sum for asset classes
+        if flags('all') and flags('aggregated'):
+            nav[end_date] = sum([v for k, v in nav_total.items() if k.lower() in asset_classes])
+        elif flags('all'):
+            nav[end_date] = nav_total
+        else:
+            for cls in asset_classes:
+                if flags(cls):
+                    nav[end_date] = nav_total[cls.capitalize()]
+                    break
+
+    return nav
 
 
+@timed('oracle')
 def calculate_totals_for_period(portfolio, start_date, end_date, **kwargs):
     def flags(s):
         return kwargs[s] if kwargs and s in kwargs else all([k not in kwargs for k in totals])
@@ -165,25 +307,36 @@ def calculate_totals_for_period(portfolio, start_date, end_date, **kwargs):
 
     dates = sorted(date_generated.values())
     if flags('nav'):
-        nav = Parallel(n_jobs=len(dates))(delayed(calculate_nav)(portfolio, d, **kwargs) for d in dates)
+        nav = calculate_nav_for_dates(portfolio, dates, **kwargs)
     if flags('pnl'):
-        with parallel_backend('loky', inner_max_num_threads=2):
-            pnl = Parallel(n_jobs=len(dates))(delayed(calculate_pnl)(
-                portfolio, [d.replace(day=1), start_date][start_date > d.replace(day=1)]
-                if kwargs['interval'] == 'Monthly' else d, d, **kwargs
-            ) for d in dates)
+        periods = [([d.replace(day=1), start_date][start_date > d.replace(day=1)]
+                    if kwargs['interval'] == 'Monthly' else d, d) for d in dates]
+        # unrealized and realized PnL for all period bounds is calculated in one pass before workers start
+        context = PnlContext(portfolio, end_date)
+        context.explained([st - timedelta(days=1) for st, _ in periods] + dates)
+        context.fees(end_date)
+        if PNL_MODE == 'vectorized':
+            pnl = calculate_pnl_for_periods(portfolio, periods, context, **kwargs)
+        else:
+            workers = pnl_workers()
+            # timings are not collected in the workers, their SQL and calculations are in the oracle time of this call
+            chunks = workers(delayed(calculate_pnl_for_periods)(portfolio, chunk, context, **kwargs)
+                             for chunk in date_chunks(periods, workers.n_jobs))
+            pnl = [entry for chunk in chunks for entry in chunk]
 
     return {'income': income,
             'pnl': dict((dt, entry[dt]) for entry in pnl for dt in entry),
-            'nav': dict((dt, entry[dt]) for entry in nav for dt in entry)}
+            'nav': nav}
 
 
+@timed('oracle')
 def calculate_yield(base, nav):
     yield_ = base * 100 / nav if nav else 0
 
     return yield_
 
 
+@timed('oracle')
 def calculate_performance(portfolio, start_date, end_date, **kwargs):
     performance, month_return = [0], list()
 
@@ -203,6 +356,7 @@ def calculate_performance(portfolio, start_date, end_date, **kwargs):
     return m_perf
 
 
+@timed('oracle')
 def calculate_benchmark_performance(benchmark, start_date, end_date):
     performance, month_return, nav = [0], list(), dict()
 
@@ -0,0 +1,155 @@
+"""
+Latency of WM API endpoints on the request bodies the tests send.
+
+Record the bodies first: pytest tests/WM_API --record-bodies bodies.json
+Usage: python -m tests.benchmarks.api_latency bodies.json --repeat 20 --concurrency 4 [--baseline latency.json]
+       python -m tests.benchmarks.api_latency bodies.json --fake 20   (offline, against fake_gateway)
+
+Regressions are the endpoints whose p95 grew more than the threshold against the baseline,
+the exit code is 1 if there are any.
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit
+
+import numpy as np
+import requests
+
+from definitions import config
+from framework.configread import ReadConfig
+from framework.request import http_session
+from tests.benchmarks.fake_gateway import FakeGateway
+
+
+def auth_headers():
+    headers = {'Content-Type': 'application/json'}
+    api_connection = ReadConfig(config).section('WM API AUTH')
+    if api_connection:
+        auth_line = '%s:%s' % (api_connection['username'], api_connection['password'])
+        headers['Authorization'] = 'Basic %s' % base64.b64encode(auth_line.encode('utf-8')).decode('utf-8')
+    return headers
+
+
+def load_calls(path, gateway=None):
+    """
+    :param path: file saved by pytest --record-bodies
+    :param gateway: scheme and host to send the calls to instead of the recorded ones
+    :return: {(endpoint, portfolio id): [(url, body)]}
+    """
+    with open(path) as bodies_file:
+        recorded = json.load(bodies_file)
+
+    calls = defaultdict(list)
+    for call in recorded:
+        url = call['url'] + call['url_param']
+        if gateway:
+            target = urlsplit(gateway)
+            url = urlunsplit(urlsplit(url)._replace(scheme=target.scheme, netloc=target.netloc))
+        try:
+            portfolio = json.loads(call['body']).get('portfolioId')
+        except (ValueError, AttributeError):
+            portfolio = None
+        endpoint = urlsplit(call['url']).path.rstrip('/').split('/')[-1] + call['url_param']
+        calls[(endpoint, portfolio)].append((url, call['body']))
+
+    return calls
+
+
+def replay(session, headers, calls, repeat, concurrency, timeout=30):
+    """
+    :param timeout: seconds to wait for a response, the calls without one are errors
+    :return: latencies of successful calls, seconds, number of errors and throughput, calls per second
+    """
+    def send(call):
+        url, body = call
+        started = time.perf_counter()
+        try:
+            response = session.post(url, data=body, headers=headers, timeout=timeout, verify=False)
+        except requests.RequestException:
+            return None
+        spent = time.perf_counter() - started
+        return spent if response.status_code in [200, 202] else None
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, calls * repeat))
+    wall = time.perf_counter() - started
+
+    latencies = [r for r in results if r is not None]
+    return latencies, len(results) - len(latencies), len(results) / wall if wall else 0.0
+
+
+def measure(calls, repeat=10, concurrency=4, timeout=30):
+    """
+    :return: {'endpoint|portfolio': {p50, p95, p99 in ms, rps, errors}}
+    """
+    session = http_session(pool_size=concurrency, retries=0)
+    headers = auth_headers()
+    stats = dict()
+    for (endpoint, portfolio), group in sorted(calls.items(), key=lambda c: (c[0][0], str(c[0][1]))):
+        latencies, errors, rps = replay(session, headers, group, repeat, concurrency, timeout)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000 if latencies else (0.0, 0.0, 0.0)
+        stats['%s|%s' % (endpoint, portfolio)] = {'p50': round(p50, 2), 'p95': round(p95, 2), 'p99': round(p99, 2),
+                                                  'rps': round(rps, 2), 'errors': errors}
+    session.close()
+
+    return stats
+
+
+def regressions(stats, baseline, threshold):
+    """
+    :return: keys whose p95 is more than threshold above the baseline
+    """
+    return [key for key, data in stats.items()
+            if key in baseline and baseline[key]['p95'] and data['p95'] > baseline[key]['p95'] * (1 + threshold)]
+
+
+def run(bodies, repeat=10, concurrency=4, gateway=None, baseline=None, save=False, threshold=0.2, fake=None,
+        timeout=30):
+    if fake is not None:
+        with FakeGateway(latency=fake / 1000) as fake_gateway:
+            stats = measure(load_calls(bodies, fake_gateway.url), repeat, concurrency, timeout)
+    else:
+        stats = measure(load_calls(bodies, gateway), repeat, concurrency, timeout)
+
+    previous = dict()
+    if baseline and os.path.exists(baseline):
+        with open(baseline) as baseline_file:
+            previous = json.load(baseline_file)
+    slow = regressions(stats, previous, threshold)
+
+    print('%-50s %9s %9s %9s %9s %6s' % ('endpoint|portfolio', 'p50, ms', 'p95, ms', 'p99, ms', 'rps', 'errors'))
+    for key, data in stats.items():
+        print('%-50s %9.2f %9.2f %9.2f %9.2f %6s%s' % (key, data['p50'], data['p95'], data['p99'], data['rps'],
+                                                       data['errors'], '  REGRESSION' if key in slow else ''))
+
+    if baseline and save:
+        with open(baseline, 'w') as baseline_file:
+            json.dump(stats, baseline_file, indent=2)
+
+    return slow
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay recorded WM API bodies and report latency percentiles')
+    parser.add_argument('bodies', help='file saved by pytest --record-bodies')
+    parser.add_argument('--repeat', type=int, default=10, help='number of times each body is sent')
+    parser.add_argument('--concurrency', type=int, default=4, help='number of calls in flight')
+    parser.add_argument('--gateway', default=None, help='scheme and host to use instead of the recorded ones')
+    parser.add_argument('--baseline', default=None, help='JSON file with the baseline latencies')
+    parser.add_argument('--save-baseline', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed growth of p95, share of baseline')
+    parser.add_argument('--fake', type=float, default=None, metavar='MS',
+                        help='send the calls to a local fake gateway answering with the delay, milliseconds')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds to wait for a response, then it is an error')
+    args = parser.parse_args()
+
+    found = run(args.bodies, args.repeat, args.concurrency, args.gateway, args.baseline, args.save_baseline,
+                args.threshold, args.fake, args.timeout)
+    sys.exit(1 if found else 0)
@@ -0,0 +1,117 @@
+"""
+Timing of the recursive SQL vs the streaming Python average price on synthetic trades.
+
+Usage: python -m tests.benchmarks.avg_price --trades 50000 --instruments 100
+"""
+import argparse
+import time
+
+from psycopg2 import extensions
+
+from definitions import config
+from framework.avg_price import AvgPrice
+from framework.dbpostgres import DbPostgres
+from tests.db_support import avg_price_recursive_sql, avg_price_trades_sql
+
+schema = 'avg_price_bench'
+portfolio = 'Avg Price Bench'
+
+
+def create_dataset(connector, trades, instruments):
+    """
+    :param connector: DbPostgres object
+    :param trades: number of trades in portfolio
+    :param instruments: number of instruments the trades are spread over
+    :return: None
+    """
+    connector.safe_execute("""DROP SCHEMA IF EXISTS %(schema)s CASCADE;
+        CREATE SCHEMA %(schema)s;
+        CREATE TABLE %(schema)s.trades AS
+            SELECT '%(portfolio)s'::text as portfolio,
+                   t.n %% %(instruments)s + 1 as instrument_id,
+                   'INSTR ' || (t.n %% %(instruments)s + 1) as instrument,
+                   timestamp '2000-01-01' + (t.n / %(instruments)s) * interval '1 day' as trade_time,
+                   (CASE WHEN random() < 0.35 THEN -1 ELSE 1 END) * ceil(random() * 100) as quantity,
+                   round((10 + random() * 100)::numeric, 4)::float as price
+            FROM generate_series(0, %(trades)s - 1) as t(n);
+        CREATE INDEX ON %(schema)s.trades (portfolio, instrument_id, trade_time);
+        ANALYZE %(schema)s.trades;""" % {
+        'schema': schema, 'portfolio': portfolio, 'trades': trades, 'instruments': instruments})
+
+
+def time_sql(connector, table):
+    """
+    :return: {instrument: {date: avg_price}} and seconds spent, None for both if the statement timed out
+    """
+    started = time.perf_counter()
+    try:
+        rows = connector.safe_execute(avg_price_recursive_sql(portfolio, trades=table))
+    except extensions.QueryCanceledError:
+        return None, None
+    finally:
+        connector.connection.rollback()
+
+    avg = dict()
+    for row in rows:
+        avg.setdefault(row['instrument'], dict())[row['trade_time'].date()] = row['avg_price']
+
+    return avg, time.perf_counter() - started
+
+
+def time_python(connector, table):
+    """
+    :return: {instrument: {date: avg_price}} and seconds spent including the fetch of trades
+    """
+    started = time.perf_counter()
+    avg = AvgPrice()
+    for trade in connector.safe_execute(avg_price_trades_sql(portfolio, trades=table)):
+        avg.add(trade['instrument'], trade['trade_date'], trade['quantity'], trade['price'])
+    connector.connection.rollback()
+
+    return avg.series(), time.perf_counter() - started
+
+
+def max_difference(expected, actual):
+    """
+    :return: the largest absolute difference of prices and the number of dates missing in any of results
+    """
+    diff, missing = 0.0, 0
+    for instr in set(expected) | set(actual):
+        exp_instr, act_instr = expected.get(instr, dict()), actual.get(instr, dict())
+        missing += len(set(exp_instr) ^ set(act_instr))
+        for dt in set(exp_instr) & set(act_instr):
+            diff = max(diff, abs(float(exp_instr[dt]) - float(act_instr[dt])))
+
+    return diff, missing
+
+
+def run(trades=50000, instruments=100, timeout=60, keep=False):
+    connector = DbPostgres(config)
+    create_dataset(connector, trades, instruments)
+    connector.safe_execute('SET statement_timeout = %s;' % (timeout * 60 * 1000))
+    table = '%s.trades' % schema
+
+    print('Average price: %s trades, %s instruments, timeout %s min' % (trades, instruments, timeout))
+    python_avg, python_spent = time_python(connector, table)
+    print('%-10s %10.2fs' % ('python', python_spent))
+    sql_avg, sql_spent = time_sql(connector, table)
+    if sql_spent is None:
+        print('%-10s %11s' % ('recursive', 'timeout'))
+    else:
+        diff, missing = max_difference(sql_avg, python_avg)
+        print('%-10s %10.2fs  max difference %.6f, dates missing %s' % ('recursive', sql_spent, diff, missing))
+
+    if not keep:
+        connector.safe_execute('DROP SCHEMA IF EXISTS %s CASCADE;' % schema)
+    connector.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare recursive SQL and streaming Python average price')
+    parser.add_argument('--trades', type=int, default=50000)
+    parser.add_argument('--instruments', type=int, default=100)
+    parser.add_argument('--timeout', type=int, default=60, help='statement timeout, minutes')
+    parser.add_argument('--keep', action='store_true', help='keep the synthetic schema after the run')
+    args = parser.parse_args()
+
+    run(args.trades, args.instruments, args.timeout, args.keep)
@@ -0,0 +1,120 @@
+"""
+EXPLAIN of representative oracle queries without and with the oracle indexes.
+
+Usage: python -m tests.benchmarks.explain_report [--portfolio NAME] [--no-analyze] [--plans]
+
+The indexes are dropped inside a transaction which is rolled back, so the tables are locked for the
+time of 'before' part of the report, but nothing is changed in the database.
+"""
+import argparse
+import json
+
+from definitions import config, RECENT_DATE
+from framework.dbpostgres import DbPostgres
+from framework import queries
+from tests import db_support
+from tests.db_support import db_get_portfolio_info, db_create_indexes, oracle_indexes
+
+
+class SqlCaptured(Exception):
+    pass
+
+
+def capture_sql(oracle, *args, **kwargs):
+    """
+    :param oracle: function from db_support
+    :return: the first query the oracle sends to DB
+    """
+    captured = list()
+
+    def record(sql, *args, **kwargs):
+        captured.append(sql)
+        raise SqlCaptured
+
+    # prepared statements are explained with the values in place of the parameters
+    def record_prepared(name, *params):
+        record(queries.oracle_queries.inline(name, params))
+
+    senders = {name: getattr(db_support, name) for name in ['psg_db', 'psg_db_stream', 'psg_db_columns', 'psg_db_prepared']}
+    db_support.psg_db = db_support.psg_db_stream = db_support.psg_db_columns = record
+    db_support.psg_db_prepared = record_prepared
+    try:
+        oracle(*args, **kwargs)
+    except SqlCaptured:
+        pass
+    finally:
+        for name, sender in senders.items():
+            setattr(db_support, name, sender)
+
+    return captured[0]
+
+
+def oracle_queries(portfolio, date):
+    return {
+        'db_total_wealth': capture_sql(db_support.db_total_wealth, portfolio, date),
+        'db_wealth_per_asset': capture_sql(db_support.db_wealth_per_asset, portfolio, date),
+        'db_valued_holdings': capture_sql(db_support.db_allocations, portfolio, date),
+        'db_custodian_holdings': capture_sql(lambda: db_support.psg_db_prepared('db_custodian_holdings', date, portfolio)),
+        'db_top_positions': capture_sql(db_support.db_top_positions, portfolio, date),
+        'db_instrument_position': capture_sql(db_support.db_instrument_position, portfolio, date),
+        'db_portfolio_trades': capture_sql(db_support.db_portfolio_trades, portfolio, date),
+        'db_portfolio_trades_columns': capture_sql(db_support.db_portfolio_trades_columns, portfolio, date),
+        'db_close_price': capture_sql(db_support.db_close_price, portfolio, date),
+        'db_fx_rate': capture_sql(db_support.db_fx_rate, portfolio, date),
+        'db_income_payments': capture_sql(db_support.db_income_payments, portfolio,
+                                          date.replace(year=date.year - 1), date),
+    }
+
+
+def explain(connector, queries, analyze=True):
+    """
+    :return: dict with plan, planning/execution time and total cost per query
+    """
+    plans = dict()
+    for name, sql in queries.items():
+        connector.cursor.execute('EXPLAIN (%sFORMAT JSON) %s' % (['', 'ANALYZE, '][analyze], sql))
+        plan = connector.cursor.fetchone()['QUERY PLAN']
+        plan = json.loads(plan)[0] if isinstance(plan, str) else plan[0]
+        plans[name] = {'plan': plan['Plan'], 'cost': plan['Plan']['Total Cost'],
+                       'planning': plan.get('Planning Time'), 'execution': plan.get('Execution Time')}
+
+    return plans
+
+
+def run(portfolio=None, analyze=True, show_plans=False):
+    portfolios = db_get_portfolio_info()
+    portfolio = portfolio or sorted(portfolios)[0]
+    queries = oracle_queries(portfolio, RECENT_DATE)
+
+    connector = DbPostgres(config)
+    # 'before': the indexes are dropped in the transaction which is never committed
+    for relation, indexes in oracle_indexes.items():
+        for columns in indexes:
+            connector.cursor.execute('DROP INDEX IF EXISTS %s_%s_idx;' % (relation, columns.replace(', ', '_')))
+    before = explain(connector, queries, analyze)
+    connector.connection.rollback()
+
+    for relation in oracle_indexes:
+        db_create_indexes(relation)
+    after = explain(connector, queries, analyze)
+    connector.connection.rollback()
+    connector.close()
+
+    metric = ['cost', 'execution'][analyze]
+    print('Oracle queries for %s on %s, %s' % (portfolio, RECENT_DATE, ['total cost', 'execution time, ms'][analyze]))
+    print('%-24s %14s %14s %8s' % ('query', 'no indexes', 'indexes', 'ratio'))
+    for name in queries:
+        b, a = before[name][metric], after[name][metric]
+        print('%-24s %14.2f %14.2f %8.1f' % (name, b, a, b / a if a else 0))
+        if show_plans:
+            print(json.dumps({'before': before[name]['plan'], 'after': after[name]['plan']}, indent=2, default=str))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='EXPLAIN oracle queries without and with the oracle indexes')
+    parser.add_argument('--portfolio', help='portfolio name, the first one by name if not set')
+    parser.add_argument('--no-analyze', action='store_true', help='compare planner costs without running queries')
+    parser.add_argument('--plans', action='store_true', help='print the plans too')
+    args = parser.parse_args()
+
+    run(args.portfolio, not args.no_analyze, args.plans)
@@ -0,0 +1,72 @@
+"""
+Local stand-in of WM gateway for offline runs of tests/benchmarks/api_latency.py.
+
+Usage: python -m tests.benchmarks.fake_gateway --port 8088 --latency 20
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeGateway(object):
+
+    # this class answers every POST with 200 and '{}' after the configured delay
+    def __init__(self, port=0, latency=0.0):
+        """
+        :param port: port to listen on, 0 - any free port
+        :param latency: response delay, seconds
+        """
+        self.latency = latency
+        self.requests = 0
+        gateway = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                gateway.requests += 1
+                time.sleep(gateway.latency)
+                content = json.dumps(dict()).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingServer(('127.0.0.1', port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%s' % self.server.server_address[1]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Answer WM API calls with empty JSON')
+    parser.add_argument('--port', type=int, default=8088)
+    parser.add_argument('--latency', type=float, default=0, help='response delay, milliseconds')
+    args = parser.parse_args()
+
+    with FakeGateway(args.port, args.latency / 1000) as fake:
+        print('Fake gateway is listening on %s' % fake.url)
+        try:
+            fake.thread.join()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,106 @@
+"""
+Timing of window vs recursive gap fill of market data on synthetic prices.
+
+Usage: python -m tests.benchmarks.gap_fill --years 10 --instruments 5000
+"""
+import argparse
+import time
+from datetime import date
+
+from psycopg2 import extensions
+
+from definitions import config
+from framework.dbpostgres import DbPostgres
+from tests.db_support import market_data_full_sql, fx_rates_full_sql
+
+schema = 'gap_fill_bench'
+currencies = ['EUR', 'GBP', 'CHF', 'JPY', 'CAD', 'AUD', 'SEK', 'NOK', 'HKD', 'SGD']
+
+
+def create_dataset(connector, years, instruments, density):
+    """
+    :param connector: DbPostgres object
+    :param years: length of calendar
+    :param instruments: number of instruments with prices
+    :param density: share of working days with prices
+    :return: None
+    """
+    end = date.today()
+    start = end.replace(year=end.year - years)
+    connector.safe_execute("""DROP SCHEMA IF EXISTS %(schema)s CASCADE;
+        CREATE SCHEMA %(schema)s;
+        CREATE TABLE %(schema)s.market_data_calendar AS
+            SELECT t.date as calc_date, lead(t.date) OVER (ORDER BY t.date) as next_date
+            FROM generate_series(date '%(start)s', date '%(end)s', interval '1 day') as t(date);
+        CREATE TABLE %(schema)s.wm_market_data AS
+            SELECT instr.id as instrument_id, dates.calc_date as close_timestamp,
+                   round((10 + random() * 100)::numeric, 4) as close_price
+            FROM generate_series(1, %(instruments)s) as instr(id)
+                     JOIN %(schema)s.market_data_calendar dates ON extract(isodow FROM dates.calc_date) < 6
+            WHERE random() < %(density)s;
+        CREATE TABLE %(schema)s.wm_exchange_rate AS
+            SELECT dates.calc_date as rate_timestamp, 'USD'::text as from_currency, ccy.name as to_currency,
+                   round((0.5 + random())::numeric, 6) as rate_value
+            FROM unnest(ARRAY['%(currencies)s']) as ccy(name)
+                     JOIN %(schema)s.market_data_calendar dates ON extract(isodow FROM dates.calc_date) < 6
+            WHERE random() < %(density)s;
+        CREATE INDEX ON %(schema)s.market_data_calendar (calc_date);
+        CREATE INDEX ON %(schema)s.wm_market_data (instrument_id, close_timestamp);
+        CREATE INDEX ON %(schema)s.wm_exchange_rate (from_currency, to_currency, rate_timestamp);
+        ANALYZE %(schema)s.market_data_calendar;
+        ANALYZE %(schema)s.wm_market_data;
+        ANALYZE %(schema)s.wm_exchange_rate;""" % {
+        'schema': schema, 'start': start, 'end': end, 'instruments': instruments, 'density': density,
+        'currencies': "', '".join(currencies)})
+
+
+def time_query(connector, sql):
+    """
+    :return: number of rows and seconds spent or None for both if the statement timed out
+    """
+    started = time.perf_counter()
+    try:
+        rows = connector.safe_execute('SELECT COUNT(*) as cnt FROM (%s) q;' % sql)[0]['cnt']
+    except extensions.QueryCanceledError:
+        return None, None
+    finally:
+        connector.connection.rollback()
+
+    return rows, time.perf_counter() - started
+
+
+def run(years=10, instruments=5000, density=0.9, timeout=60, keep=False):
+    connector = DbPostgres(config)
+    create_dataset(connector, years, instruments, density)
+    connector.safe_execute('SET statement_timeout = %s;' % (timeout * 60 * 1000))
+
+    calendar = '%s.market_data_calendar' % schema
+    queries = {
+        'market_data_full': {method: market_data_full_sql(method, prices='%s.wm_market_data' % schema, calendar=calendar)
+                             for method in ['window', 'recursive']},
+        'fx_rates_full': {method: fx_rates_full_sql(method, rates='%s.wm_exchange_rate' % schema, calendar=calendar)
+                          for method in ['window', 'recursive']}}
+
+    print('Gap fill: %s years, %s instruments, %.0f%% of working days priced, timeout %s min' %
+          (years, instruments, density * 100, timeout))
+    for relation, methods in queries.items():
+        for method, sql in methods.items():
+            rows, spent = time_query(connector, sql)
+            print('%-18s %-10s %s' % (relation, method,
+                                      'timeout' if spent is None else '%12s rows %10.2fs' % (rows, spent)))
+
+    if not keep:
+        connector.safe_execute('DROP SCHEMA IF EXISTS %s CASCADE;' % schema)
+    connector.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare window and recursive gap fill on synthetic market data')
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--instruments', type=int, default=5000)
+    parser.add_argument('--density', type=float, default=0.9, help='share of working days with prices')
+    parser.add_argument('--timeout', type=int, default=60, help='statement timeout, minutes')
+    parser.add_argument('--keep', action='store_true', help='keep the synthetic schema after the run')
+    args = parser.parse_args()
+
+    run(args.years, args.instruments, args.density, args.timeout, args.keep)
@@ -1,14 +1,75 @@
 from datetime import datetime
+import json
 import pytest
 from py.xml import html
 
 from definitions import config
+from framework import request as wm_request
 from framework.configread import ReadConfig
+from framework.queries import oracle_queries
+from framework.timing import timings
 
 
 env_config = ReadConfig(config)
 
 
+def pytest_addoption(parser):
+    parser.addoption('--portfolio', action='append', default=[],
+                     help='run tests only for portfolios matching the name pattern or id, can be repeated')
+    parser.addoption('--timings', action='store', default=None, metavar='PATH',
+                     help='save wall time of SQL, API calls and calculations of each test to JSON file, '
+                          'SQL and calculations of PnL worker processes are counted as the wait of the oracle')
+    parser.addoption('--record-bodies', action='store', default=None, metavar='PATH',
+                     help='save POST bodies sent by the tests to JSON file for tests/benchmarks/api_latency.py')
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'portfolios(argnames, expand=None): parametrize the test by test portfolios, expand is a name '
+                            'of portfolio_periods in tests/WM_API/conftest.py or a function')
+    timings.enabled = bool(config.getoption('timings'))
+    if config.getoption('record_bodies'):
+        wm_request.recorded_bodies = list()
+
+
+@pytest.mark.hookwrapper
+def pytest_runtest_protocol(item):
+    timings.test_id = item.nodeid
+    yield
+    timings.test_id = '<session>'
+
+
+def pytest_sessionfinish(session):
+    path = session.config.getoption('timings')
+    if path:
+        timings.dump(path)
+    path = session.config.getoption('record_bodies')
+    if path:
+        unique = {json.dumps(call, sort_keys=True): call for call in wm_request.recorded_bodies or list()}
+        with open(path, 'w') as bodies_file:
+            json.dump(list(unique.values()), bodies_file, indent=2)
+
+
+def pytest_terminal_summary(terminalreporter):
+    # counters of pytest process, statements of PnL workers are not included
+    stats = oracle_queries.stats()
+    if stats:
+        terminalreporter.write_line('Prepared oracle statements: %s executions, %s prepares, plan cache hits %.0f%%' % (
+            sum(call['executed'] for call in stats.values()), sum(call['prepared'] for call in stats.values()),
+            oracle_queries.hit_rate() * 100))
+
+
+@pytest.mark.optionalhook
+def pytest_html_results_summary(prefix, summary, postfix):
+    if not timings.enabled:
+        return
+    rows = [html.tr([html.td(test_id), html.td('%.2f' % data['api']), html.td('%.2f' % data['reference']),
+                     html.td('%.2f' % data['sql'])])
+            for test_id, data in list(timings.report().items())[:20]]
+    postfix.extend([html.h2('Slowest tests'),
+                    html.table([html.tr([html.th('Test'), html.th('API, s'), html.th('Reference, s'),
+                                         html.th('SQL, s')])] + rows, id='timings')])
+
+
 def pytest_report_header():
     return "%s: WM API testing..." % env_config.option('Environment', 'platform').upper()
 
@@ -1,20 +1,172 @@
+import inspect
 from collections import defaultdict
+from datetime import date, datetime, timedelta
+from dateutil import parser
 from dateutil.relativedelta import relativedelta
 
-from definitions import config, RECENT_DATE
-from framework.dbpostgres import DbPostgres
+from definitions import config, RECENT_DATE, MD_REFRESH, MD_REFRESH_OVERLAP, MD_GAP_FILL
+from framework.allocations import Allocations
+from framework.avg_price import AvgPrice
+from framework.cache import ReferenceCache
+from framework.dbpostgres import db_config, db_pool
+from framework.fx_rates import FxRates
+from framework.queries import oracle_queries
+from framework.timing import named, timings
+
+# portfolios and asset classes are looked up by every test, they change only when portfolios are created
+reference_cache = ReferenceCache()
+
+# kind of market data relations for each refresh mode: tables are extended by days, views are fully refreshed
+md_relation_kinds = {'incremental': 'r', 'full': 'm'}
+md_relations = {'incremental': 'TABLE', 'full': 'MATERIALIZED VIEW'}
+
+# indexes matching the filters of oracle queries, see db_create_indexes()
+oracle_indexes = {
+    'exd_trades': ['portfolio, trade_time', 'portfolio_id, instrument_id, trade_time', 'instrument_id, trade_time'],
+    'market_data_calendar': ['calc_date'],
+    'market_data_full': ['instrument_id, close_timestamp', 'close_timestamp'],
+    'fx_rates_full': ['from_currency, to_currency, rate_timestamp', 'rate_timestamp'],
+    'exd_market_data': ['close_timestamp, p_currency, instrument_id', 'instrument_id, close_timestamp'],
+    'exd_positions': ['portfolio, position_date, instrument_id', 'portfolio_id, instrument_id, position_date'],
+    'fx_rates_asof': ['from_currency, to_currency, valid_from'],
+    'coupon_principals': ['instrument_id'],
+}
+md_tables = ['market_data_calendar', 'market_data_full', 'fx_rates_full', 'exd_market_data']
+
+
+# as-of exchange rates: a rate of the currency pair is valid from its timestamp till the next rate of the pair
+fx_rates_asof_sql = """
+             SELECT rates.from_currency,
+                    rates.to_currency,
+                    rates.rate_timestamp as valid_from,
+                    coalesce(LEAD(rates.rate_timestamp) OVER (PARTITION BY rates.from_currency, rates.to_currency
+                                                              ORDER BY rates.rate_timestamp), 'infinity') as valid_to,
+                    rates.rate_value
+             FROM (SELECT DISTINCT ON (from_currency, to_currency, rate_timestamp)
+                          from_currency, to_currency, rate_timestamp, rate_value
+                   FROM wm_exchange_rate
+                   ORDER BY from_currency, to_currency, rate_timestamp) rates"""
+
+# principal of credit instruments, the denominator of coupon income, and the date of the last principal payment
+coupon_principals_sql = """
+             SELECT coupons.instrument_id,
+                    SUM(coupons.principal)                                          as principal,
+                    MAX(coupons.coupon_date) FILTER (WHERE coupons.principal != 0) as last_principal_date
+             FROM wm_income_credit_coupons_data coupons
+             GROUP BY coupons.instrument_id"""
+
+# exchanged market data: close prices for all dates in all portfolio currencies
+exd_market_data_sql = """
+             SELECT m_data.instrument_id,
+                    i_ccy.name         as i_currency,
+                    p_ccy.name         as p_currency,
+                    dates.calc_date    as close_timestamp,
+                    m_data.close_price as last_close,
+                    m_data.close_price /
+                    CASE
+                        WHEN i_ccy.name = p_ccy.name THEN 1
+                        ELSE rates.rate_value
+                        END            as base_last_close,
+                    CASE
+                        WHEN i_ccy.name = p_ccy.name THEN 1
+                        ELSE rates.rate_value
+                        END            as base_rate
+             FROM market_data_calendar as dates
+                      JOIN market_data_full m_data ON m_data.close_timestamp = dates.calc_date
+                      JOIN (SELECT DISTINCT ccy.name
+                            FROM wm_portfolio portfolio
+                            JOIN wm_currency ccy ON ccy.id = portfolio.currency_id) as p_ccy ON p_ccy.name NOTNULL
+                      LEFT JOIN wm_instrument instr ON instr.id = m_data.instrument_id
+                      LEFT JOIN wm_currency i_ccy on instr.currency_id = i_ccy.id
+                      LEFT JOIN fx_rates_full rates ON rates.rate_timestamp = dates.calc_date AND rates.to_currency = i_ccy.name AND
+                                                       rates.from_currency = p_ccy.name
+                      LEFT JOIN wm_stock_market_index indx ON indx.id = m_data.instrument_id"""
 
 
-def psg_db(sql):
-    connector = DbPostgres(config)
-    db_info = connector.safe_execute(sql)
-    del connector
+def psg_db(sql, name=None):
+    """
+    :param sql: request to execute
+    :param name: oracle the SQL time is reported by, the function of this module sending it if not specified
+    :return: result of DbPostgres.safe_execute()
+    """
+    with timings.measure('sql', name or timings.current_name()):
+        with db_pool(config).connector() as connector:
+            db_info = connector.safe_execute(sql)
 
     return db_info
 
 
+def psg_db_stream(sql, itersize=2000, row_format='dict', name=None):
+    """
+    :param sql: 'select' to execute
+    :param itersize: number of rows fetched from DB at once
+    :param row_format: 'dict', 'tuple' or 'columns', see DbPostgres.stream()
+    :param name: oracle the SQL time is reported by, the function of this module sending it if not specified
+    :return: generator of rows, the pooled connection is kept until the rows are read
+    """
+    # the rows are read after the oracle has returned, its name is taken now
+    name = name or timings.current_name()
+
+    def rows():
+        with db_pool(config).connector() as connector:
+            batches = connector.batches(sql, itersize, row_format)
+            while True:
+                # only the query and the fetches are SQL time, the rows are processed by the consumer outside of it,
+                # every fetch is a call of the oracle in timings
+                with timings.measure('sql', name):
+                    batch = next(batches, None)
+                if batch is None:
+                    return
+                for row in batch:
+                    yield row
+
+    return rows()
+
+
+def psg_db_columns(sql, method='cursor', name=None):
+    """
+    :param sql: 'select' to execute, without ';'
+    :param method: 'cursor' or 'copy', see DbPostgres.columns()
+    :param name: oracle the SQL time is reported by, the function of this module sending it if not specified
+    :return: {column name: numpy array}
+    """
+    with timings.measure('sql', name or timings.current_name()):
+        with db_pool(config).connector() as connector:
+            return connector.columns(sql, method)
+
+
+def psg_db_prepared(name, *params):
+    """
+    :param name: statement registered in oracle_queries, the SQL time is reported by it
+    :param params: values of $1, $2...
+    :return: rows, the statement is prepared once per pooled connection
+    """
+    with timings.measure('sql', name):
+        with db_pool(config).connector() as connector:
+            return oracle_queries.execute(connector, name, params)
+
+
+def invalidate_reference_cache(*keys):
+    """
+    :param keys: 'portfolios', 'asset_classes', 'fx_rates', 'allocations' or nothing to drop all cached lookups
+    :return: None
+    """
+    reference_cache.invalidate(*keys)
+
+
+def db_trades_version():
+    """
+    :return: refresh time of exd_trades and the last market data date, results calculated from them are valid
+             while both are the same
+    """
+    version = psg_db(sql="""SELECT (SELECT created_at FROM exd_trades LIMIT 1) as trades_created_at,
+                                   (SELECT MAX(close_timestamp) FROM exd_market_data) as md_date;""")
+
+    return version[0]['trades_created_at'], version[0]['md_date']
+
+
 def trades_fresh():
-    view_exist = psg_db(sql="SELECT matviewname FROM pg_matviews WHERE matviewname = 'exd_trades';")
+    view_exist = db_relation_kind('exd_trades')
 
     if view_exist:
         resp_view = psg_db(sql='SELECT DISTINCT portfolio_id, COUNT(*) OVER (PARTITION BY portfolio_id) as p_id '
@@ -29,7 +181,8 @@ def trades_fresh():
 
 
 def md_fresh():
-    view_exist = psg_db(sql="SELECT matviewname FROM pg_matviews WHERE matviewname = 'exd_market_data';")
+    # market data is kept in tables for incremental refresh or in materialized views for full refresh
+    view_exist = db_relation_kind('exd_market_data') == md_relation_kinds[MD_REFRESH]
 
     if view_exist:
         last_update = psg_db(sql='SELECT MAX(close_timestamp) as dt FROM exd_market_data;')
@@ -37,12 +190,18 @@ def md_fresh():
         db_create_exd_market_data_view()
         return True
 
-    return last_update[0]['dt'].date() >= RECENT_DATE
+    return last_update[0]['dt'] is not None and last_update[0]['dt'].date() >= RECENT_DATE
 
 
 def refresh_md():
     # set 'updated to 1 or number of updated rows
     updated = 1 if md_fresh() else db_refresh_exd_market_data_view()
+    # views created before the indexes were introduced get them here
+    for relation in md_tables:
+        updated = updated and db_create_indexes(relation)
+    # databases prepared before the as-of rates were introduced get them here
+    if not db_relation_kind('fx_rates_asof'):
+        updated = updated and db_refresh_fx_rates_asof()
 
     return updated
 
@@ -50,31 +209,108 @@ def refresh_md():
 def refresh_trades():
     # set 'updated to 1 or number of updated rows
     updated = 1 if trades_fresh() else db_refresh_exd_trades_view()
+    updated = updated and db_create_indexes('exd_trades')
 
     return updated
 
 
-def db_delete_exd_market_data_view():
-    sql = """DROP MATERIALIZED VIEW IF EXISTS exd_market_data;"""
+def db_create_indexes(relation):
+    """
+    :param relation: name of view or table from oracle_indexes
+    :return: -1 (no rows are affected by index creation)
+    """
+    sql = ' '.join(['CREATE INDEX IF NOT EXISTS %s_%s_idx ON %s (%s);' % (relation, columns.replace(', ', '_'),
+                                                                        relation, columns)
+                    for columns in oracle_indexes[relation]])
 
     resp = psg_db(sql)
     return resp
 
 
-def db_delete_support_views():
-    sql = """DROP MATERIALIZED VIEW IF EXISTS market_data_calendar;"""
+def db_analyze(*relations):
+    # planner statistics are outdated after every refresh
+    sql = ' '.join(['ANALYZE %s;' % relation for relation in relations])
+
     resp = psg_db(sql)
+    return resp
 
-    sql = """DROP MATERIALIZED VIEW IF EXISTS fx_rates_full;"""
-    resp = resp and psg_db(sql)
 
-    sql = """DROP MATERIALIZED VIEW IF EXISTS market_data_full;"""
-    resp = resp and psg_db(sql)
+def positions_fresh():
+    view_exist = db_relation_kind('exd_positions')
+
+    if view_exist:
+        # the ledger is fresh if it covers the calendar and is built on the current refresh of trades
+        fresh = psg_db(sql="""SELECT (SELECT MAX(position_date) FROM exd_positions) =
+                                    (SELECT MAX(calc_date) FROM market_data_calendar) AND
+                                    (SELECT trades_created_at FROM exd_positions LIMIT 1) IS NOT DISTINCT FROM
+                                    (SELECT created_at FROM exd_trades LIMIT 1) as fresh;""")
+    else:
+        db_create_exd_positions_view()
+        return True
+
+    return fresh[0]['fresh'] is True
+
+
+def refresh_positions():
+    # set 'updated to 1 or number of updated rows
+    updated = 1 if positions_fresh() else db_refresh_exd_positions_view()
+
+    return updated
+
+
+def refresh_coupon_principals():
+    # coupons are not tracked by freshness checks, the principals are built again once per session
+    if db_relation_kind('coupon_principals'):
+        resp = psg_db(sql="""REFRESH MATERIALIZED VIEW coupon_principals;""")
+    else:
+        resp = psg_db(sql="""CREATE MATERIALIZED VIEW coupon_principals AS %s;""" % coupon_principals_sql)
+        resp = resp and db_create_indexes('coupon_principals')
+    resp = resp and db_analyze('coupon_principals')
+
+    return resp
+
+
+def db_relation_kind(name):
+    """
+    :param name: name of table or view
+    :return: 'r' for table, 'm' for materialized view, 'v' for view, None if there is no such relation
+    """
+    kind = psg_db(sql="SELECT relkind FROM pg_class WHERE oid = to_regclass('%s');" % name)
+
+    return kind[0]['relkind'] if kind else None
+
+
+def db_drop_relation(name):
+    relation = {'r': 'TABLE', 'v': 'VIEW'}.get(db_relation_kind(name), 'MATERIALIZED VIEW')
+    sql = """DROP %s IF EXISTS %s;""" % (relation, name)
+
+    resp = psg_db(sql)
+    return resp
+
+
+def db_delete_exd_market_data_view():
+    resp = db_drop_relation('exd_market_data')
+    return resp
+
+
+def db_delete_support_views():
+    # the calendar is dropped last since positions, market data and fx rates are built on it
+    resp = db_delete_exd_positions_view()
+    resp = resp and db_drop_relation('fx_rates_full')
+    resp = resp and db_drop_relation('market_data_full')
+    resp = resp and db_drop_relation('market_data_calendar')
 
     return resp
 
 
 def db_refresh_exd_market_data_view():
+    # holdings are valued by market data
+    invalidate_reference_cache('allocations')
+    if db_relation_kind('exd_market_data') == 'r':
+        resp = db_extend_exd_market_data()
+        resp = resp and db_refresh_fx_rates_asof()
+        return resp and db_analyze(*md_tables)
+
     sql = """REFRESH MATERIALIZED VIEW market_data_calendar;"""
     resp = psg_db(sql)
 
@@ -87,27 +323,139 @@ def db_refresh_exd_market_data_view():
     sql = """REFRESH MATERIALIZED VIEW exd_market_data;"""
     resp = resp and psg_db(sql)
 
+    resp = resp and db_refresh_fx_rates_asof()
+    resp = resp and db_analyze(*md_tables)
     return resp
 
 
+def db_extend_exd_market_data(overlap=MD_REFRESH_OVERLAP):
+    """
+    add the days missing since the last refresh to market data tables instead of rebuilding the whole history
+    :param overlap: number of the last filled days to build again, prices for them could come after the refresh,
+                    older corrections need the full refresh, see MD_REFRESH_OVERLAP
+    :return: -1 as REFRESH does, errors are raised
+    """
+    last_date = psg_db(sql='SELECT MAX(calc_date) as dt FROM market_data_calendar;')[0]['dt']
+    since = last_date - timedelta(days=overlap)
+
+    # all steps are done in one transaction, the tables are never left half-filled
+    sql = """INSERT INTO market_data_calendar (calc_date, next_date)
+             SELECT t.date, NULL
+             FROM generate_series(timestamp '%(last)s' + interval '1 day', current_date - interval '1 day',
+                                  interval '1 day') as t(date);
+
+             UPDATE market_data_calendar
+             SET next_date = CASE WHEN calc_date < current_date - interval '1 day' THEN calc_date + interval '1 day' END
+             WHERE calc_date >= '%(last)s';
+
+             DELETE FROM exd_market_data WHERE close_timestamp > '%(since)s';
+             DELETE FROM market_data_full WHERE close_timestamp > '%(since)s';
+             DELETE FROM fx_rates_full WHERE rate_timestamp > '%(since)s';
+
+             INSERT INTO market_data_full (instrument_id, close_timestamp, close_price)
+             SELECT instr.instrument_id,
+                    dates.calc_date,
+                    CASE WHEN price_found.close_timestamp IS NULL THEN instr.close_price
+                         ELSE price_found.close_price END
+             FROM market_data_calendar as dates
+                      JOIN (SELECT m_full.instrument_id, m_full.close_price, TRUE as filled
+                            FROM market_data_full m_full
+                            WHERE m_full.close_timestamp = '%(since)s'
+                            UNION
+                            SELECT m_data.instrument_id, NULL, FALSE
+                            FROM wm_market_data m_data
+                            WHERE m_data.close_timestamp > '%(since)s'
+                              AND m_data.instrument_id NOT IN (SELECT m_full2.instrument_id
+                                                               FROM market_data_full m_full2
+                                                               WHERE m_full2.close_timestamp = '%(since)s')) instr
+                           ON TRUE
+                      LEFT JOIN LATERAL (SELECT m_data.close_timestamp, m_data.close_price
+                                         FROM wm_market_data m_data
+                                         WHERE m_data.instrument_id = instr.instrument_id
+                                           AND m_data.close_timestamp > '%(since)s'
+                                           AND m_data.close_timestamp <= dates.calc_date
+                                         ORDER BY m_data.close_timestamp DESC
+                                         LIMIT 1) price_found ON TRUE
+             WHERE dates.calc_date > '%(since)s'
+               AND (instr.filled OR price_found.close_timestamp IS NOT NULL);
+
+             INSERT INTO fx_rates_full (rate_timestamp, from_currency, to_currency, rate_value)
+             SELECT dates.calc_date,
+                    pairs.from_currency,
+                    pairs.to_currency,
+                    CASE WHEN rates_found.rate_timestamp IS NULL THEN pairs.rate_value
+                         ELSE rates_found.rate_value END
+             FROM market_data_calendar as dates
+                      JOIN (SELECT fx_full.from_currency, fx_full.to_currency, fx_full.rate_value, TRUE as filled
+                            FROM fx_rates_full fx_full
+                            WHERE fx_full.rate_timestamp = '%(since)s'
+                            UNION
+                            SELECT rates.from_currency, rates.to_currency, NULL, FALSE
+                            FROM wm_exchange_rate rates
+                            WHERE rates.rate_timestamp > '%(since)s'
+                              AND (rates.from_currency, rates.to_currency) NOT IN (
+                                SELECT fx_full2.from_currency, fx_full2.to_currency
+                                FROM fx_rates_full fx_full2
+                                WHERE fx_full2.rate_timestamp = '%(since)s')) pairs ON TRUE
+                      LEFT JOIN LATERAL (SELECT rates.rate_timestamp, rates.rate_value
+                                         FROM wm_exchange_rate rates
+                                         WHERE rates.from_currency = pairs.from_currency
+                                           AND rates.to_currency = pairs.to_currency
+                                           AND rates.rate_timestamp > '%(since)s'
+                                           AND rates.rate_timestamp <= dates.calc_date
+                                         ORDER BY rates.rate_timestamp DESC
+                                         LIMIT 1) rates_found ON TRUE
+             WHERE dates.calc_date > '%(since)s'
+               AND (pairs.filled OR rates_found.rate_timestamp IS NOT NULL);
+
+             INSERT INTO exd_market_data
+             SELECT * FROM (%(exd_market_data)s) m_data WHERE m_data.close_timestamp > '%(since)s';""" % {
+        'last': last_date, 'since': since, 'exd_market_data': exd_market_data_sql}
+
+    psg_db(sql)
+    # no rows are added if market data is up to date, it is not a failure
+    return -1
+
+
 def db_delete_exd_trades_view():
-    sql = """DROP MATERIALIZED VIEW IF EXISTS exd_trades;"""
+    resp = db_delete_exd_positions_view()
 
-    resp = psg_db(sql)
+    sql = """DROP MATERIALIZED VIEW IF EXISTS exd_trades;"""
+    resp = resp and psg_db(sql)
     return resp
 
 
 def db_refresh_exd_trades_view():
+    # trades take fx_close from the as-of rates, custodian holdings are valued by trades
+    invalidate_reference_cache('allocations')
+    resp = db_refresh_fx_rates_asof()
+
     sql = """REFRESH MATERIALIZED VIEW exd_trades;"""
+    resp = resp and psg_db(sql)
+    resp = resp and db_analyze('exd_trades')
+    return resp
+
+
+def db_refresh_fx_rates_asof():
+    """
+    create or refresh as-of exchange rates, trades and income oracles resolve rates by them
+    :return: -1 or None if failed
+    """
+    if db_relation_kind('fx_rates_asof'):
+        resp = psg_db(sql="""REFRESH MATERIALIZED VIEW fx_rates_asof;""")
+    else:
+        resp = psg_db(sql="""CREATE MATERIALIZED VIEW fx_rates_asof AS %s;""" % fx_rates_asof_sql)
+        resp = resp and db_create_indexes('fx_rates_asof')
+    resp = resp and db_analyze('fx_rates_asof')
+    invalidate_reference_cache('fx_rates')
 
-    resp = psg_db(sql)
     return resp
 
 
 def db_create_exd_trades_view():
     # create extended trades view for faster testing
     sql = """CREATE MATERIALIZED VIEW exd_trades AS
-             SELECT trades.id                                                             as trade_id
+             SELECT trades.id                                                             as trade_id,
                     portfolio.name                                                        as portfolio,
                     portfolio.id                                                          as portfolio_id,
                     a_class.name                                                          as asset_class,
@@ -137,14 +485,7 @@ def db_create_exd_trades_view():
                             THEN 1.0
                         WHEN lower(ccy2.name) = lower(ccy.name)
                             THEN 100.0
-                        ELSE
-                            (SELECT rates.rate_value
-                             FROM wm_exchange_rate rates
-                             WHERE rates.rate_timestamp <= trade_time
-                               AND rates.from_currency = ccy2.name
-                               AND rates.to_currency = ccy.name
-                             ORDER BY rates.rate_timestamp DESC
-                             LIMIT 1)
+                        ELSE fx.rate_value
                         END                                                               as fx_close,
                     trades.notes,
                     now()                                                                 as created_at
@@ -156,447 +497,433 @@ def db_create_exd_trades_view():
                       JOIN wm_currency ccy2 on ccy2.id = portfolio.currency_id
                       JOIN wm_asset_class a_class on a_class.id = instr.asset_class_id
                       JOIN wm_asset_subclass subclass on subclass.id = instr.asset_subclass_id
+                      LEFT JOIN fx_rates_asof fx ON fx.from_currency = ccy2.name AND fx.to_currency = ccy.name AND
+                                                    trades.trade_time >= fx.valid_from AND trades.trade_time < fx.valid_to
              WHERE trades.hidden IS FALSE;"""
+    resp = db_refresh_fx_rates_asof()
+    resp = resp and psg_db(sql)
+    resp = resp and db_create_indexes('exd_trades')
+    resp = resp and db_analyze('exd_trades')
+    return resp
+
+
+def db_delete_exd_positions_view():
+    sql = """DROP MATERIALIZED VIEW IF EXISTS exd_positions;"""
+
     resp = psg_db(sql)
     return resp
 
 
-def db_create_support_views():
-    # delete all view if any were created ()
-    resp = db_delete_support_views()
+def db_refresh_exd_positions_view():
+    invalidate_reference_cache('allocations')
+    sql = """REFRESH MATERIALIZED VIEW exd_positions;"""
 
-    # create calendar view with dates from 2014 to yesterday
-    sql = """CREATE MATERIALIZED VIEW market_data_calendar as
-             SELECT t.date as calc_date, lead(t.date) OVER () as next_date
-             FROM generate_series(date '2014-01-01', current_date - interval '1 day', interval '1 day') as t(date);"""
-    resp = resp and psg_db(sql)
-    # create market data view with all dates filled with values
-    sql = """CREATE MATERIALIZED VIEW market_data_full AS
-             WITH RECURSIVE close_price AS (
+    resp = psg_db(sql)
+    resp = resp and db_analyze('exd_positions')
+    return resp
+
+
+def db_create_exd_positions_view():
+    # daily positions ledger: position of every instrument held by portfolio for every calendar date
+    # starting from the first trade, trades are counted on the first calendar date not earlier than trade time
+    # flagged_position is made by trades with investable flag set, total wealth is taken by it
+    sql = """CREATE MATERIALIZED VIEW exd_positions AS
+             WITH daily AS (
+                 SELECT trades.portfolio_id,
+                        MAX(trades.portfolio)                                                 as portfolio,
+                        trades.instrument_id,
+                        GREATEST(date_trunc('day', trades.trade_time + interval '1 day' - interval '1 microsecond'),
+                                 calendar.first_date)                                         as calc_date,
+                        SUM(trades.quantity)                                                  as quantity,
+                        SUM(trades.quantity) FILTER (WHERE trades.investable IS NOT NULL)     as flagged_quantity,
+                        SUM(trades.quantity) FILTER (WHERE trades.investable IS NOT FALSE)    as investable_quantity,
+                        MAX(trades.multiplier)                                                as multiplier,
+                        MAX(trades.created_at)                                                as trades_created_at
+                 FROM exd_trades trades
+                          JOIN (SELECT MIN(calc_date) as first_date, MAX(calc_date) as last_date
+                                FROM market_data_calendar) calendar ON trades.trade_time <= calendar.last_date
+                 GROUP BY trades.portfolio_id, trades.instrument_id, 4)
+             SELECT held.portfolio_id,
+                    held.portfolio,
+                    held.instrument_id,
+                    dates.calc_date                                     as position_date,
+                    SUM(daily.quantity) OVER positions * held.multiplier            as position,
+                    SUM(daily.flagged_quantity) OVER positions * held.multiplier    as flagged_position,
+                    SUM(daily.investable_quantity) OVER positions * held.multiplier as investable_position,
+                    held.trades_created_at
+             FROM (SELECT portfolio_id,
+                          MAX(portfolio)         as portfolio,
+                          instrument_id,
+                          MIN(calc_date)         as first_date,
+                          MAX(multiplier)        as multiplier,
+                          MAX(trades_created_at) as trades_created_at
+                   FROM daily
+                   GROUP BY portfolio_id, instrument_id) held
+                      JOIN market_data_calendar dates ON dates.calc_date >= held.first_date
+                      LEFT JOIN daily ON daily.portfolio_id = held.portfolio_id AND
+                                         daily.instrument_id = held.instrument_id AND
+                                         daily.calc_date = dates.calc_date
+             WINDOW positions AS (PARTITION BY held.portfolio_id, held.instrument_id ORDER BY dates.calc_date);"""
+    resp = psg_db(sql)
+    resp = resp and db_create_indexes('exd_positions')
+    resp = resp and db_analyze('exd_positions')
+    return resp
+
+
+def market_data_full_sql(gap_fill=MD_GAP_FILL, prices='wm_market_data', calendar='market_data_calendar'):
+    """
+    :param gap_fill: 'window' - the last price date found by running max, 'recursive' - price carried day by day
+    :param prices: table with close prices
+    :param calendar: table with calendar dates
+    :return: query for close prices of all instruments for all dates starting from the first price
+    """
+    names = {'prices': prices, 'calendar': calendar}
+    if gap_fill == 'recursive':
+        return """WITH RECURSIVE close_price AS (
                  SELECT dates.calc_date,
                         dates.next_date,
                         m_data.instrument_id,
                         m_data.close_price
-                 FROM market_data_calendar as dates
-                          JOIN wm_market_data m_data ON m_data.close_timestamp = dates.calc_date
+                 FROM %(calendar)s as dates
+                          JOIN %(prices)s m_data ON m_data.close_timestamp = dates.calc_date
                  UNION
                  SELECT dates2.calc_date,
                         dates2.next_date,
                         price_found.instrument_id,
                         price_found.close_price
-                 FROM market_data_calendar as dates2
+                 FROM %(calendar)s as dates2
                           JOIN close_price as price_found ON price_found.next_date = dates2.calc_date AND
                                                              dates2.calc_date NOT IN (SELECT m_data2.close_timestamp
-                                                                                      FROM wm_market_data m_data2
+                                                                                      FROM %(prices)s m_data2
                                                                                       WHERE m_data2.instrument_id = price_found.instrument_id)
              )
              SELECT instrument_id, calc_date as close_timestamp, close_price
-             FROM close_price;"""
-    resp = resp and psg_db(sql)
-    # create fx rates view with all dates filled with values
-    sql = """CREATE MATERIALIZED VIEW fx_rates_full AS
-             WITH RECURSIVE
+             FROM close_price""" % names
+
+    return """SELECT filled.instrument_id, filled.calc_date as close_timestamp, m_data.close_price
+             FROM (
+                      SELECT instr.instrument_id,
+                             dates.calc_date,
+                             MAX(price_dates.close_timestamp)
+                             OVER (PARTITION BY instr.instrument_id ORDER BY dates.calc_date) as price_date
+                      FROM (SELECT instrument_id, MIN(close_timestamp) as first_date
+                            FROM %(prices)s
+                            GROUP BY instrument_id) instr
+                               JOIN %(calendar)s as dates ON dates.calc_date >= instr.first_date
+                               LEFT JOIN (SELECT DISTINCT instrument_id, close_timestamp
+                                          FROM %(prices)s) price_dates
+                                         ON price_dates.instrument_id = instr.instrument_id AND
+                                            price_dates.close_timestamp = dates.calc_date) filled
+                      JOIN (SELECT DISTINCT instrument_id, close_timestamp, close_price
+                            FROM %(prices)s) m_data
+                           ON m_data.instrument_id = filled.instrument_id AND m_data.close_timestamp = filled.price_date""" % names
+
+
+def fx_rates_full_sql(gap_fill=MD_GAP_FILL, rates='wm_exchange_rate', calendar='market_data_calendar'):
+    """
+    :param gap_fill: 'window' - the last rate date found by running max, 'recursive' - rate carried day by day
+    :param rates: table with exchange rates
+    :param calendar: table with calendar dates
+    :return: query for exchange rates of all currency pairs for all dates starting from the first rate
+    """
+    names = {'rates': rates, 'calendar': calendar}
+    if gap_fill == 'recursive':
+        return """WITH RECURSIVE
                  fx_rate AS (
                      SELECT dates.calc_date as rate_timestamp,
                             dates.next_date,
                             rates.from_currency,
                             rates.to_currency,
                             rates.rate_value
-                     FROM market_data_calendar as dates
-                              JOIN wm_exchange_rate rates ON rates.rate_timestamp = dates.calc_date
+                     FROM %(calendar)s as dates
+                              JOIN %(rates)s rates ON rates.rate_timestamp = dates.calc_date
                      UNION
                      SELECT dates2.calc_date as rate_timestamp,
                             dates2.next_date,
                             rates_found.from_currency,
                             rates_found.to_currency,
                             rates_found.rate_value
-                     FROM market_data_calendar as dates2
+                     FROM %(calendar)s as dates2
                               JOIN fx_rate as rates_found ON rates_found.next_date = dates2.calc_date AND
                                                              dates2.calc_date NOT IN (SELECT rates2.rate_timestamp
-                                                                                      FROM wm_exchange_rate rates2
+                                                                                      FROM %(rates)s rates2
                                                                                       WHERE rates2.to_currency = rates_found.to_currency
                                                                                         AND rates2.from_currency = rates_found.from_currency)
                  )
              SELECT rate_timestamp, from_currency, to_currency, rate_value
-             FROM fx_rate;"""
+             FROM fx_rate""" % names
+
+    return """SELECT filled.calc_date as rate_timestamp, filled.from_currency, filled.to_currency, rates.rate_value
+             FROM (
+                      SELECT pairs.from_currency,
+                             pairs.to_currency,
+                             dates.calc_date,
+                             MAX(rate_dates.rate_timestamp)
+                             OVER (PARTITION BY pairs.from_currency, pairs.to_currency ORDER BY dates.calc_date) as rate_date
+                      FROM (SELECT from_currency, to_currency, MIN(rate_timestamp) as first_date
+                            FROM %(rates)s
+                            GROUP BY from_currency, to_currency) pairs
+                               JOIN %(calendar)s as dates ON dates.calc_date >= pairs.first_date
+                               LEFT JOIN (SELECT DISTINCT from_currency, to_currency, rate_timestamp
+                                          FROM %(rates)s) rate_dates
+                                         ON rate_dates.from_currency = pairs.from_currency AND
+                                            rate_dates.to_currency = pairs.to_currency AND
+                                            rate_dates.rate_timestamp = dates.calc_date) filled
+                      JOIN (SELECT DISTINCT from_currency, to_currency, rate_timestamp, rate_value
+                            FROM %(rates)s) rates
+                           ON rates.from_currency = filled.from_currency AND rates.to_currency = filled.to_currency AND
+                              rates.rate_timestamp = filled.rate_date""" % names
+
+
+def db_compare_gap_fill():
+    """
+    check that window and recursive gap fill produce the same rows for the current data
+    :return: number of different rows for market data and fx rates
+    """
+    sql = """SELECT COUNT(*) as diff
+             FROM (((%(window)s) EXCEPT ALL (%(recursive)s))
+                   UNION ALL
+                   ((%(recursive)s) EXCEPT ALL (%(window)s))) diff;"""
+
+    market_data = psg_db(sql % {'window': market_data_full_sql('window'),
+                                'recursive': market_data_full_sql('recursive')})
+    fx_rates = psg_db(sql % {'window': fx_rates_full_sql('window'), 'recursive': fx_rates_full_sql('recursive')})
+
+    return {'market_data_full': market_data[0]['diff'], 'fx_rates_full': fx_rates[0]['diff']}
+
+
+def db_create_support_views():
+    # delete all view if any were created ()
+    resp = db_delete_support_views()
+    relation = md_relations[MD_REFRESH]
+
+    # create calendar view with dates from 2014 to yesterday
+    sql = """CREATE %s market_data_calendar as
+             SELECT t.date as calc_date, lead(t.date) OVER () as next_date
+             FROM generate_series(date '2014-01-01', current_date - interval '1 day', interval '1 day') as t(date);""" % relation
+    resp = resp and psg_db(sql)
+    # create market data view with all dates filled with values
+    sql = """CREATE %s market_data_full AS %s;""" % (relation, market_data_full_sql())
     resp = resp and psg_db(sql)
+    # create fx rates view with all dates filled with values
+    sql = """CREATE %s fx_rates_full AS %s;""" % (relation, fx_rates_full_sql())
+    resp = resp and psg_db(sql)
+
+    for table in md_tables[:-1]:
+        resp = resp and db_create_indexes(table)
+    resp = resp and db_analyze(*md_tables[:-1])
 
     return resp
 
 
 def db_create_exd_market_data_view():
-    # create support views first
-    resp = db_create_support_views()
+    # drop the view built on support views, then create support views
+    resp = db_delete_exd_market_data_view()
+    resp = resp and db_create_support_views()
 
     # create exchanged market data view
-    sql = """CREATE MATERIALIZED VIEW exd_market_data AS
-             SELECT m_data.instrument_id,
-                    i_ccy.name         as i_currency,
-                    p_ccy.name         as p_currency,
-                    dates.calc_date    as close_timestamp,
-                    m_data.close_price as last_close,
-                    m_data.close_price /
-                    CASE
-                        WHEN i_ccy.name = p_ccy.name THEN 1
-                        ELSE rates.rate_value
-                        END            as base_last_close,
-                    CASE
-                        WHEN i_ccy.name = p_ccy.name THEN 1
-                        ELSE rates.rate_value
-                        END            as base_rate
-             FROM market_data_calendar as dates
-                      JOIN market_data_full m_data ON m_data.close_timestamp = dates.calc_date
-                      JOIN (SELECT DISTINCT ccy.name
-                            FROM wm_portfolio portfolio
-                            JOIN wm_currency ccy ON ccy.id = portfolio.currency_id) as p_ccy ON p_ccy.name NOTNULL
-                      LEFT JOIN wm_instrument instr ON instr.id = m_data.instrument_id
-                      LEFT JOIN wm_currency i_ccy on instr.currency_id = i_ccy.id
-                      LEFT JOIN fx_rates_full rates ON rates.rate_timestamp = dates.calc_date AND rates.to_currency = i_ccy.name AND
-                                                       rates.from_currency = p_ccy.name
-                      LEFT JOIN wm_stock_market_index indx ON indx.id = m_data.instrument_id;"""
+    sql = """CREATE %s exd_market_data AS %s;""" % (md_relations[MD_REFRESH], exd_market_data_sql)
     resp = resp and psg_db(sql)
+    resp = resp and db_create_indexes('exd_market_data')
+    resp = resp and db_analyze('exd_market_data')
     return resp
 
 
-def db_total_wealth(portfolio, date, investable=None):
-    p_ccy = db_get_portfolio_info(ccy_only=True)[portfolio]
-    tw = psg_db(sql="""SELECT SUM(m_data.base_last_close * (
-                              SELECT SUM(trade2.quantity) * MAX(trade2.multiplier) 
-                              FROM exd_trades trade2
-                              WHERE m_data.instrument_id = trade2.instrument_id AND
-                                trade2.trade_time <= '%s' AND
-                                trade2.portfolio = '%s' AND trade2.investable is not %s )) as TW
-                       FROM exd_market_data m_data
-                       WHERE m_data.close_timestamp = '%s' AND m_data.p_currency = '%s';""" %
-                    (date, portfolio, ['NULL', False][investable is True], date, p_ccy))
-    return [tw[0]['tw'], 0][tw[0]['tw'] is None]
+def as_date(value):
+    """
+    :param value: date, datetime or date string
+    :return: datetime.date, as DB casts the value to date
+    """
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
 
+    return parser.parse(value).date()
 
-def db_wealth_per_asset(portfolio, date):
-    p_ccy = db_get_portfolio_info(ccy_only=True)[portfolio]
-    assets_wealth = psg_db(sql="""SELECT DISTINCT
-                                    a_class.name                            as asset_class,
-                                    SUM(m_data.base_last_close * (SELECT SUM(trade2.quantity) * MAX(trade2.multiplier) 
-                                  FROM exd_trades trade2
-                                  WHERE m_data.instrument_id = trade2.instrument_id AND
-                                    trade2.trade_time <= '%s' AND
-                                    trade2.portfolio = '%s'))
-                                  OVER (
-                                    PARTITION BY a_class.name ) as nav
-                                  FROM exd_market_data m_data
-                                    JOIN wm_instrument instr ON instr.id = m_data.instrument_id
-                                    JOIN (SELECT id, name FROM wm_asset_class a_class
-                                          UNION
-                                          SELECT id, name FROM wm_asset_subclass subclass) a_class 
-                                          ON instr.asset_class_id = a_class.id OR instr.asset_subclass_id = a_class.id
-                                  WHERE m_data.close_timestamp = '%s' AND m_data.p_currency = '%s';""" % (
-        date, portfolio, date, p_ccy))
 
-    assets_nav = {row['asset_class']: [row['nav'], 0][row['nav'] is None] for row in assets_wealth}
+def db_total_wealth(portfolio, date, investable=None):
+    tw = db_total_wealth_for_dates(portfolio, [date], investable)
 
-    return assets_nav
+    return tw[date]
 
 
-def db_shares_ccy(portfolio, date):
+# total wealth by positions of trades with investable flag set or by investable positions
+total_wealth_sql = """SELECT m_data.close_timestamp::date as tw_date,
+                              SUM(m_data.base_last_close * pos.%s) as TW
+                       FROM exd_market_data m_data
+                         LEFT JOIN exd_positions pos ON pos.portfolio = $1 AND pos.instrument_id = m_data.instrument_id AND
+                                                        pos.position_date = m_data.close_timestamp
+                       WHERE m_data.close_timestamp = ANY($2::text[]::date[]) AND m_data.p_currency = $3
+                       GROUP BY m_data.close_timestamp"""
+oracle_queries.register('db_total_wealth_position', total_wealth_sql % 'flagged_position')
+oracle_queries.register('db_total_wealth_investable_position', total_wealth_sql % 'investable_position')
+
+
+def db_total_wealth_for_dates(portfolio, dates, investable=None):
+    """
+    :param portfolio: portfolio name
+    :param dates: list or range of dates, datetimes or date strings
+    :param investable: True - investable wealth only
+    :return: {date as passed: total wealth}
+    """
+    days = {dt: as_date(dt) for dt in dates}
+    if not days:
+        return dict()
     p_ccy = db_get_portfolio_info(ccy_only=True)[portfolio]
-    ccy_shares = psg_db(sql="""SELECT DISTINCT
-                                 upper(ccy.name) as currency,
-                                 SUM(m_data.base_last_close * (SELECT SUM(trade2.quantity) * MAX(trade2.multiplier)
-                                                              FROM exd_trades trade2
-                                                              WHERE instr.id = trade2.instrument_id AND
-                                                                    trade2.trade_time <= '%s' AND
-                                                                    trade2.portfolio = '%s'))
-                                 OVER (
-                                   PARTITION BY upper(ccy.name) ) * 100 /
-                                   SUM(m_data.base_last_close * (SELECT SUM(trade2.quantity) * MAX(trade2.multiplier)
-                                                                FROM exd_trades trade2
-                                                                WHERE instr.id = trade2.instrument_id AND
-                                                                  trade2.trade_time <= '%s' AND
-                                                                  trade2.portfolio = '%s'))
-                                    OVER () as percentage
-                               FROM exd_market_data m_data
-                                 JOIN wm_instrument instr ON instr.id = m_data.instrument_id
-                                 LEFT JOIN wm_currency ccy on ccy.id = instr.currency_id
-                               WHERE m_data.close_timestamp = '%s' AND m_data.p_currency = '%s'
-                               ORDER BY percentage DESC NULLS LAST;""" % (
-        date, portfolio, date, portfolio, date, p_ccy))
-
-    db_ccy_shares = {row['currency']: row['percentage'] for row in ccy_shares if row['percentage'] != 0}
-
-    return db_ccy_shares
+    tw = psg_db_prepared('db_total_wealth_%s' % ['position', 'investable_position'][investable is True],
+                         portfolio, sorted(set(str(day) for day in days.values())), p_ccy)
 
+    # rows come by date, they are returned by the keys of the caller
+    tw_days = {row['tw_date']: [row['tw'], 0][row['tw'] is None] for row in tw}
 
-def db_shares_region(portfolio, date):
-    p_ccy = db_get_portfolio_info(ccy_only=True)[portfolio]
-    region_shares = psg_db(sql="""SELECT DISTINCT
-                                    region.name as region,
-                                    SUM(m_data.base_last_close * (SELECT SUM(trade2.quantity) * MAX(trade2.multiplier)
-                                                                 FROM exd_trades trade2
-                                                                 WHERE instr.id = trade2.instrument_id AND
-                                                                       trade2.trade_time <= '%s' AND
-                                                                       trade2.portfolio = '%s'))
-                                    OVER (
-                                      PARTITION BY instr.geo_region_id ) * 100 /
-                                    SUM(m_data.base_last_close * (SELECT SUM(trade2.quantity) * MAX(trade2.multiplier)
-                                                                 FROM exd_trades trade2
-                                                                 WHERE instr.id = trade2.instrument_id AND
-                                                                       trade2.trade_time <= '%s' AND
-                                                                       trade2.portfolio = '%s'))
-                                    OVER ()     as percentage
-                                  FROM exd_market_data m_data
-                                    JOIN wm_instrument instr ON instr.id = m_data.instrument_id
-                                    JOIN wm_geo_region region on instr.geo_region_id = region.id
-                                  WHERE m_data.close_timestamp = '%s' AND m_data.p_currency = '%s'
-                                  ORDER BY percentage DESC NULLS LAST;""" % (
-        date, portfolio, date, portfolio, date, p_ccy))
+    return {dt: tw_days.get(day, 0) for dt, day in days.items()}
 
-    db_region_shares = {row['region']: row['percentage'] for row in region_shares if row['percentage'] != 0}
 
-    return db_region_shares
+def db_wealth_per_asset(portfolio, date):
+    assets_nav = db_wealth_per_asset_for_dates(portfolio, [date])
 
+    return assets_nav[date]
 
-def db_shares_assets(portfolio, date):
-    p_ccy = db_get_portfolio_info(ccy_only=True)[portfolio]
-    assets_shares = psg_db(sql="""SELECT DISTINCT
-                                    a_class.name as asset_class,
-                                    SUM(m_data.base_last_close * (SELECT SUM(trade2.quantity) * MAX(trade2.multiplier)
-                                                                 FROM exd_trades trade2
-                                                                 WHERE instr.id = trade2.instrument_id AND
-                                                                       trade2.trade_time <= '%s' AND
-                                                                       trade2.portfolio = '%s'))
-                                    OVER (
-                                      PARTITION BY instr.asset_class_id ) * 100 /
-                                    SUM(m_data.base_last_close * (SELECT SUM(trade2.quantity) * MAX(trade2.multiplier)
-                                                                 FROM exd_trades trade2
-                                                                 WHERE instr.id = trade2.instrument_id AND
-                                                                       trade2.trade_time <= '%s' AND
-                                                                       trade2.portfolio = '%s'))
-                                    OVER ()    as percentage
+
+oracle_queries.register('db_wealth_per_asset_for_dates', """SELECT m_data.close_timestamp::date                 as nav_date,
+                                    a_class.name                                as asset_class,
+                                    SUM(m_data.base_last_close * pos.position) as nav
                                   FROM exd_market_data m_data
                                     JOIN wm_instrument instr ON instr.id = m_data.instrument_id
-                                    JOIN wm_asset_class a_class on instr.asset_class_id = a_class.id
-                                  WHERE m_data.close_timestamp = '%s' AND m_data.p_currency = '%s'
-                                  ORDER BY percentage DESC NULLS LAST;""" % (
-        date, portfolio, date, portfolio, date, p_ccy))
-
-    db_assets_shares = {row['asset_class']: row['percentage'] for row in assets_shares}
-
-    return db_assets_shares
-
-
-def db_shares_custodian(portfolio, date):
-    custodian_shares = psg_db(sql="""SELECT DISTINCT coalesce(cust.name, 'Unknown')  as custodian,
-                                                     SUM(trades.quantity * trades.multiplier * m_data.base_last_close)
-                                                     OVER (
-                                                         PARTITION BY trades.custodian_id ) * 100 /
-                                                     SUM(trades.quantity * trades.multiplier * m_data.base_last_close) OVER () as percentage
-                                     FROM exd_trades trades
-                                              JOIN exd_market_data m_data
-                                                   ON m_data.instrument_id = trades.instrument_id AND trades.p_currency = m_data.p_currency AND
-                                                      m_data.close_timestamp = '%s'
-                                              LEFT JOIN wm_custodian cust ON cust.id = trades.custodian_id
-                                     WHERE trades.trade_time <= m_data.close_timestamp
-                                       AND trades.portfolio LIKE '%s'
-                                     ORDER BY percentage DESC;""" % (date, portfolio))
+                                    LEFT JOIN exd_positions pos ON pos.portfolio = $1 AND pos.instrument_id = m_data.instrument_id AND
+                                                                   pos.position_date = m_data.close_timestamp
+                                    JOIN (SELECT id, name FROM wm_asset_class a_class
+                                          UNION
+                                          SELECT id, name FROM wm_asset_subclass subclass) a_class 
+                                          ON instr.asset_class_id = a_class.id OR instr.asset_subclass_id = a_class.id
+                                  WHERE m_data.close_timestamp = ANY($2::text[]::date[]) AND m_data.p_currency = $3
+                                  GROUP BY m_data.close_timestamp, a_class.name""")
+
+
+def db_wealth_per_asset_for_dates(portfolio, dates):
+    """
+    :param portfolio: portfolio name
+    :param dates: list or range of dates, datetimes or date strings
+    :return: {date as passed: {asset class or subclass: nav}}
+    """
+    days = {dt: as_date(dt) for dt in dates}
+    if not days:
+        return dict()
+    p_ccy = db_get_portfolio_info(ccy_only=True)[portfolio]
+    assets_wealth = psg_db_prepared('db_wealth_per_asset_for_dates', portfolio,
+                                    sorted(set(str(day) for day in days.values())), p_ccy)
 
-    db_custodian_shares = {row['custodian']: row['percentage'] for row in custodian_shares}
+    # rows come by date, they are returned by the keys of the caller
+    nav_days = defaultdict(dict)
+    for row in assets_wealth:
+        nav_days[row['nav_date']][row['asset_class']] = [row['nav'], 0][row['nav'] is None]
 
-    return db_custodian_shares
+    return {dt: dict(nav_days.get(day, dict())) for dt, day in days.items()}
 
 
-def db_shares_subclass(portfolio, date, asset_class=None):
-    p_ccy = db_get_portfolio_info(ccy_only=True)[portfolio]
-    subclass_shares = psg_db(sql="""SELECT DISTINCT
+oracle_queries.register('db_valued_holdings', """SELECT m_data.instrument_id,
+                                      m_data.base_last_close * pos.position as value,
+                                      instr.asset_class_id,
                                       a_class.name                          as asset_class,
-                                      subclass.name                         as subclass,
-                                      SUM(m_data.base_last_close * (SELECT SUM(trade2.quantity) * MAX(trade2.multiplier)
-                                                                   FROM exd_trades trade2
-                                                                   WHERE instr.id = trade2.instrument_id AND
-                                                                         trade2.trade_time <= '%s' AND
-                                                                         trade2.portfolio = '%s'))
-                                      OVER (
-                                        PARTITION BY instr.asset_subclass_id ) * 100 /
-                                      SUM(m_data.base_last_close * (SELECT SUM(trade2.quantity) * MAX(trade2.multiplier)
-                                                                   FROM exd_trades trade2
-                                                                   WHERE instr.id = trade2.instrument_id AND
-                                                                         trade2.trade_time <= '%s' AND
-                                                                         trade2.portfolio = '%s'))
-                                      OVER (
-                                        PARTITION BY instr.asset_class_id ) as percentage
+                                      instr.asset_subclass_id,
+                                      subclass.name                         as asset_subclass,
+                                      ARRAY(SELECT classes.name
+                                            FROM (SELECT id, name
+                                                  FROM wm_asset_class
+                                                  UNION
+                                                  SELECT id, name
+                                                  FROM wm_asset_subclass) classes
+                                            WHERE classes.id = instr.asset_class_id OR
+                                                  classes.id = instr.asset_subclass_id) as class_names,
+                                      instr.geo_region_id,
+                                      region.id                             as region_id,
+                                      region.name                           as region,
+                                      upper(ccy.name)                       as currency,
+                                      sector.name                           as industry_sector,
+                                      instr.credit_rating,
+                                      rating.rating                         as rating
                                     FROM exd_market_data m_data
                                       JOIN wm_instrument instr ON instr.id = m_data.instrument_id
-                                      JOIN wm_asset_class a_class on instr.asset_class_id = a_class.id
-                                      JOIN wm_asset_subclass subclass on instr.asset_subclass_id = subclass.id
-                                    WHERE m_data.close_timestamp = '%s' AND m_data.p_currency = '%s'
-                                    ORDER BY a_class.name, percentage DESC NULLS LAST;""" % (
-        date, portfolio, date, portfolio, date, p_ccy))
+                                      LEFT JOIN exd_positions pos ON pos.portfolio = $1 AND pos.instrument_id = m_data.instrument_id AND
+                                                                     pos.position_date = m_data.close_timestamp
+                                      LEFT JOIN wm_asset_class a_class on instr.asset_class_id = a_class.id
+                                      LEFT JOIN wm_asset_subclass subclass on instr.asset_subclass_id = subclass.id
+                                      LEFT JOIN wm_geo_region region on instr.geo_region_id = region.id
+                                      LEFT JOIN wm_currency ccy on ccy.id = instr.currency_id
+                                      LEFT JOIN wm_industry_sector sector ON instr.industry_sector_id = sector.id
+                                      LEFT JOIN wm_credit_rating rating on instr.credit_rating = rating.id
+                                    WHERE m_data.close_timestamp = $2 AND m_data.p_currency = $3""")
+
+
+oracle_queries.register('db_custodian_holdings', """SELECT trades.custodian_id,
+                                                       coalesce(cust.name, 'Unknown') as custodian,
+                                                       SUM(trades.quantity * trades.multiplier * m_data.base_last_close) as value
+                                       FROM exd_trades trades
+                                                JOIN exd_market_data m_data
+                                                     ON m_data.instrument_id = trades.instrument_id AND trades.p_currency = m_data.p_currency AND
+                                                        m_data.close_timestamp = $1
+                                                LEFT JOIN wm_custodian cust ON cust.id = trades.custodian_id
+                                       WHERE trades.trade_time <= m_data.close_timestamp
+                                         AND trades.portfolio LIKE $2
+                                       GROUP BY trades.custodian_id, cust.name""")
+
+
+def db_allocations(portfolio, date):
+    """
+    :param portfolio: portfolio name
+    :param date: allocation date
+    :return: Allocations of the portfolio, holdings are valued once per portfolio and date for the session
+    """
+    allocations = reference_cache.get('allocations', dict)
+    key = (portfolio, str(date))
+    if key not in allocations:
+        p_ccy = db_get_portfolio_info(ccy_only=True)[portfolio]
+        allocations[key] = Allocations(psg_db_prepared('db_valued_holdings', portfolio, date, p_ccy),
+                                       lambda: psg_db_prepared('db_custodian_holdings', date, portfolio))
+
+    return allocations[key]
 
-    if asset_class:
-        db_subclass = {row['subclass']: row['percentage'] for row in subclass_shares
-                       if row['percentage'] and row['asset_class'] == asset_class}
-    else:
-        db_subclass = subclass_shares
 
-    return db_subclass
+def db_shares_ccy(portfolio, date):
+    return db_allocations(portfolio, date).currency()
 
 
-def db_shares_asset_region(portfolio, date, asset_class=None):
-    p_ccy = db_get_portfolio_info(ccy_only=True)[portfolio]
-    region_shares = psg_db(sql="""SELECT DISTINCT
-                                    a_class.name                          as asset_class,
-                                    region.name                           as region,
-                                    SUM(m_data.base_last_close * (SELECT SUM(trade2.quantity) * MAX(trade2.multiplier)
-                                                                 FROM exd_trades trade2
-                                                                 WHERE instr.id = trade2.instrument_id AND
-                                                                       trade2.trade_time <= '%s' AND
-                                                                       trade2.portfolio = '%s'))
-                                    OVER (
-                                      PARTITION BY a_class.name, instr.geo_region_id ) * 100 /
-                                    NULLIF(SUM(m_data.base_last_close * (SELECT SUM(trade2.quantity) * MAX(trade2.multiplier)
-                                                                 FROM exd_trades trade2
-                                                                 WHERE instr.id = trade2.instrument_id AND
-                                                                       trade2.trade_time <= '%s' AND
-                                                                       trade2.portfolio = '%s'))
-                                    OVER (
-                                      PARTITION BY a_class.name), 0) as percentage
-                                  FROM exd_market_data m_data
-                                    JOIN wm_instrument instr ON instr.id = m_data.instrument_id
-                                    JOIN (SELECT id, name
-                                          FROM wm_asset_class a_class
-                                          UNION
-                                          SELECT id, name
-                                          FROM wm_asset_subclass subclass) a_class on 
-                                          instr.asset_class_id = a_class.id OR a_class.id = instr.asset_subclass_id
-                                    LEFT JOIN wm_geo_region region on instr.geo_region_id = region.id
-                                  WHERE m_data.close_timestamp = '%s' AND m_data.p_currency = '%s'
-                                  ORDER BY a_class.name, percentage DESC NULLS LAST;""" %
-                               (date, portfolio, date, portfolio, date, p_ccy))
+def db_shares_region(portfolio, date):
+    return db_allocations(portfolio, date).region()
 
-    if asset_class:
-        db_region = {row['region']: row['percentage'] for row in region_shares
-                     if row['percentage'] and row['asset_class'] == asset_class}
-    else:
-        db_region = region_shares
 
-    return db_region
+def db_shares_assets(portfolio, date):
+    return db_allocations(portfolio, date).asset_classes()
 
 
-def db_shares_asset_ccy(portfolio, date, asset_class=None):
-    p_ccy = db_get_portfolio_info(ccy_only=True)[portfolio]
-    ccy_shares = psg_db(sql="""SELECT DISTINCT
-                                    a_class.name                            as asset_class,
-                                    upper(ccy.name) as currency,
-                                    SUM(m_data.base_last_close * (SELECT SUM(trade2.quantity) * MAX(trade2.multiplier)
-                                                                 FROM exd_trades trade2
-                                                                 WHERE instr.id = trade2.instrument_id AND
-                                                                       trade2.trade_time <= '%s' AND
-                                                                       trade2.portfolio = '%s'))
-                                    OVER (
-                                      PARTITION BY instr.asset_class_id, upper(ccy.name) ) * 100 /
-                                    NULLIF(SUM(m_data.base_last_close * (SELECT SUM(trade2.quantity) * MAX(trade2.multiplier)
-                                                                 FROM exd_trades trade2
-                                                                 WHERE instr.id = trade2.instrument_id AND
-                                                                       trade2.trade_time <= '%s' AND
-                                                                       trade2.portfolio = '%s'))
-                                    OVER (
-                                      PARTITION BY instr.asset_class_id ), 0) as percentage
-                                  FROM exd_market_data m_data
-                                    JOIN wm_instrument instr ON instr.id = m_data.instrument_id
-                                    LEFT JOIN wm_asset_class a_class on instr.asset_class_id = a_class.id
-                                    LEFT JOIN wm_currency ccy on ccy.id = instr.currency_id
-                                  WHERE m_data.close_timestamp = '%s' AND m_data.p_currency = '%s'
-                                  ORDER BY a_class.name, percentage DESC NULLS LAST;""" %
-                            (date, portfolio, date, portfolio, date, p_ccy))
+def db_shares_custodian(portfolio, date):
+    return db_allocations(portfolio, date).custodian()
 
-    if asset_class:
-        db_ccy = {row['currency']: row['percentage'] for row in ccy_shares
-                  if row['percentage'] and row['asset_class'] == asset_class}
-    else:
-        db_ccy = ccy_shares
 
-    return db_ccy
+def db_shares_subclass(portfolio, date, asset_class=None):
+    return db_allocations(portfolio, date).subclass(asset_class)
 
 
-def db_shares_industry(portfolio, date, asset_class=None):
-    p_ccy = db_get_portfolio_info(ccy_only=True)[portfolio]
-    industry_shares = psg_db(sql="""SELECT DISTINCT
-                                      a_class.name                            as asset_class,
-                                      coalesce(sector.name, 'Unknown') as industry_sector,
-                                      SUM(m_data.base_last_close * (SELECT SUM(trade2.quantity) * MAX(trade2.multiplier)
-                                                                   FROM exd_trades trade2
-                                                                   WHERE instr.id = trade2.instrument_id AND
-                                                                         trade2.trade_time <= '%s' AND
-                                                                         trade2.portfolio = '%s'))
-                                      OVER (
-                                        PARTITION BY instr.asset_class_id, sector.name ) * 100 /
-                                      NULLIF(SUM(m_data.base_last_close * (SELECT SUM(trade2.quantity) * MAX(trade2.multiplier)
-                                                                   FROM exd_trades trade2
-                                                                   WHERE instr.id = trade2.instrument_id AND
-                                                                         trade2.trade_time <= '%s' AND
-                                                                         trade2.portfolio = '%s'))
-                                      OVER (
-                                        PARTITION BY instr.asset_class_id ), 0) as percentage
-                                    FROM exd_market_data m_data
-                                      JOIN wm_instrument instr ON instr.id = m_data.instrument_id
-                                      LEFT JOIN wm_asset_class a_class on instr.asset_class_id = a_class.id
-                                      LEFT JOIN wm_industry_sector sector ON instr.industry_sector_id = sector.id
-                                    WHERE m_data.close_timestamp = '%s' AND m_data.p_currency = '%s'
-                                    ORDER BY a_class.name, percentage DESC NULLS LAST;""" %
-                                 (date, portfolio, date, portfolio, date, p_ccy))
+def db_shares_asset_region(portfolio, date, asset_class=None):
+    return db_allocations(portfolio, date).asset_region(asset_class)
 
-    if asset_class:
-        db_industry = {[row['industry_sector'], 'Unknown'][row['industry_sector'] == '']: row['percentage']
-                       for row in industry_shares
-                       if row['percentage'] and row['asset_class'] == asset_class}
-    else:
-        db_industry = industry_shares
 
-    return db_industry
+def db_shares_asset_ccy(portfolio, date, asset_class=None):
+    return db_allocations(portfolio, date).asset_currency(asset_class)
 
 
-def db_shares_credit(portfolio, date, asset_class=None):
-    p_ccy = db_get_portfolio_info(ccy_only=True)[portfolio]
-    rating_shares = psg_db(sql="""SELECT DISTINCT
-                                    a_class.name                          as asset_class,
-                                    rating.rating                         as rating,
-                                    SUM(m_data.base_last_close * (SELECT SUM(trade2.quantity) * MAX(trade2.multiplier)
-                                                                 FROM exd_trades trade2
-                                                                 WHERE instr.id = trade2.instrument_id AND
-                                                                       trade2.trade_time <= '%s' AND
-                                                                       trade2.portfolio = '%s'))
-                                    OVER (
-                                      PARTITION BY instr.asset_class_id, instr.credit_rating ) * 100 /
-                                    SUM(m_data.base_last_close * (SELECT SUM(trade2.quantity) * MAX(trade2.multiplier)
-                                                                 FROM exd_trades trade2
-                                                                 WHERE instr.id = trade2.instrument_id AND
-                                                                       trade2.trade_time <= '%s' AND
-                                                                       trade2.portfolio = '%s'))
-                                    OVER (
-                                      PARTITION BY instr.asset_class_id ) as percentage
-                                  FROM exd_market_data m_data
-                                    JOIN wm_instrument instr ON instr.id = m_data.instrument_id
-                                    LEFT JOIN wm_credit_rating rating on instr.credit_rating = rating.id
-                                    LEFT JOIN wm_asset_class a_class on instr.asset_class_id = a_class.id
-                                  WHERE m_data.close_timestamp = '%s' AND m_data.p_currency = '%s'
-                                  ORDER BY a_class.name, percentage DESC NULLS LAST;""" %
-                               (date, portfolio, date, portfolio, date, p_ccy))
+def db_shares_industry(portfolio, date, asset_class=None):
+    return db_allocations(portfolio, date).industry(asset_class)
 
-    if asset_class:
-        db_rating = {row['rating']: row['percentage'] for row in rating_shares
-                     if row['percentage'] and row['asset_class'] == asset_class}
-    else:
-        db_rating = rating_shares
 
-    return db_rating
+def db_shares_credit(portfolio, date, asset_class=None):
+    return db_allocations(portfolio, date).credit(asset_class)
 
 
 def db_top_positions(portfolio, date, asset_class=None, desc=True, order_by='percentage', limit=100):
     p_ccy = db_get_portfolio_info(ccy_only=True)[portfolio]
-    positions_sql = """SUM(m_data.base_last_close * (SELECT SUM(trade2.quantity) * MAX(trade2.multiplier)
-                                                     FROM exd_trades trade2
-                                                     WHERE instr.id = trade2.instrument_id AND
-                                                     trade2.trade_time <= '%s' AND
-                                                     trade2.portfolio = '%s'))""" % (date, portfolio)
+    positions_sql = """SUM(m_data.base_last_close * pos.position)"""
 
     top_positions = psg_db(sql="""SELECT DISTINCT
                                     a_class.name                          as asset_class,
@@ -613,15 +940,17 @@ def db_top_positions(portfolio, date, asset_class=None, desc=True, order_by='per
                                     %s OVER (PARTITION BY a_class.type)  as percentage
                                   FROM exd_market_data m_data
                                     JOIN wm_instrument instr ON instr.id = m_data.instrument_id
+                                    LEFT JOIN exd_positions pos ON pos.portfolio = '%s' AND pos.instrument_id = m_data.instrument_id AND
+                                                                   pos.position_date = m_data.close_timestamp
                                     JOIN (SELECT id, name, 'class' as type FROM wm_asset_class a_class
                                           UNION
                                           SELECT id, name, 'subclass' as type FROM wm_asset_subclass subclass) a_class 
                                           ON instr.asset_class_id = a_class.id OR instr.asset_subclass_id = a_class.id
                                     LEFT JOIN wm_company company on company.id = instr.company_id
                                   WHERE m_data.close_timestamp = '%s' AND m_data.p_currency = '%s' 
-                                  AND (SELECT %s FROM exd_market_data m_data) != 0;""" %
+                                  AND pos.position != 0;""" %
                                (positions_sql, positions_sql, positions_sql, positions_sql, positions_sql,
-                                positions_sql, positions_sql, positions_sql, date, p_ccy, positions_sql))
+                                positions_sql, positions_sql, positions_sql, portfolio, date, p_ccy))
     # order the result dict by requested value
     top_positions.sort(key=lambda tup: tup[order_by], reverse=desc)
 
@@ -641,377 +970,97 @@ def db_top_positions(portfolio, date, asset_class=None, desc=True, order_by='per
     return db_positions
 
 
-def db_dividends(portfolio, start_date=None, end_date=RECENT_DATE, class_data_only=True, interval=None):
-    # check if period is specified otherwise set to default values (since inception till now)
-    if not start_date:
-        start_date = db_get_portfolio_info()[portfolio]['start_date']
-
-    period = 'day' if interval == 'Daily' else 'month'
-
-    # get the dividends from DB
-    raw_dividends = psg_db(sql="""SELECT trades.instrument,
-                                   trades.currency,
-                                   trades.trade_time,
-                                   dividends.ex_date,
-                                   trades.position,
-                                   dividends.amount                                       as dividends,
-                                   trades.position * dividends.amount * trades.multiplier as income_per_payment,
-                                   SUM(trades.position * dividends.amount * trades.multiplier)
-                                   OVER (
-                                       PARTITION BY trades.instrument)                    as income_per_instr,
-                                   SUM(trades.position * dividends.amount * trades.multiplier /
-                                       CASE
-                                           WHEN trades.currency = trades.p_currency THEN 1
-                                           ELSE
-                                               (SELECT rates.rate_value
-                                                FROM wm_exchange_rate rates
-                                                WHERE trades.currency = rates.to_currency
-                                                  AND rates.from_currency = trades.p_currency
-                                                  AND rates.rate_timestamp <= dividends.ex_date
-                                                ORDER BY rates.rate_timestamp DESC
-                                                LIMIT 1)
-                                           END
-                                       )
-                                   OVER (
-                                       PARTITION BY trades.instrument )                   as exd_income_per_instr,
-                                   SUM(trades.position * dividends.amount * trades.multiplier / CASE
-                                                                                                    WHEN trades.currency = trades.p_currency THEN 1
-                                                                                                    ELSE
-                                                                                                        (SELECT rates.rate_value
-                                                                                                        FROM wm_exchange_rate rates
-                                                                                                        WHERE trades.currency = rates.to_currency
-                                                                                                          AND rates.from_currency = trades.p_currency
-                                                                                                          AND rates.rate_timestamp <= dividends.ex_date
-                                                                                                        ORDER BY rates.rate_timestamp DESC
-                                                                                                        LIMIT 1)
-                                       END
-                                       )
-                                   OVER ()                                                as exd_total,
-                                   SUM(trades.position * dividends.amount * trades.multiplier / CASE
-                                                                                                   WHEN trades.currency = trades.p_currency
-                                                                                                       THEN 1
-                                                                                                   ELSE
-                                                                                                       (SELECT rates.rate_value
-                                                                                                        FROM wm_exchange_rate rates
-                                                                                                        WHERE trades.currency = rates.to_currency
-                                                                                                          AND rates.from_currency = trades.p_currency
-                                                                                                          AND rates.rate_timestamp <= dividends.ex_date
-                                                                                                        ORDER BY rates.rate_timestamp DESC
-                                                                                                        LIMIT 1)
-                                       END)
-                                   OVER (PARTITION BY date_trunc('%s', ex_date))       as exd_total_period
-                            FROM (
-                                     SELECT trades.instrument_id,
-                                            trades.instrument,
-                                            trades.currency,
-                                            trades.p_currency,
-                                            trades.trade_time,
-                                            trades.multiplier,
-                                            LEAD(trades.trade_time, 1)
-                                            OVER (
-                                                PARTITION BY trades.instrument
-                                                ORDER BY
-                                                    trades.trade_time
-                                                )                            as next_trade_time,
-                                            SUM(trades.quantity)
-                                            OVER (
-                                                PARTITION BY trades.instrument
-                                                ORDER BY trades.trade_time ) as position
-                                     FROM exd_trades trades
-                                     WHERE trades.asset_class = 'Equities'
-                                       AND trades.portfolio = '%s') trades
-                                     JOIN wm_income_equity_dividends_data_view dividends
-                                          ON dividends.instrument_id = trades.instrument_id AND trades.trade_time < dividends.ex_date AND
-                                             dividends.ex_date <= coalesce(trades.next_trade_time, '2099-01-31')
-                            WHERE dividends.ex_date BETWEEN '%s' AND '%s'
-                              AND trades.position > 0
-                            ORDER BY lower(instrument);""" % (period, portfolio, start_date, end_date))
-    if class_data_only:
-        if interval == 'Monthly':
-            dividends = defaultdict(int, {
-                row['ex_date'] + relativedelta(day=31) if row['ex_date'] + relativedelta(day=31) < end_date
-                else end_date: row['exd_total_period']
-                for row in raw_dividends
-            } if raw_dividends else {})
-        elif interval == 'Daily':
-            dividends = defaultdict(int, {
-                row['ex_date'] + relativedelta(day=31) if row['ex_date'] + relativedelta(day=31) < end_date
-                else end_date: row['exd_total_period']
-                for row in raw_dividends} if raw_dividends else {})
-        else:
-            dividends = raw_dividends[0]['exd_total'] if raw_dividends else 0
-    else:
-        dividends = defaultdict(int, {row['instrument']: row['income_per_instr'] for row in
-                                      raw_dividends} if raw_dividends else {})
-    return dividends
-
-
-def db_coupons(portfolio, start_date=None, end_date=RECENT_DATE, class_data_only=True, interval=None):
-    # check if period is specified otherwise set to default values (since inception till now)
-    if not start_date:
-        start_date = db_get_portfolio_info()[portfolio]['start_date']
-
-    period = 'day' if interval == 'Daily' else 'month'
-
-    raw_coupons = psg_db(sql="""SELECT
-                              trades.instrument,
-                              trades.currency,
-                              trades.trade_time,
-                              coupons.coupon_date,
-                              trades.position,
-                              coupons.amount                                            as coupon,
-                              (trades.position * coupons.amount) / (
-                                (
-                                  SELECT DISTINCT SUM(coupons2.principal)
-                                  OVER (
-                                    PARTITION BY coupons2.instrument_id )
-                                  FROM wm_income_credit_coupons_data coupons2
-                                  WHERE coupons2.instrument_id = trades.instrument_id)) as income_per_payment,
-                              SUM((trades.position * coupons.amount) / (
-                                (
-                                  SELECT DISTINCT SUM(coupons2.principal)
-                                  OVER (
-                                    PARTITION BY coupons2.instrument_id )
-                                  FROM wm_income_credit_coupons_data coupons2
-                                  WHERE coupons2.instrument_id = trades.instrument_id)))
-                              OVER (
-                                PARTITION BY coupons.instrument_id )                    as income_per_instr,
-                              SUM((trades.position * coupons.amount) / (
-                                (
-                                  SELECT DISTINCT SUM(coupons2.principal)
-                                  OVER (
-                                    PARTITION BY coupons2.instrument_id )
-                                  FROM wm_income_credit_coupons_data coupons2
-                                  WHERE coupons2.instrument_id = trades.instrument_id)) / CASE
-                                                                           WHEN trades.currency = trades.p_currency THEN 1
-                                                                           ELSE
-                                                                               (SELECT rates.rate_value
-                                                                                  FROM fx_rates_full rates
-                                                                                  WHERE rates.to_currency = trades.currency
-                                                                                  AND rates.from_currency = trades.p_currency
-                                                                                  AND rates.rate_timestamp <= coupons.coupon_date
-                                                                                ORDER BY rates.rate_timestamp DESC
-                                                                                LIMIT 1)
-                              END)
-                              OVER (
-                                PARTITION BY coupons.instrument_id )                    as exd_income_per_instr,
-                              SUM((trades.position * coupons.amount) / (
-                                (
-                                  SELECT DISTINCT SUM(coupons2.principal)
-                                  OVER (
-                                    PARTITION BY coupons2.instrument_id )
-                                  FROM wm_income_credit_coupons_data coupons2
-                                  WHERE coupons2.instrument_id = trades.instrument_id)) / CASE
-                                                                           WHEN trades.currency = trades.p_currency THEN 1
-                                                                           ELSE
-                                                                               (SELECT rates.rate_value
-                                                                                FROM fx_rates_full rates
-                                                                                WHERE trades.currency = rates.to_currency
-                                                                                  AND rates.from_currency = trades.p_currency
-                                                                                  AND rates.rate_timestamp <= coupons.coupon_date
-                                                                                ORDER BY rates.rate_timestamp DESC
-                                                                                LIMIT 1)
-                              END)
-                              OVER ()                                                   as exd_total,
-                               SUM((trades.position * coupons.amount) / (
-                                (
-                                  SELECT DISTINCT SUM(coupons2.principal)
-                                  OVER (
-                                    PARTITION BY coupons2.instrument_id )
-                                  FROM wm_income_credit_coupons_data coupons2
-                                  WHERE coupons2.instrument_id = trades.instrument_id)) / CASE
-                                                                           WHEN trades.currency = trades.p_currency THEN 1
-                                                                           ELSE
-                                                                               (SELECT rates.rate_value
-                                                                                FROM fx_rates_full rates
-                                                                                WHERE trades.currency = rates.to_currency
-                                                                                  AND rates.from_currency = trades.p_currency
-                                                                                  AND rates.rate_timestamp <= coupons.coupon_date
-                                                                                ORDER BY rates.rate_timestamp DESC
-                                                                                LIMIT 1)
-                              END)
-                              OVER (PARTITION BY date_trunc('%s', coupon_date))                      as exd_total_period
-                            FROM (
-                                   SELECT
-                                     trades.instrument_id,
-                                     trades.instrument,
-                                     trades.currency,
-                                     trades.p_currency,
-                                     trades.trade_time,
-                                     LEAD(trades.trade_time, 1)
-                                     OVER (
-                                       PARTITION BY trades.instrument
-                                       ORDER BY
-                                         trades.trade_time
-                                       )                            as next_trade_time,
-                                     SUM(trades.quantity)
-                                            OVER (
-                                                PARTITION BY trades.instrument
-                                                ORDER BY trades.trade_time ) as position
-                                   FROM exd_trades trades
-                                   WHERE trades.asset_class = 'Credit' AND trades.portfolio = '%s') trades
-                              JOIN wm_income_credit_coupons_data coupons
-                                ON coupons.instrument_id = trades.instrument_id AND trades.trade_time < coupons.coupon_date AND
-                                   coupons.coupon_date <= coalesce(trades.next_trade_time, '2099-01-31')
-                            WHERE coupons.coupon_date BETWEEN '%s' AND '%s' AND trades.position > 0
-                            ORDER BY lower(instrument);""" % (period, portfolio, start_date, end_date))
-
-    if class_data_only:
-        if interval == 'Monthly':
-            coupons = defaultdict(int,{
-                row['coupon_date'] + relativedelta(day=31) if row['coupon_date'] + relativedelta(day=31) < end_date
-                else end_date: row['exd_total_period']
-                for row in raw_coupons} if raw_coupons else {})
-        elif interval == 'Daily':
-            coupons = defaultdict(int, {
-                row['coupon_date'] + relativedelta(day=31) if row['coupon_date'] + relativedelta(day=31) < end_date
-                else end_date: row['exd_total_period']
-                for row in raw_coupons} if raw_coupons else {})
-        else:
-            coupons = raw_coupons[0]['exd_total'] if raw_coupons else 0
-    else:
-        coupons = defaultdict(int, {row['instrument']: row['income_per_instr'] for row in raw_coupons} if raw_coupons else {})
-    return coupons
-
-
-def db_non_market_income(portfolio, start_date=None, end_date=RECENT_DATE, class_data_only=True, interval=None):
-    # check if period is specified otherwise set to default values (since inception till now)
-    if not start_date:
-        start_date = db_get_portfolio_info()[portfolio]['start_date']
-    # this line is commented since there is only one day for income for non-market so far
-    # period = 'day' if interval == 'Daily' else 'month'
-
-    raw_non_market = psg_db(sql="""SELECT
-                                  trades.instrument,
-                                  t.date + interval '1 month' - interval '1 day'   as calculated_date,
-                                  (trades.quantity * amount / 12)               as payment,
-                                  (trades.quantity * amount / 12) / CASE
-                                                                        WHEN trades.currency = trades.p_currency THEN 1
-                                                                        ELSE(SELECT rate_value
-                                                   FROM wm_exchange_rate rates
-                                                   WHERE rates.to_currency = non_market.currency 
-                                                         AND rates.from_currency = trades.p_currency
-                                                         AND rates.rate_timestamp <= (t.date + interval '1 month' - interval '1 day')
-                                                   ORDER BY rates.rate_timestamp DESC
-                                                   LIMIT 1) END   as exd_income_per_instr,
-                                  SUM(trades.quantity * amount / 12)
-                                  OVER (
-                                    PARTITION BY trades.instrument ) as income_per_instr,
-                                  SUM((trades.quantity * amount / 12) / CASE
-                                                                        WHEN trades.currency = trades.p_currency THEN 1
-                                                                        ELSE(SELECT rate_value
-                                                       FROM wm_exchange_rate rates
-                                                       WHERE rates.to_currency = non_market.currency 
-                                                             AND rates.from_currency = trades.p_currency
-                                                             AND rates.rate_timestamp <= (t.date + interval '1 month' - interval '1 day')
-                                                       ORDER BY rates.rate_timestamp DESC
-                                                       LIMIT 1) END)
-                                  OVER ()                     as exd_total,
-                                                SUM((trades.quantity * amount / 12) / CASE
-                                                 WHEN trades.currency = trades.p_currency THEN 1
-                                                 ELSE (SELECT rate_value
-                                                       FROM wm_exchange_rate rates
-                                                       WHERE rates.to_currency = non_market.currency
-                                                         AND rates.from_currency = trades.p_currency
-                                                         AND rates.rate_timestamp <= (t.date + interval '1 month' - interval '1 day')
-                                                       ORDER BY rates.rate_timestamp DESC
-                                                       LIMIT 1) END)
-                                  OVER (PARTITION BY t.date + interval '1 month' - interval '1 day') as exd_total_period
-                                FROM wm_income_non_market_data non_market
-                                  JOIN exd_trades trades ON trades.instrument_id = non_market.instrument_id AND trades.portfolio = '%s'
-                                  JOIN generate_series(date '%s',
-                                                       date '%s',
-                                                       interval '1 month') as t(date) 
-                                                       ON (t.date + interval '1 month' - interval '1 day') BETWEEN 
-                                                       (non_market.start_date + interval '1 day') AND date '%s'
-                                  JOIN wm_asset_class a_class ON a_class.id = trades.asset_class_id AND a_class.name = 'Real Estate';""" %
-                                (portfolio, start_date.replace(day=1), end_date, end_date))
-
-    if class_data_only:
-        if interval in ['Monthly', 'Daily']:
-            non_market = defaultdict(int, {row['calculated_date'].date(): row['exd_total_period'] if row['exd_total_period'] else 0
-                          for row in raw_non_market} if raw_non_market else {})
-        else:
-            non_market = raw_non_market[0]['exd_total'] if raw_non_market else 0
-    else:
-        non_market = defaultdict(int, {row['instrument']: row['income_per_instr'] for row in raw_non_market} if raw_non_market else {})
-
-    return non_market
-
-
-def db_cash_income(portfolio, start_date=None, end_date=RECENT_DATE, class_data_only=True, interval=None):
-    # check if period is specified otherwise set to default values (since inception till now)
-    if not start_date:
-        start_date = db_get_portfolio_info()[portfolio]['start_date']
-
-    # this line is commented since there is only one day for income for non-market so far
-    # period = 'day' if interval == 'Daily' else 'month'
-
+def db_income_payments(portfolio, start_date, end_date):
+    """
+    :param portfolio: portfolio name
+    :param start_date: the first date of the period
+    :param end_date: the last date of the period
+    :return: income payments of dividends, coupons, cash and real estate as rows of
+             asset_class, instrument, pay_date, amount (instrument currency), exd_amount (portfolio currency)
+             ordered by asset class, instrument and date, positions are calculated once for all of them
+    """
     p_ccy = db_get_portfolio_info(ccy_only=True)[portfolio]
-    cash_income = psg_db(sql="""SELECT
-                                  t.date + interval '1 month' - interval '1 day' as calculated_date,
-                                  'USDCash' as instrument,
-                                  (SELECT SUM(trades.quantity)
-                                   FROM exd_trades trades
-                                   WHERE trades.trade_time <= t.date + interval '1 month' - interval '1 day' 
-                                   AND trades.instrument = 'USDCash' AND
-                                         trades.portfolio = '%s')             as position,
-                                  0.02 * (SELECT SUM(trades.quantity)
-                                          FROM exd_trades trades
-                                          WHERE trades.trade_time <= t.date + interval '1 month' - interval '1 day' 
-                                          AND trades.instrument = 'USDCash' AND
-                                                trades.portfolio = '%s') / 12 as payment,
-                                  SUM(0.02 * (SELECT SUM(trades.quantity)
+    names = {'portfolio': portfolio, 'p_ccy': p_ccy, 'start': start_date, 'end': end_date,
+             'month': start_date.replace(day=1)}
+
+    payments = psg_db(sql="""WITH positions AS (SELECT trades.instrument_id,
+                                                     trades.instrument,
+                                                     trades.asset_class,
+                                                     trades.currency,
+                                                     trades.p_currency,
+                                                     trades.multiplier,
+                                                     trades.quantity,
+                                                     trades.trade_time,
+                                                     LEAD(trades.trade_time, 1)
+                                                     OVER (PARTITION BY trades.instrument ORDER BY trades.trade_time) as next_trade_time,
+                                                     SUM(trades.quantity)
+                                                     OVER (PARTITION BY trades.instrument ORDER BY trades.trade_time) as position
                                               FROM exd_trades trades
-                                              WHERE trades.trade_time <= t.date + interval '1 month' - interval '1 day' 
-                                              AND trades.instrument = 'USDCash' AND
-                                                    trades.portfolio = '%s') / 12) 
-                                  OVER () as income_per_instr,                            
-                                  SUM((0.02 * (SELECT SUM(trades.quantity)
-                                              FROM exd_trades trades
-                                              WHERE trades.trade_time <= t.date + interval '1 month' - interval '1 day' 
-                                              AND trades.instrument = 'USDCash' AND
-                                                    trades.portfolio = '%s') / 12) / CASE
-                                                                        WHEN '%s' = 'USD' THEN 1
-                                                                        ELSE (SELECT rate_value
-                                                                              FROM wm_exchange_rate rates
-                                                                              WHERE rates.to_currency = 'USD'
-                                                                                AND rates.from_currency = '%s'                                                                          
-                                                                                AND rates.rate_timestamp <= (t.date + interval '1 month' - interval '1 day')
-                                                                              ORDER BY rates.rate_timestamp DESC
-                                                                              LIMIT 1) END)
-                                  OVER ()                                         as exd_total,
-                                  (0.02 * (SELECT SUM(trades.quantity)
-                                              FROM exd_trades trades
-                                              WHERE trades.trade_time <= t.date + interval '1 month' - interval '1 day' 
-                                              AND trades.instrument = 'USDCash' AND
-                                                    trades.portfolio = '%s') / 12) / CASE
-                                                                        WHEN '%s' = 'USD' THEN 1
-                                                                        ELSE (SELECT rate_value
-                                                                              FROM wm_exchange_rate rates
-                                                                              WHERE rates.to_currency = 'USD'
-                                                                                AND rates.from_currency = '%s'                                                                          
-                                                                                AND rates.rate_timestamp <= (t.date + interval '1 month' - interval '1 day')
-                                                                              ORDER BY rates.rate_timestamp DESC
-                                                                              LIMIT 1) END     as exd_total_period
-                                FROM generate_series(date '%s',
-                                                     date '%s',
-                                                     interval '1 month') as t(date)
-                                WHERE t.date + interval '1 month' - interval '1 day' <= date '%s';""" %
-                             (portfolio, portfolio, portfolio, portfolio, p_ccy, p_ccy, portfolio, p_ccy, p_ccy,
-                              start_date.replace(day=1), end_date, end_date))
-
-    if class_data_only:
-        if interval in ['Monthly', 'Daily']:
-            cash = defaultdict(int, {row['calculated_date'].date(): row['exd_total_period'] if row['exd_total_period'] else 0
-                                     for row in cash_income} if cash_income else {})
-        else:
-            cash = cash_income[0]['exd_total'] if cash_income and cash_income[-1]['payment'] else 0
-    else:
-        cash = defaultdict(int, {row['instrument']: row['income_per_instr'] if row['income_per_instr'] else 0
-                                 for row in cash_income} if cash_income else {})
-
-    return cash
+                                              WHERE trades.portfolio = '%(portfolio)s'),
+                                  months AS (SELECT (t.date + interval '1 month' - interval '1 day')::date as pay_date
+                                             FROM generate_series(date '%(month)s', date '%(end)s', interval '1 month') as t(date)
+                                             WHERE t.date + interval '1 month' - interval '1 day' <= date '%(end)s')
+                             SELECT 'Equities'                                                   as asset_class,
+                                    pos.instrument,
+                                    dividends.ex_date::date                                      as pay_date,
+                                    pos.position * dividends.amount * pos.multiplier             as amount,
+                                    pos.position * dividends.amount * pos.multiplier /
+                                    CASE WHEN pos.currency = pos.p_currency THEN 1 ELSE fx.rate_value END as exd_amount
+                             FROM positions pos
+                                      JOIN wm_income_equity_dividends_data_view dividends
+                                           ON dividends.instrument_id = pos.instrument_id AND pos.trade_time < dividends.ex_date AND
+                                              dividends.ex_date <= coalesce(pos.next_trade_time, '2099-01-31')
+                                      LEFT JOIN fx_rates_asof fx
+                                           ON fx.from_currency = pos.p_currency AND fx.to_currency = pos.currency AND
+                                              dividends.ex_date >= fx.valid_from AND dividends.ex_date < fx.valid_to
+                             WHERE pos.asset_class = 'Equities' AND pos.position > 0
+                               AND dividends.ex_date BETWEEN '%(start)s' AND '%(end)s'
+                             UNION ALL
+                             SELECT 'Credit',
+                                    pos.instrument,
+                                    coupons.coupon_date::date,
+                                    pos.position * coupons.amount / principals.principal,
+                                    pos.position * coupons.amount / principals.principal /
+                                    CASE WHEN pos.currency = pos.p_currency THEN 1 ELSE fx.rate_value END
+                             FROM positions pos
+                                      JOIN wm_income_credit_coupons_data coupons
+                                           ON coupons.instrument_id = pos.instrument_id AND pos.trade_time < coupons.coupon_date AND
+                                              coupons.coupon_date <= coalesce(pos.next_trade_time, '2099-01-31')
+                                      JOIN coupon_principals principals ON principals.instrument_id = pos.instrument_id
+                                      LEFT JOIN fx_rates_asof fx
+                                           ON fx.from_currency = pos.p_currency AND fx.to_currency = pos.currency AND
+                                              coupons.coupon_date >= fx.valid_from AND coupons.coupon_date < fx.valid_to
+                             WHERE pos.asset_class = 'Credit' AND pos.position > 0
+                               AND coupons.coupon_date BETWEEN '%(start)s' AND '%(end)s'
+                             UNION ALL
+                             SELECT 'Cash and Equivalents',
+                                    'USDCash',
+                                    months.pay_date,
+                                    0.02 * pos.position / 12,
+                                    0.02 * pos.position / 12 / CASE WHEN '%(p_ccy)s' = 'USD' THEN 1 ELSE fx.rate_value END
+                             FROM months
+                                      LEFT JOIN positions pos
+                                           ON pos.instrument = 'USDCash' AND pos.trade_time <= months.pay_date AND
+                                              months.pay_date < coalesce(pos.next_trade_time, 'infinity')
+                                      LEFT JOIN fx_rates_asof fx
+                                           ON fx.from_currency = '%(p_ccy)s' AND fx.to_currency = 'USD' AND
+                                              months.pay_date >= fx.valid_from AND months.pay_date < fx.valid_to
+                             UNION ALL
+                             SELECT 'Real Estate',
+                                    pos.instrument,
+                                    months.pay_date,
+                                    pos.quantity * non_market.amount / 12,
+                                    pos.quantity * non_market.amount / 12 /
+                                    CASE WHEN pos.currency = pos.p_currency THEN 1 ELSE fx.rate_value END
+                             FROM wm_income_non_market_data non_market
+                                      JOIN positions pos ON pos.instrument_id = non_market.instrument_id AND pos.asset_class = 'Real Estate'
+                                      JOIN months ON months.pay_date >= non_market.start_date + interval '1 day'
+                                      LEFT JOIN fx_rates_asof fx
+                                           ON fx.from_currency = pos.p_currency AND fx.to_currency = non_market.currency AND
+                                              months.pay_date >= fx.valid_from AND months.pay_date < fx.valid_to
+                             ORDER BY asset_class, pay_date;""" % names)
+
+    return payments
 
 
 def db_principal_pay(portfolio, start_date):
@@ -1027,17 +1076,7 @@ def db_principal_pay(portfolio, start_date):
                                          SELECT DISTINCT bonds.perpetual,
                                                          SUM(trades.quantity)
                                                          OVER (
-                                                             PARTITION BY trades.instrument_id ) / CASE
-                                                                       WHEN trades.currency = trades.p_currency
-                                                                           THEN 1
-                                                                       ELSE
-                                                                           (SELECT rates.rate_value
-                                                                            FROM wm_exchange_rate rates
-                                                                            WHERE trades.currency = rates.to_currency
-                                                                              AND rates.from_currency = trades.p_currency
-                                                                              AND rates.rate_timestamp <= coupons.coupon_date
-                                                                            ORDER BY rates.rate_timestamp DESC
-                                                                            LIMIT 1) END as principal,
+                                                             PARTITION BY trades.instrument_id ) / CASE WHEN trades.currency = trades.p_currency THEN 1 ELSE fx.rate_value END as principal,
                                                          MAX(coalesce(coupons.coupon_date, bonds.expiry))
                                                          OVER (
                                                              PARTITION BY trades.instrument_id )             as call_date
@@ -1045,14 +1084,20 @@ def db_principal_pay(portfolio, start_date):
                                                   JOIN wm_bond_instrument bonds
                                                        ON bonds.instrument_id = trades.instrument_id AND
                                                           coalesce(bonds.expiry, '2100-01-01') > '%s'
+                                                  JOIN coupon_principals principals
+                                                       ON principals.instrument_id = trades.instrument_id AND
+                                                          principals.last_principal_date > '%s'
                                                   JOIN wm_income_credit_coupons_data coupons
                                                        ON coupons.instrument_id = trades.instrument_id AND coupons.coupon_date > '%s' AND
                                                           coupons.principal != 0
+                                                  LEFT JOIN fx_rates_asof fx
+                                                       ON fx.from_currency = trades.p_currency AND fx.to_currency = trades.currency AND
+                                                          coupons.coupon_date >= fx.valid_from AND coupons.coupon_date < fx.valid_to
                                          WHERE trades.portfolio = '%s'
                                            AND (bonds.perpetual is TRUE) is not NULL) bonds_call
                                 WHERE principal > 0;
                                 ;""" %
-                           (start_date, start_date, portfolio))
+                           (start_date, start_date, start_date, portfolio))
 
     db_principal = {'Perpetual' if row['perpetual']
                     else row['call_year'].date(): row['principal_by_type'] if row['perpetual']
@@ -1061,7 +1106,7 @@ def db_principal_pay(portfolio, start_date):
     return db_principal
 
 
-def db_get_portfolio_info(parametrized=False, ids_only=False, ccy_only=False):
+def db_portfolios():
     sql = """SELECT DISTINCT portfolios.name as portfolio,
                 portfolios.id   as portfolio_id,
                 ccy.name        as p_currency,
@@ -1070,7 +1115,35 @@ def db_get_portfolio_info(parametrized=False, ids_only=False, ccy_only=False):
                       JOIN wm_portfolio_trade trades ON portfolios.id = trades.portfolio_id
                       JOIN wm_currency ccy ON portfolios.currency_id = ccy.id;"""
 
-    portfolios = psg_db(sql)
+    return reference_cache.get('portfolios', lambda: psg_db(sql))
+
+
+def db_portfolio_trades_count(portfolio_id):
+    """
+    :param portfolio_id: portfolio id
+    :return: number of trades stored for the portfolio
+    """
+    count = psg_db(sql="""SELECT COUNT(*) as cnt FROM wm_portfolio_trade WHERE portfolio_id = %s;""" % portfolio_id)
+
+    return count[0]['cnt']
+
+
+def db_portfolios_fingerprint():
+    """
+    :return: string which changes when portfolios or their trades are added or removed in the DB
+    """
+    db = db_config(config)
+    state = psg_db(sql="""SELECT (SELECT COUNT(*) FROM wm_portfolio) as portfolios,
+                                 (SELECT MAX(id) FROM wm_portfolio) as max_portfolio,
+                                 (SELECT COUNT(*) FROM wm_portfolio_trade) as trades,
+                                 (SELECT MAX(id) FROM wm_portfolio_trade) as max_trade;""")[0]
+
+    return '%s:%s/%s|%s|%s|%s|%s' % (db['host'], db['port'], db['database'], state['portfolios'],
+                                     state['max_portfolio'], state['trades'], state['max_trade'])
+
+
+def db_get_portfolio_info(parametrized=False, ids_only=False, ccy_only=False):
+    portfolios = db_portfolios()
 
     if parametrized:
         p_packed = [(row['portfolio'], row['portfolio_id'])
@@ -1101,11 +1174,13 @@ def db_benchmark_prices(benchmark, start_date, end_date):
 
 
 def db_asset_classes(asset_type):
-    types_info = psg_db(sql="""SELECT id, name FROM wm_asset_class a_class
-                                   UNION
-                               SELECT id, name FROM wm_asset_subclass subclass;""")
+    def load():
+        types_info = psg_db(sql="""SELECT id, name FROM wm_asset_class a_class
+                                       UNION
+                                   SELECT id, name FROM wm_asset_subclass subclass;""")
+        return {row['name']: row['id'] for row in types_info}
 
-    db_types = {row['name']: row['id'] for row in types_info}
+    db_types = reference_cache.get('asset_classes', load)
 
     return db_types[asset_type]
 
@@ -1177,8 +1252,8 @@ def db_portfolio_snapshot(portfolio, order_by='instrument', desc=False):
     return snapshot
 
 
-def db_portfolio_trades(portfolio, status_date=RECENT_DATE, raw_view=False):
-    sql = """SELECT trades.trade_id,
+# trades of a portfolio as API shows them
+portfolio_trades_sql = """SELECT trades.trade_id,
                trades.description,
                trades.instrument,
                a_class.name as asset_class,
@@ -1195,27 +1270,72 @@ def db_portfolio_trades(portfolio, status_date=RECENT_DATE, raw_view=False):
                trades.notes
         FROM exd_trades trades
         JOIN wm_asset_class a_class ON a_class.id = trades.asset_class_id
-        WHERE trades.portfolio = '%s' AND trades.trade_time <= '%s';""" % (portfolio, status_date)
+        WHERE trades.portfolio = '%s' AND trades.trade_time <= '%s'"""
+
 
-    trades = psg_db(sql)
+def db_portfolio_trades(portfolio, status_date=RECENT_DATE, raw_view=False):
+    sql = portfolio_trades_sql % (portfolio, status_date) + ';'
+
+    # rows are read by the cursor and packed without the intermediate list
+    trades = psg_db_stream(sql)
     db_trades = dict()
 
     if raw_view:
         for trade in trades:
-            trade['trade_time'] = trade['trade_time']
             if trade['instrument'] in db_trades:
                 db_trades[trade['instrument']].append(trade)
             else:
                 db_trades[trade['instrument']] = [trade]
-            db_trades[trade['instrument']].sort(key=lambda tup: tup['trade_time'])
+        # trades of every instrument are sorted once, the sort is stable as before
+        for instr_trades in db_trades.values():
+            instr_trades.sort(key=lambda tup: tup['trade_time'])
     else:
         db_trades = {trade['trade_id']: trade for trade in trades}
 
     return db_trades
 
 
-def db_avg_price(portfolio, price_date=None):
-    sql = """WITH RECURSIVE
+def db_portfolio_trades_stream(portfolio, status_date=RECENT_DATE):
+    """
+    :param portfolio: portfolio name
+    :param status_date: the latest trade date
+    :return: generator of trades ordered by trade date, trades are fetched by server-side cursor
+    """
+    sql = portfolio_trades_sql % (portfolio, status_date) + ' ORDER BY trades.trade_time, trades.trade_id;'
+
+    return psg_db_stream(sql)
+
+
+def db_portfolio_trades_columns(portfolio, status_date=RECENT_DATE, method='cursor'):
+    """
+    :param portfolio: portfolio name
+    :param status_date: the latest trade date
+    :param method: 'cursor' or 'copy', see DbPostgres.columns()
+    :return: {column: numpy array} of instrument, trade_time (date), position_date, quantity, price and multiplier
+             ordered by instrument and trade time
+    """
+    # as in exd_positions, a trade is in the position of the first date not earlier than trade time
+    sql = """SELECT trades.instrument,
+                    trades.trade_time::date                                                                as trade_time,
+                    date_trunc('day', trades.trade_time + interval '1 day' - interval '1 microsecond')::date as position_date,
+                    trades.quantity,
+                    trades.price,
+                    trades.multiplier
+             FROM exd_trades trades
+             JOIN wm_asset_class a_class ON a_class.id = trades.asset_class_id
+             WHERE trades.portfolio = '%s' AND trades.trade_time <= '%s'
+             ORDER BY trades.instrument, trades.trade_time, trades.trade_id""" % (portfolio, status_date)
+
+    return psg_db_columns(sql, method)
+
+
+def avg_price_recursive_sql(portfolio, trades='exd_trades'):
+    """
+    :param portfolio: portfolio name
+    :param trades: table with trades
+    :return: the former recursive query for average price, kept for tests/benchmarks/avg_price.py
+    """
+    return """WITH RECURSIVE
                     positions AS (SELECT DISTINCT trades.portfolio,
                                                   trades.instrument,
                                                   trades.trade_time,
@@ -1229,7 +1349,7 @@ def db_avg_price(portfolio, price_date=None):
                                                   coalesce(SUM(trades.quantity)
                                                            OVER (PARTITION BY trades.portfolio, trades.instrument_id ROWS BETWEEN UNBOUNDED PRECEDING AND 1 preceding),
                                                            0)                                                                                                 as prev_position
-                                  FROM exd_trades trades
+                                  FROM %s trades
                                   WHERE trades.portfolio = '%s'),
                     avg_price AS (
                         SELECT p1.instrument,
@@ -1257,58 +1377,88 @@ def db_avg_price(portfolio, price_date=None):
                                  JOIN avg_price avg ON avg.instrument = p2.instrument AND p2.prev_trade_time = avg.trade_time AND
                                                        p2.prev_position = avg.sum_position)
                 SELECT instrument, trade_time, avg_price
-                FROM avg_price;""" % portfolio
+                FROM avg_price;""" % (trades, portfolio)
 
-    avg = psg_db(sql)
 
-    db_avg = defaultdict(int, dict())
-    for pos in avg:
-        if pos['instrument'] in db_avg:
-            db_avg[pos['instrument']].update(defaultdict(int, {pos['trade_time'].date(): pos['avg_price']}))
-        else:
-            db_avg[pos['instrument']] = defaultdict(int, {pos['trade_time'].date(): pos['avg_price']})
+def avg_price_trades_sql(portfolio, trades='exd_trades'):
+    """
+    :param portfolio: portfolio name
+    :param trades: table with trades
+    :return: query for trades in the order average price is calculated
+    """
+    return """SELECT trades.instrument, trades.trade_time::date as trade_date, trades.quantity, trades.price
+              FROM %s trades
+              WHERE trades.portfolio = '%s'
+              ORDER BY trades.instrument_id, trades.trade_time, trades.quantity DESC, trades.price;""" % (
+        trades, portfolio)
+
+
+def db_avg_price_engine(portfolio):
+    """
+    :param portfolio: portfolio name
+    :return: AvgPrice object with average prices of all portfolio instruments
+    """
+    avg = AvgPrice()
+    trades = psg_db_stream(avg_price_trades_sql(portfolio), row_format='tuple')
+    for instrument, trade_date, quantity, price in trades:
+        avg.add(instrument, trade_date, quantity, price)
+
+    return avg
+
+
+def db_avg_price(portfolio, price_date=None):
+    avg = db_avg_price_engine(portfolio)
+
+    db_avg = defaultdict(int, {instr: defaultdict(int, data) for instr, data in avg.series().items()})
 
     if price_date:
-        for instr, data in db_avg.items():
-            trade_dates = sorted(data.keys())
-            if min(trade_dates) > price_date:
-                db_avg[instr].update({price_date: 0.0})
-                continue
-            nearest_trade_date = max(dt for dt in trade_dates if dt <= price_date)
-            db_avg[instr].update({price_date: db_avg[instr][nearest_trade_date]})
+        for instr in db_avg:
+            db_avg[instr].update({price_date: avg.at(instr, price_date)})
 
     return db_avg
 
 
 def db_fees(portfolio, fee_date=None):
-    fees = psg_db(sql="""SELECT DISTINCT trades.portfolio,
+    fees = psg_db_stream(sql="""SELECT DISTINCT trades.portfolio,
                             trades.instrument,
                             trades.trade_time,
                             -coalesce((SUM(trades.fees * trades.fx_close * trades.multiplier / trades.fx_trade)
                              OVER (PARTITION BY trades.portfolio_id, trades.instrument_id ORDER BY trades.trade_time)), 0) as fees
                         FROM exd_trades trades
-                        WHERE trades.portfolio = '%s';""" % portfolio)
+                        WHERE trades.portfolio = '%s';""" % portfolio, row_format='tuple')
 
     db_commission = dict()
 
-    for fee in fees:
-        if fee['instrument'] in db_commission:
-            db_commission[fee['instrument']].update({fee['trade_time'].date(): fee['fees']})
+    for _, instrument, trade_time, fee in fees:
+        if instrument in db_commission:
+            db_commission[instrument].update({trade_time.date(): fee})
         else:
-            db_commission[fee['instrument']] = {fee['trade_time'].date(): fee['fees']}
+            db_commission[instrument] = {trade_time.date(): fee}
 
     if fee_date:
-        for instr, data in db_commission.items():
-            trade_dates = sorted(data.keys())
-            if min(trade_dates) > fee_date:
-                db_commission[instr] = 0.0
-                continue
-            nearest_trade_date = max(dt for dt in trade_dates if dt <= fee_date)
-            db_commission[instr] = db_commission[instr][nearest_trade_date]
+        db_commission = fees_at_date(db_commission, fee_date)
 
     return db_commission
 
 
+def fees_at_date(db_commission, fee_date):
+    """
+    :param db_commission: {instrument: {trade date: fees}} as returned by db_fees() without date
+    :param fee_date: date
+    :return: {instrument: fees paid till the date}
+    """
+    fees = dict()
+    for instr, data in db_commission.items():
+        trade_dates = sorted(data.keys())
+        if min(trade_dates) > fee_date:
+            fees[instr] = 0.0
+            continue
+        nearest_trade_date = max(dt for dt in trade_dates if dt <= fee_date)
+        fees[instr] = data[nearest_trade_date]
+
+    return fees
+
+
 def db_close_price(portfolio, close_date):
     close = psg_db(sql="""SELECT trades.instrument, last_close
                             FROM exd_market_data m_data
@@ -1324,18 +1474,62 @@ def db_close_price(portfolio, close_date):
     return db_close
 
 
+def db_close_price_for_dates(portfolio, dates):
+    """
+    :param portfolio: portfolio name
+    :param dates: list or range of dates, datetimes or date strings
+    :return: {date as passed: {instrument: close price}}, empty dict for dates without prices
+    """
+    days = {dt: as_date(dt) for dt in dates}
+    if not days:
+        return dict()
+
+    close = psg_db(sql="""SELECT m_data.close_timestamp::date as close_date, trades.instrument, MAX(m_data.last_close) as last_close
+                            FROM exd_market_data m_data
+                          JOIN (SELECT DISTINCT instrument_id, instrument FROM exd_trades WHERE portfolio = '%s') trades
+                               ON trades.instrument_id = m_data.instrument_id
+                          WHERE close_timestamp IN (%s)
+                          GROUP BY m_data.close_timestamp, trades.instrument;""" % (
+        portfolio, ', '.join(["'%s'" % day for day in sorted(set(days.values()))])))
+
+    # rows come by date, they are returned by the keys of the caller
+    close_days = defaultdict(dict)
+    for row in close:
+        close_days[row['close_date']][row['instrument']] = row['last_close']
+
+    return {dt: dict(close_days.get(day, dict())) for dt, day in days.items()}
+
+
+def db_fx_rates():
+    """
+    :return: FxRates with all as-of exchange rates, loaded once per session
+    """
+    def load():
+        rates = psg_db_stream(sql="""SELECT from_currency, to_currency, valid_from, rate_value
+                                     FROM fx_rates_asof
+                                     ORDER BY from_currency, to_currency, valid_from;""", row_format='tuple')
+        fx = FxRates()
+        for from_currency, to_currency, valid_from, rate_value in rates:
+            fx.add(from_currency, to_currency, valid_from, rate_value)
+        return fx
+
+    return reference_cache.get('fx_rates', load)
+
+
 def db_fx_rate(portfolio, fx_date):
-    fx = psg_db(sql="""SELECT trades.instrument,
-                       CASE
-                           WHEN trades.currency = trades.p_currency THEN 1.0
-                               ELSE rates.rate_value 
-                           END as rate_value
-                       FROM exd_trades trades
-                                LEFT JOIN fx_rates_full rates
-                                          ON rates.from_currency = trades.p_currency AND rates.to_currency = trades.currency AND
-                                             rates.rate_timestamp = '%s'
-                       WHERE trades.portfolio = '%s';""" % (fx_date, portfolio))
-
-    db_fx = {row['instrument']: row['rate_value'] for row in fx}
+    # rates are resolved by the session cache, only currencies of instruments are read
+    currencies = psg_db(sql="""SELECT DISTINCT trades.instrument, trades.currency, trades.p_currency
+                               FROM exd_trades trades
+                               WHERE trades.portfolio = '%s';""" % portfolio)
+    fx = db_fx_rates()
+
+    db_fx = {row['instrument']: fx.at(row['p_currency'], row['currency'], fx_date) for row in currencies}
 
     return db_fx
+
+
+# SQL is reported by the function of this module sending it, the innermost one if they call each other
+for _name, _func in list(globals().items()):
+    if inspect.isfunction(_func) and _func.__module__ == __name__ and not _name.startswith('psg_db'):
+        globals()[_name] = named(_func)
+del _name, _func
@@ -0,0 +1,76 @@
+import pytest
+
+from framework.allocations import Allocations, value_sum
+
+
+def holding(value, class_id, asset_class, subclass_id, subclass, geo_id, region_id, region, currency, sector, rating_id,
+            rating):
+    class_names = [name for name in [asset_class, subclass] if name is not None]
+    return {'value': value, 'asset_class_id': class_id, 'asset_class': asset_class, 'asset_subclass_id': subclass_id,
+            'asset_subclass': subclass, 'geo_region_id': geo_id, 'region_id': region_id, 'region': region,
+            'currency': currency, 'industry_sector': sector, 'credit_rating': rating_id, 'rating': rating,
+            'class_names': class_names}
+
+
+@pytest.fixture
+def allocations():
+    # None is an instrument without position, 0 is a closed position, geo region 7 has no region row
+    holdings = [holding(60, 1, 'Equities', 10, 'Large', 1, 1, 'EU', 'USD', 'Tech', None, None),
+                holding(20, 1, 'Equities', 11, 'Small', 2, 2, 'US', 'EUR', '', None, None),
+                holding(20, 2, 'Credit', None, None, 7, None, None, 'USD', None, 1, 'AAA'),
+                holding(None, 2, 'Credit', None, None, 1, 1, 'EU', 'GBP', None, 2, 'BB'),
+                holding(0, None, None, None, None, None, None, None, 'CHF', None, None, None)]
+    custodians = [{'custodian_id': 1, 'custodian': 'Bank', 'value': 30},
+                  {'custodian_id': None, 'custodian': 'Unknown', 'value': 10}]
+    calls = list()
+
+    def load_custodians():
+        calls.append(1)
+        return custodians
+
+    breakdown = Allocations(holdings, load_custodians)
+    breakdown.custodian_calls = calls
+
+    return breakdown
+
+
+def test_value_sum():
+    assert value_sum([1, None, 2]) == 3
+    assert value_sum([0, None]) == 0
+    assert value_sum([None, None]) is None
+    assert value_sum([]) is None
+
+
+def test_portfolio_breakdowns(allocations):
+    # share of the class without value is NULL, zero shares of currency and region are skipped
+    assert allocations.currency() == {'USD': 80.0, 'EUR': 20.0, 'GBP': None}
+    assert allocations.region() == {'EU': 75.0, 'US': 25.0}
+    assert allocations.asset_classes() == {'Equities': 80.0, 'Credit': 20.0}
+    assert allocations.custodian() == {'Bank': 75.0, 'Unknown': 25.0}
+
+
+def test_class_breakdowns(allocations):
+    assert allocations.subclass('Equities') == {'Large': 75.0, 'Small': 25.0}
+    assert allocations.subclass('Credit') == {}
+    assert allocations.asset_region('Equities') == {'EU': 75.0, 'US': 25.0}
+    assert allocations.asset_region('Large') == {'EU': 100.0}
+    assert allocations.asset_region('Credit') == {None: 100.0}
+    assert allocations.asset_currency('Credit') == {'USD': 100.0}
+    assert allocations.industry('Equities') == {'Tech': 75.0, 'Unknown': 25.0}
+    assert allocations.industry('Credit') == {'Unknown': 100.0}
+    assert allocations.credit('Credit') == {'AAA': 100.0}
+
+
+def test_class_order(allocations):
+    # class name and percentage DESC, NULLS LAST for both
+    assert [(row['asset_class'], row['rating'], row['percentage']) for row in allocations.credit()] == [
+        ('Credit', 'AAA', 100.0), ('Credit', 'BB', None), ('Equities', None, 100.0), (None, None, None)]
+
+
+def test_breakdowns_are_calculated_once(allocations):
+    first = allocations.breakdowns()
+    assert allocations.breakdowns() == first
+    assert allocations.custodian_calls == [1]
+    assert set(allocations.breakdowns('Equities')) == {'subclass', 'region', 'currency', 'industry', 'credit'}
+    assert set(allocations.results) == {'asset_classes', 'region', 'currency', 'custodians', 'custodian', 'subclass',
+                                        'asset_region', 'asset_currency', 'industry', 'credit'}
@@ -0,0 +1,60 @@
+import json
+import socket
+
+from framework.request import http_session
+from tests.benchmarks.api_latency import load_calls, replay, run
+from tests.benchmarks.fake_gateway import FakeGateway
+
+
+def write_bodies(path):
+    recorded = [{'url': 'https://wm.example/api/v1/totals', 'url_param': '', 'body': json.dumps({'portfolioId': 1})},
+                {'url': 'https://wm.example/api/v1/totals', 'url_param': '', 'body': json.dumps({'portfolioId': 2})}]
+    with open(path, 'w') as bodies_file:
+        json.dump(recorded, bodies_file)
+
+
+def closed_port():
+    with socket.socket() as free:
+        free.bind(('127.0.0.1', 0))
+        return free.getsockname()[1]
+
+
+def test_replay_counts_failed_calls(tmp_path):
+    bodies = str(tmp_path / 'bodies.json')
+    write_bodies(bodies)
+    session = http_session(pool_size=2, retries=0)
+
+    with FakeGateway(latency=0.01) as gateway:
+        calls = load_calls(bodies, gateway.url)
+        latencies, errors, rps = replay(session, dict(), calls[('totals', 1)], 3, 2)
+        assert len(latencies) == 3 and errors == 0 and rps > 0
+        assert gateway.requests == 3
+
+        # no response within the timeout
+        gateway.latency = 0.5
+        latencies, errors, _ = replay(session, dict(), calls[('totals', 2)], 2, 2, timeout=0.05)
+        assert latencies == [] and errors == 2
+
+    # nothing is listening
+    calls = load_calls(bodies, 'http://127.0.0.1:%s' % closed_port())
+    latencies, errors, _ = replay(session, dict(), calls[('totals', 1)], 2, 2, timeout=1)
+    assert latencies == [] and errors == 2
+    session.close()
+
+
+def test_run_reports_regressions(tmp_path):
+    bodies = str(tmp_path / 'bodies.json')
+    baseline = str(tmp_path / 'latency.json')
+    write_bodies(bodies)
+
+    assert run(bodies, repeat=2, concurrency=2, baseline=baseline, save=True, fake=5) == []
+    with open(baseline) as baseline_file:
+        stats = json.load(baseline_file)
+    assert sorted(stats) == ['totals|1', 'totals|2']
+    assert all(data['errors'] == 0 and data['p95'] >= 5 for data in stats.values())
+
+    # the fake gateway is 50 times slower than the baseline for one portfolio
+    stats['totals|1']['p95'] = 0.1
+    with open(baseline, 'w') as baseline_file:
+        json.dump(stats, baseline_file)
+    assert run(bodies, repeat=2, concurrency=2, baseline=baseline, fake=5, threshold=10) == ['totals|1']
@@ -0,0 +1,29 @@
+from datetime import date
+
+from framework.avg_price import AvgPrice
+
+
+def test_moving_average():
+    avg = AvgPrice()
+    assert avg.add('A', date(2020, 1, 1), 10, 100) == 100
+    assert avg.add('A', date(2020, 1, 2), 10, 120) == 110
+    # selling a long position keeps the price
+    assert avg.add('A', date(2020, 1, 3), -5, 130) == 110
+    # the position turned short is priced by the same formula as the recursive query
+    assert avg.add('A', date(2020, 1, 4), -20, 90) == (-20 * 90 + 15 * 110) / -5
+
+
+def test_price_at_date():
+    avg = AvgPrice()
+    avg.add('A', date(2020, 1, 2), 10, 100)
+    avg.add('A', date(2020, 1, 2), 10, 200)
+    avg.add('A', date(2020, 1, 5), -10, 300)
+    avg.add('B', date(2020, 1, 3), -2, 50)
+
+    # the last trade of the day wins, 0 before the first trade
+    assert avg.series() == {'A': {date(2020, 1, 2): 150, date(2020, 1, 5): 150}, 'B': {date(2020, 1, 3): 50}}
+    assert avg.at('A', date(2020, 1, 1)) == 0.0
+    assert avg.at('A', date(2020, 1, 2)) == 150
+    assert avg.at('A', date(2020, 1, 4)) == 150
+    assert avg.at('B', date(2020, 1, 10)) == 50
+    assert avg.at('C', date(2020, 1, 10)) == 0.0
@@ -0,0 +1,87 @@
+from decimal import Decimal
+from unittest import mock
+
+import numpy as np
+import psycopg2
+
+from framework.dbpostgres import DbPostgres, column_array, db_timings
+
+
+def test_numbers():
+    values = column_array([Decimal('1.5'), None, 2], 1700)
+    assert values.dtype == float
+    assert values[0] == 1.5 and np.isnan(values[1]) and values[2] == 2.0
+
+    assert list(column_array(['3', '4.25'], 701, from_text=True)) == [3.0, 4.25]
+
+
+def test_booleans():
+    assert column_array([True, False], 16).dtype == bool
+    assert list(column_array(['t', 'f'], 16, from_text=True)) == [True, False]
+    # NULL is not a boolean
+    values = column_array(['t', None], 16, from_text=True)
+    assert values.dtype == object and list(values) == [True, None]
+
+
+def test_dates():
+    days = column_array(['2020-01-31', None], 1082, from_text=True)
+    assert days.dtype == np.dtype('datetime64[D]')
+    assert days[0] == np.datetime64('2020-01-31') and np.isnat(days[1])
+
+    times = column_array(['2020-01-31 10:00:00', None], 1114, from_text=True)
+    assert times[0] == np.datetime64('2020-01-31T10:00:00') and np.isnat(times[1])
+
+
+def test_other_types_are_objects():
+    values = column_array(['AAPL', None], 1043)
+    assert values.dtype == object and list(values) == ['AAPL', None]
+
+
+class LostStatement(psycopg2.Error):
+    pgcode = '26000'
+
+
+class FakeCursor(object):
+
+    # this class keeps the prepared statements of a session, the session can be reset
+    def __init__(self):
+        self.prepared = set()
+        self.executed = list()
+
+    def execute(self, sql, params=None):
+        self.executed.append(sql.split(' ')[0])
+        if sql.startswith('PREPARE'):
+            self.prepared.add(sql.split(' ')[1])
+        elif sql.split(' ')[1] not in self.prepared:
+            raise LostStatement()
+
+    def fetchall(self):
+        return [{'value': 1}]
+
+
+def prepared_connector():
+    connector = DbPostgres.__new__(DbPostgres)
+    connector.pid = None
+    connector.connection = mock.Mock()
+    connector.cursor = FakeCursor()
+    connector.prepared = set()
+    return connector
+
+
+def test_statement_is_prepared_once():
+    connector = prepared_connector()
+    assert connector.execute_prepared('price', 'select $1', [1]) == ([{'value': 1}], False)
+    assert connector.execute_prepared('price', 'select $1', [2]) == ([{'value': 1}], True)
+    assert connector.cursor.executed == ['PREPARE', 'EXECUTE', 'EXECUTE']
+
+
+def test_lost_statement_is_prepared_again_in_one_query():
+    connector = prepared_connector()
+    connector.execute_prepared('price', 'select $1', [1])
+    connector.cursor.prepared.clear()
+    queries = db_timings['queries']
+
+    assert connector.execute_prepared('price', 'select $1', [2]) == ([{'value': 1}], False)
+    assert connector.cursor.executed == ['PREPARE', 'EXECUTE', 'EXECUTE', 'PREPARE', 'EXECUTE']
+    assert db_timings['queries'] == queries + 1
+    assert connector.prepared == {'price'}
@@ -0,0 +1,29 @@
+from datetime import date, datetime
+
+from framework.fx_rates import FxRates
+
+
+def test_rate_at_date():
+    rates = FxRates()
+    rates.add('USD', 'EUR', date(2020, 1, 1), 0.9)
+    rates.add('USD', 'EUR', datetime(2020, 1, 3, 12), 0.8)
+
+    assert rates.at('USD', 'USD', date(2019, 1, 1)) == 1
+    assert rates.at('USD', 'EUR', date(2019, 12, 31)) is None
+    assert rates.at('USD', 'GBP', date(2020, 1, 2)) is None
+    assert rates.at('USD', 'EUR', date(2020, 1, 1)) == 0.9
+    # a date is its midnight, the rate of the afternoon is valid from the next day
+    assert rates.at('USD', 'EUR', date(2020, 1, 3)) == 0.9
+    assert rates.at('USD', 'EUR', datetime(2020, 1, 3, 12)) == 0.8
+    assert rates.at('USD', 'EUR', date(2020, 1, 4)) == 0.8
+
+
+def test_added_rate_replaces_resolved_one():
+    rates = FxRates()
+    rates.add('USD', 'EUR', date(2020, 1, 1), 0.9)
+    assert rates.at('USD', 'EUR', date(2020, 1, 2)) == 0.9
+
+    rates.add('USD', 'EUR', date(2020, 1, 2), 0.7)
+    rates.add('USD', 'EUR', date(2020, 1, 2), 0.75)
+    assert rates.at('USD', 'EUR', date(2020, 1, 2)) == 0.75
+    assert rates.timestamps[('USD', 'EUR')] == [datetime(2020, 1, 1), datetime(2020, 1, 2)]
@@ -0,0 +1,67 @@
+from datetime import date
+from unittest import mock
+
+import pytest
+
+from tests.WM_API import income_engine
+from tests.WM_API.income_engine import IncomeEngine
+
+
+def payment(asset_class, instrument, pay_date, amount, exd_amount):
+    return {'asset_class': asset_class, 'instrument': instrument, 'pay_date': pay_date, 'amount': amount,
+            'exd_amount': exd_amount}
+
+
+def engine(payments, end_date=date(2020, 2, 15)):
+    with mock.patch.object(income_engine, 'db_income_payments', return_value=payments):
+        return IncomeEngine('portfolio', date(2020, 1, 1), end_date)
+
+
+@pytest.fixture
+def dividends():
+    # a payment without amount or without exchange rate is NULL in the query
+    return engine([payment('Equities', 'AAA', date(2020, 1, 10), 10, 5),
+                   payment('Equities', 'AAA', date(2020, 2, 10), None, None),
+                   payment('Equities', 'bbb', date(2020, 1, 10), 4, 2),
+                   payment('Equities', 'Ccc', date(2020, 1, 20), None, None)])
+
+
+def test_dividends(dividends):
+    assert dividends.per_instrument('Equities') == {'AAA': 10, 'bbb': 4, 'Ccc': None}
+    assert dividends.per_instrument('Equities')['unknown'] == 0
+    assert dividends.total('Equities') == 7
+    # the last month ends at the end of the period
+    assert dividends.per_period('Equities', 'Monthly') == {date(2020, 1, 31): 7, date(2020, 2, 15): None}
+    # the day of the last instrument in the month is reported for the month
+    assert dividends.per_period('Equities', 'Daily') == {date(2020, 1, 31): None, date(2020, 2, 15): None}
+
+
+def test_income_without_amounts():
+    income = engine([payment('Credit', 'Bond', date(2020, 1, 10), None, None)])
+    assert income.total('Credit') is None
+    assert income.per_period('Credit') == {date(2020, 1, 31): None}
+    assert income.total('Equities') == 0
+    assert income.per_period('Equities') == {}
+    assert income.per_instrument('Equities') == {}
+
+
+def test_cash_income():
+    cash = engine([payment('Cash and Equivalents', 'USDCash', date(2020, 1, 31), None, None),
+                   payment('Cash and Equivalents', 'USDCash', date(2020, 2, 29), 2, 1)])
+    assert cash.per_instrument('Cash and Equivalents') == {'USDCash': 2}
+    assert cash.total('Cash and Equivalents') == 1
+    assert cash.per_period('Cash and Equivalents', 'Daily') == {date(2020, 1, 31): 0, date(2020, 2, 29): 1}
+
+    # no cash in the last month
+    no_cash = engine([payment('Cash and Equivalents', 'USDCash', date(2020, 1, 31), 2, 1),
+                      payment('Cash and Equivalents', 'USDCash', date(2020, 2, 29), 0, 0)])
+    assert no_cash.total('Cash and Equivalents') == 0
+
+    never = engine([payment('Cash and Equivalents', 'USDCash', date(2020, 1, 31), None, None)])
+    assert never.per_instrument('Cash and Equivalents') == {'USDCash': 0}
+
+
+def test_breakdown(dividends):
+    assert dividends.breakdown('Equities') == 7
+    assert dividends.breakdown('Equities', interval='Monthly') == dividends.per_period('Equities', 'Monthly')
+    assert dividends.breakdown('Equities', class_data_only=False) == dividends.per_instrument('Equities')
@@ -0,0 +1,60 @@
+import json
+import threading
+
+import pytest
+
+from framework.pager import Pager, merge_groups
+
+
+class FakeRequest(object):
+
+    # this class returns pages of the items, 'last' is not sent if with_last is False
+    def __init__(self, items, with_last=True):
+        self.items = items
+        self.with_last = with_last
+        self.bodies = list()
+        self.lock = threading.Lock()
+
+    def post(self, body, url_param=None):
+        body = json.loads(body)
+        with self.lock:
+            self.bodies.append(body)
+        start = body['page'] * body['size']
+        content = self.items[start:start + body['size']]
+        page = {'content': content}
+        if self.with_last:
+            page['last'] = start + body['size'] >= len(self.items)
+
+        return page
+
+
+@pytest.mark.parametrize('prefetch', [1, 3])
+@pytest.mark.parametrize('with_last', [True, False])
+@pytest.mark.parametrize('count', [0, 4, 5, 11])
+def test_pages_in_order(prefetch, with_last, count):
+    request = FakeRequest(list(range(count)), with_last)
+    pager = Pager(request, '.list', {'portfolioId': 1}, size=5, prefetch=prefetch)
+
+    assert list(pager) == list(range(count))
+    assert all(body['portfolioId'] == 1 for body in request.bodies)
+    assert pager.pages == len(request.bodies)
+
+
+def test_one_page_at_a_time():
+    request = FakeRequest(list(range(12)))
+    pager = Pager(request, '.list', dict(), size=5, prefetch=0)
+
+    assert list(pager) == list(range(12))
+    assert [body['page'] for body in request.bodies] == [0, 1, 2]
+
+
+def test_merge_groups():
+    left = [(1, 'a'), (1, 'b'), (3, 'c')]
+    right = [{'id': 2}, {'id': 3}, {'id': 3}, {'id': 5}]
+
+    assert list(merge_groups(left, right, lambda item: item[0], lambda item: item['id'])) == [
+        (1, [(1, 'a'), (1, 'b')], []),
+        (2, [], [{'id': 2}]),
+        (3, [(3, 'c')], [{'id': 3}, {'id': 3}]),
+        (5, [], [{'id': 5}])]
+    assert list(merge_groups([], [], len, len)) == []
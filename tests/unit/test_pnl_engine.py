@@ -0,0 +1,69 @@
+from datetime import date
+from unittest import mock
+
+import numpy as np
+import pytest
+
+from tests.WM_API import pnl_engine
+from tests.WM_API.pnl_engine import PnlEngine
+
+# trade time, position date (the day the trade is in the position of), quantity, price, multiplier
+TRADES = {'A': [('2020-01-02T10:00', '2020-01-03', 10, 100, 1),
+                ('2020-01-05T00:00', '2020-01-05', -4, 120, 1)],
+          'B': [('2020-01-04T15:00', '2020-01-05', 2, 50, 10)]}
+AVG_PRICES = {'A': {date(2020, 1, 2): 100.0, date(2020, 1, 5): 100.0}, 'B': {date(2020, 1, 4): 50.0}}
+CLOSE = {'A': 110, 'B': 55}
+
+
+def trades_columns():
+    rows = [(instr,) + trade for instr, trades in sorted(TRADES.items()) for trade in trades]
+    instrument, trade_time, position_date, quantity, price, multiplier = zip(*rows)
+
+    return {'instrument': np.array(instrument, dtype=object),
+            'trade_time': np.array(trade_time, dtype='datetime64[us]'),
+            'position_date': np.array(position_date, dtype='datetime64[D]'),
+            'quantity': np.array(quantity, dtype=float), 'price': np.array(price, dtype=float),
+            'multiplier': np.array(multiplier, dtype=float)}
+
+
+def close_prices(portfolio, dates):
+    # there are no prices on 2020-01-07
+    return {dt: dict() if dt == date(2020, 1, 7) else dict(CLOSE) for dt in dates}
+
+
+@pytest.fixture
+def engine():
+    with mock.patch.object(pnl_engine, 'db_portfolio_trades_columns', return_value=trades_columns()), \
+            mock.patch.object(pnl_engine, 'db_avg_price', return_value=AVG_PRICES):
+        yield PnlEngine('portfolio', date(2020, 1, 31))
+
+
+def test_explain(engine):
+    dates = [date(2020, 1, day) for day in [2, 3, 5, 6, 7]]
+    with mock.patch.object(pnl_engine, 'db_close_price_for_dates', side_effect=close_prices):
+        explained = engine.explain(dates)
+
+    # the trade after midnight is in the position of the next day, the trade at midnight is of the same day
+    assert explained[date(2020, 1, 2)] == ({}, {})
+    assert explained[date(2020, 1, 3)] == ({'A': 100.0}, {'A': 0.0})
+    assert explained[date(2020, 1, 5)] == ({'A': 60.0, 'B': 100.0}, {'A': 0.0, 'B': 0.0})
+    # realized PnL of the Sell trade counts from the day after the trade date
+    assert explained[date(2020, 1, 6)] == ({'A': 60.0, 'B': 100.0}, {'A': 80.0, 'B': 0.0})
+    assert explained[date(2020, 1, 7)] == ({'A': 0, 'B': 0}, {'A': 80.0, 'B': 0.0})
+
+
+def test_explained_dates_are_kept(engine):
+    with mock.patch.object(pnl_engine, 'db_close_price_for_dates', side_effect=close_prices) as close:
+        engine.explain([date(2020, 1, 3), date(2020, 1, 5)])
+        explained = engine.explain([date(2020, 1, 6), date(2020, 1, 3)])
+
+    assert [call.args[1] for call in close.call_args_list] == [[date(2020, 1, 3), date(2020, 1, 5)], [date(2020, 1, 6)]]
+    assert list(explained) == [date(2020, 1, 6), date(2020, 1, 3)]
+
+
+def test_portfolio_without_trades():
+    columns = {name: values[:0] for name, values in trades_columns().items()}
+    with mock.patch.object(pnl_engine, 'db_portfolio_trades_columns', return_value=columns), \
+            mock.patch.object(pnl_engine, 'db_avg_price', return_value=dict()), \
+            mock.patch.object(pnl_engine, 'db_close_price_for_dates', side_effect=close_prices):
+        assert PnlEngine('portfolio').explain([date(2020, 1, 3)]) == {date(2020, 1, 3): ({}, {})}
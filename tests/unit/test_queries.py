@@ -0,0 +1,50 @@
+from datetime import date
+
+import pytest
+
+from framework.queries import QueryRegistry
+
+
+class FakeConnector(object):
+
+    # this class prepares a statement at the first execution like DbPostgres.execute_prepared()
+    def __init__(self):
+        self.prepared = set()
+
+    def execute_prepared(self, name, sql, params):
+        hit = name in self.prepared
+        self.prepared.add(name)
+
+        return [{'sql': sql, 'params': params}], hit
+
+
+def test_register():
+    registry = QueryRegistry()
+    assert registry.register('q', 'SELECT $1') == 'q'
+    assert registry.register('q', 'SELECT $1') == 'q'
+    with pytest.raises(ValueError):
+        registry.register('q', 'SELECT $2')
+
+
+def test_execution_counters():
+    registry = QueryRegistry()
+    registry.register('q', 'SELECT $1')
+    assert registry.stats() == {}
+    assert registry.hit_rate() == 0.0
+
+    first, second = FakeConnector(), FakeConnector()
+    assert registry.execute(first, 'q', (1,)) == [{'sql': 'SELECT $1', 'params': (1,)}]
+    registry.execute(first, 'q', (2,))
+    registry.execute(first, 'q', (3,))
+    registry.execute(second, 'q', (4,))
+
+    assert registry.stats() == {'q': {'executed': 4, 'prepared': 2, 'hits': 2}}
+    assert registry.hit_rate() == 0.5
+
+
+def test_inline():
+    registry = QueryRegistry()
+    registry.register('q', "SELECT * FROM t WHERE a = $1 AND b = $2 AND c = $1 AND d = $3")
+
+    assert registry.inline('q', ["O'Neil", 10, date(2020, 1, 31)]) == (
+        "SELECT * FROM t WHERE a = 'O''Neil' AND b = 10 AND c = 'O''Neil' AND d = '2020-01-31'::date")